@@ -0,0 +1,106 @@
+"""Utilities shared by the benchmarks: result files and regression checks.
+
+Results are saved as JSON objects with an ``environment`` entry describing the
+machine and library versions and a ``results`` list with one entry per
+benchmark case. Each case is identified by its ``name``; cases which could not
+be run have a ``skipped`` entry giving the reason.
+"""
+
+import argparse
+import datetime
+import importlib.metadata
+import json
+import platform
+import sys
+
+def environment():
+    """Information about the machine and library versions, as a dict."""
+    versions = {}
+    for package in ('verifai', 'numpy', 'scipy', 'pandas', 'scikit-learn',
+                    'GPyOpt', 'pyarrow'):
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'versions': versions,
+    }
+
+def write_results(benchmark, results, path):
+    data = {'benchmark': benchmark, 'environment': environment(),
+            'results': results}
+    if path == '-':
+        json.dump(data, sys.stdout, indent=2)
+        print()
+    else:
+        with open(path, 'w') as outfile:
+            json.dump(data, outfile, indent=2)
+
+def read_results(path):
+    with open(path) as infile:
+        return json.load(infile)
+
+def compare(results, baseline, metrics, tolerance=0.2):
+    """Find regressions with respect to a baseline.
+
+    Args:
+        results (list): new benchmark results.
+        baseline (list): results of an earlier run of the same benchmark.
+        metrics (dict): map from metric names to True if higher values are
+          better (e.g. throughput) or False if lower values are (e.g. latency).
+        tolerance (float): relative slowdown tolerated before a case counts as
+          a regression.
+
+    Returns:
+        A list of (name, metric, old value, new value) tuples.
+    """
+    old_cases = {case['name']: case for case in baseline}
+    regressions = []
+    for case in results:
+        old = old_cases.get(case['name'])
+        if old is None or 'skipped' in case or 'skipped' in old:
+            continue
+        for metric, higher_is_better in metrics.items():
+            new_value, old_value = case.get(metric), old.get(metric)
+            if new_value is None or old_value is None or old_value == 0:
+                continue
+            change = (new_value - old_value) / old_value
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append((case['name'], metric, old_value, new_value))
+    return regressions
+
+def argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-o', '--output', default='-',
+                        help='file to save results to as JSON (default stdout)')
+    parser.add_argument('--baseline',
+                        help='results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown counted as a regression (default 0.2)')
+    parser.add_argument('-k', '--select', action='append', default=[],
+                        help='only run cases whose names contain this string '
+                             '(may be repeated)')
+    return parser
+
+def selected(name, patterns):
+    return not patterns or any(pattern in name for pattern in patterns)
+
+def finish(benchmark, results, args, metrics):
+    """Save results and check them against the baseline, if any.
+
+    Returns the exit status for the benchmark script: 1 if there were
+    regressions, 0 otherwise.
+    """
+    write_results(benchmark, results, args.output)
+    if args.baseline is None:
+        return 0
+    baseline = read_results(args.baseline)['results']
+    regressions = compare(results, baseline, metrics, tolerance=args.tolerance)
+    for name, metric, old, new in regressions:
+        print(f'REGRESSION in {name}: {metric} went from {old:.4g} to {new:.4g}',
+              file=sys.stderr)
+    return 1 if regressions else 0
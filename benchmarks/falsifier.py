@@ -0,0 +1,267 @@
+"""End-to-end benchmark of falsification with a stub simulator.
+
+Runs `generic_falsifier` and `mtl_falsifier` against `StubClient`, a client
+whose "simulation" just waits for a given latency and returns a synthetic
+trajectory of a given size. The stub is either called directly by the server
+(``inprocess`` mode) or runs in a thread connected to the server over a
+loopback socket (``loopback`` mode). For each configuration, the benchmark
+reports throughput, the overhead of the framework per sample (everything
+except the stub's simulation time), memory growth, and the time taken by each
+phase of a run as recorded by `verifai.instrumentation`; the ``record`` phase
+gives the cost of adding results to the error tables and writing them out.
+Run with e.g.::
+
+    python -m benchmarks.falsifier -n 1000 100000 --tables none csv parquet
+
+Memory growth is measured from the resident set size of the process, which
+includes memory freed but not returned to the OS; use ``--trace-memory`` for
+exact (but much slower) measurements with `tracemalloc`.
+"""
+
+import contextlib
+import gc
+import itertools
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from dotmap import DotMap
+import numpy as np
+
+from verifai.features import *
+from verifai.client import Client
+from verifai.server import Server
+from verifai.falsifier import generic_falsifier, mtl_falsifier
+from verifai.monitor import specification_monitor
+from verifai.instrumentation import Instrumentation
+
+from benchmarks import common
+
+## Stub simulator
+
+class StubClient(Client):
+    """Client returning synthetic trajectories instead of running a simulator.
+
+    Args:
+        port (int): port of the server (unused in ``inprocess`` mode).
+        latency (float): seconds each simulation takes.
+        trajectory_size (int): number of time steps in each trajectory.
+        kind (str): ``'generic'`` to return trajectories as arrays, or
+          ``'mtl'`` to return them as signals for `mtl_specification`.
+    """
+    def __init__(self, port=None, latency=0, trajectory_size=100, kind='generic'):
+        super().__init__(port, 4096, persistent=True)
+        self.latency = latency
+        self.trajectory_size = trajectory_size
+        self.kind = kind
+        self.wave = 0.1 * np.sin(np.arange(trajectory_size))
+        self.simulations = 0
+        self.simulate_time = 0
+
+    def simulate(self, sample):
+        start = time.perf_counter()
+        if self.latency > 0:
+            time.sleep(self.latency)
+        trajectory = sample.x[0] + self.wave
+        if self.kind == 'mtl':
+            values = (trajectory - 0.5).tolist()
+            trajectory = {'ok': list(zip(range(len(values)), values))}
+        self.simulations += 1
+        self.simulate_time += time.perf_counter() - start
+        return trajectory
+
+    def serve(self):
+        """Run the client in a background thread until the server ends the session."""
+        def loop():
+            while self.run_client():
+                pass
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+class InProcessServer(Server):
+    """Server calling a `StubClient` directly instead of over a socket.
+
+    The stub is given as the ``stub`` server option.
+    """
+    def __init__(self, sampling_data, monitor, options={}):
+        super().__init__(sampling_data, monitor, options)
+        self.stub = options['stub']
+
+    def evaluate_sample(self, sample):
+        with self.timed('simulate'):
+            simulation_data = self.stub.simulate(sample)
+        with self.timed('monitor'):
+            value = (0 if self.monitor is None
+                     else self.monitor.evaluate(simulation_data))
+        return value
+
+    def terminate(self):
+        self.socket.close()
+
+## Benchmarking
+
+def resident_memory():
+    """Current resident set size of the process in bytes (peak if unavailable)."""
+    try:
+        with open('/proc/self/statm') as infile:
+            return int(infile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else 1024 * peak
+
+def make_falsifier(kind, mode, tables, iterations, stub, directory, streaming=True,
+                   sampler_type='random', instrumentation=None):
+    space = {'x': Box((0, 1)), 'y': Box((0, 1))}
+    params = DotMap(n_iters=iterations, streaming=streaming,
+                    save_error_table=(tables != 'none'),
+                    save_safe_table=(tables != 'none'))
+    if tables not in ('none', 'memory'):
+        params.error_table_path = os.path.join(directory, f'error.{tables}')
+        params.safe_table_path = os.path.join(directory, f'safe.{tables}')
+    options = DotMap(port=0, instrumentation=instrumentation)
+    if mode == 'inprocess':
+        options.stub = stub
+        server_class = InProcessServer
+    elif mode == 'loopback':
+        options.persistent = True
+        server_class = Server
+    else:
+        raise RuntimeError(f'unknown mode "{mode}"')
+    if kind == 'generic':
+        monitor = specification_monitor(lambda traj: float(np.min(traj)) - 0.5)
+        return generic_falsifier(sample_space=space, monitor=monitor,
+                                 sampler_type=sampler_type, falsifier_params=params,
+                                 server_options=options, server_class=server_class)
+    elif kind == 'mtl':
+        return mtl_falsifier(specification=['G(ok)'], sample_space=space,
+                             sampler_type=sampler_type, falsifier_params=params,
+                             server_options=options, server_class=server_class)
+    raise RuntimeError(f'unknown falsifier "{kind}"')
+
+def run_case(kind, mode, tables, iterations, latency=0, trajectory_size=100,
+             streaming=True, sampler_type='random', trace_memory=False):
+    """Benchmark one configuration, returning a dict of results."""
+    name = (f'{kind}/{mode}/{tables}/n={iterations}/latency={latency:g}'
+            f'/trajectory={trajectory_size}')
+    result = {'name': name, 'falsifier': kind, 'mode': mode, 'tables': tables,
+              'iterations': iterations, 'latency': latency,
+              'trajectory_size': trajectory_size, 'streaming': streaming}
+    stub = StubClient(latency=latency, trajectory_size=trajectory_size, kind=kind)
+    instrumentation = Instrumentation()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            falsifier = make_falsifier(kind, mode, tables, iterations, stub, directory,
+                                       streaming=streaming, sampler_type=sampler_type,
+                                       instrumentation=instrumentation)
+        except RuntimeError as e:     # e.g. pyarrow not installed
+            result['skipped'] = str(e)
+            return result
+        if mode == 'loopback':
+            stub.port = falsifier.server.port
+            thread = stub.serve()
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        else:
+            memory_before = resident_memory()
+        start = time.perf_counter()
+        # the client prints a message when the session ends: keep it out of
+        # the results if they are written to stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            falsifier.run_falsifier()
+            elapsed = time.perf_counter() - start
+            if mode == 'loopback':
+                thread.join(timeout=5)
+        if trace_memory:
+            memory_after = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        else:
+            memory_after = resident_memory()
+        table_bytes = sum(os.path.getsize(os.path.join(directory, name))
+                          for name in os.listdir(directory))
+    samples = falsifier.num_results
+    growth = memory_after - memory_before
+    result.update(
+        samples=samples, seconds=elapsed,
+        samples_per_sec=samples / elapsed if elapsed > 0 else None,
+        simulator_seconds=stub.simulate_time,
+        overhead_ms_per_sample=1000 * (elapsed - stub.simulate_time) / samples,
+        memory_growth_mb=growth / 2**20,
+        memory_bytes_per_sample=growth / samples,
+        table_file_bytes=table_bytes,
+    )
+    phases = {}
+    for phase, stats in instrumentation.summary().items():
+        phases[phase] = {'total_s': stats['total'], 'mean_ms': 1000 * stats['mean'],
+                         'p99_ms': 1000 * stats['p99']}
+    result['phases'] = phases
+    if 'record' in phases:
+        result['record_ms_mean'] = phases['record']['mean_ms']
+    return result
+
+def run(falsifiers=('generic', 'mtl'), modes=('inprocess', 'loopback'),
+        tables=('none', 'memory', 'csv'), iterations=(1000,), latencies=(0,),
+        trajectory_sizes=(100,), select=(), verbose=False, **options):
+    """Run all combinations of the given configurations, returning a list of results."""
+    results = []
+    for config in itertools.product(falsifiers, modes, tables, iterations,
+                                    latencies, trajectory_sizes):
+        kind, mode, table, n, latency, size = config
+        name = f'{kind}/{mode}/{table}/n={n}/latency={latency:g}/trajectory={size}'
+        if not common.selected(name, select):
+            continue
+        result = run_case(kind, mode, table, n, latency=latency,
+                          trajectory_size=size, **options)
+        if verbose:
+            if 'skipped' in result:
+                status = f'skipped ({result["skipped"]})'
+            else:
+                status = (f'{result["samples_per_sec"]:10.1f} samples/s, '
+                          f'overhead {result["overhead_ms_per_sample"]:.3f} ms/sample, '
+                          f'memory +{result["memory_growth_mb"]:.1f} MB')
+            print(f'{result["name"]:<56}{status}', file=sys.stderr)
+        results.append(result)
+    return results
+
+#: Metrics compared against baselines: True if higher is better.
+metrics = {'samples_per_sec': True, 'overhead_ms_per_sample': False,
+           'memory_bytes_per_sample': False, 'record_ms_mean': False}
+
+def main(args=None):
+    parser = common.argument_parser(__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, nargs='+', default=[1000],
+                        help='numbers of iterations to run (default 1000)')
+    parser.add_argument('--falsifier', nargs='+', default=['generic', 'mtl'],
+                        choices=['generic', 'mtl'])
+    parser.add_argument('--mode', nargs='+', default=['inprocess', 'loopback'],
+                        choices=['inprocess', 'loopback'])
+    parser.add_argument('--tables', nargs='+', default=['none', 'memory', 'csv'],
+                        choices=['none', 'memory', 'csv', 'parquet', 'arrow'],
+                        help='whether to keep error tables, and in which file '
+                             'format to write them (default none, memory, csv)')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0],
+                        help='simulation latencies in seconds (default 0)')
+    parser.add_argument('--trajectory-size', type=int, nargs='+', default=[100],
+                        help='trajectory sizes (default 100)')
+    parser.add_argument('--sampler', default='random',
+                        help='sampler type (default random)')
+    parser.add_argument('--no-streaming', dest='streaming', action='store_false',
+                        help='populate tables at the end of each run')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='measure memory with tracemalloc')
+    args = parser.parse_args(args)
+    results = run(falsifiers=args.falsifier, modes=args.mode, tables=args.tables,
+                  iterations=args.iterations, latencies=args.latency,
+                  trajectory_sizes=args.trajectory_size, select=args.select,
+                  streaming=args.streaming, sampler_type=args.sampler,
+                  trace_memory=args.trace_memory, verbose=args.output != '-')
+    return common.finish('falsifier', results, args, metrics)
+
+if __name__ == '__main__':
+    sys.exit(main())
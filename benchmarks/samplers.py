@@ -0,0 +1,188 @@
+"""Micro-benchmarks of the samplers.
+
+Measures the throughput of each kind of sampler, and the latency of generating
+a sample and of completing it (which updates active samplers with the
+feedback), over a few representative feature spaces. The feedback values are
+random, so that no simulator is involved. Run with::
+
+    python -m benchmarks.samplers -o samplers.json
+    python -m benchmarks.samplers --baseline samplers.json   # later
+
+Samplers depending on optional packages (e.g. GPyOpt for Bayesian
+optimization) are reported as skipped if those are not installed.
+"""
+
+import random
+import sys
+import time
+
+from dotmap import DotMap
+import numpy as np
+
+from verifai.features import *
+from verifai.samplers import (FeatureSampler, LateFeatureSampler, RandomSampler,
+                              SplitSampler, DistBayesOptSampler, TerminationException)
+from verifai.samplers.feature_sampler import makeRandomSampler
+from verifai.server import choose_sampler
+from verifai.instrumentation import Instrumentation
+
+from benchmarks import common
+
+## Feature spaces
+
+def spaces(dimension=50):
+    """Feature spaces to benchmark on, by name."""
+    car = Struct({
+        'position': Box((-10, 10), (-10, 10)),
+        'heading': Box((0, 2*np.pi)),
+        'model': Categorical('sedan', 'truck', 'bus'),
+    })
+    return {
+        'small_box': FeatureSpace({
+            'x': Feature(Box((0, 1), (0, 1), (0, 1))),
+        }),
+        'box': FeatureSpace({
+            'x': Feature(Box(*[(0, 1)] * dimension)),
+        }),
+        'categorical_struct': FeatureSpace({
+            'options': Feature(Struct({
+                f'c{i}': Categorical(*range(4)) for i in range(dimension // 5)
+            })),
+        }),
+        'array': FeatureSpace({
+            'grid': Feature(Array(Box((0, 1), (0, 1)), (5, dimension // 10))),
+        }),
+        'feature_lists': FeatureSpace({
+            'cars': Feature(car, lengthDomain=DiscreteBox((1, 8))),
+            'weather': Feature(Box((0, 1))),
+        }),
+    }
+
+## Samplers
+
+sa_params = DotMap(T=10, decay_rate=0.9, iterations=3, num_epoch=10)
+
+def distBOSampler(space):
+    params = DotMap(func=max, init_num=5, num_preds=2)
+    def makeDomainSampler(domain):
+        return SplitSampler.fromPredicate(
+            domain,
+            lambda d: d.standardizedDimension > 0,
+            lambda domain: DistBayesOptSampler(domain=domain, distBOparams=params),
+            makeRandomSampler)
+    return LateFeatureSampler(space, RandomSampler, makeDomainSampler)
+
+def chosen(sampler_type):
+    return lambda space: choose_sampler(space, sampler_type)[1]
+
+#: Samplers to benchmark, by name: a function creating the sampler for a
+#: space, and the relative number of samples to draw (GP-based samplers are
+#: much slower than the others).
+samplers = {
+    'random': (chosen('random'), 1),
+    'grid': (chosen('grid'), 1),
+    'halton': (chosen('halton'), 1),
+    'ce': (chosen('ce'), 1),
+    'mab': (chosen('mab'), 1),
+    'eg': (chosen('eg'), 1),
+    'bo': (chosen('bo'), 0.02),
+    'sa': (lambda space: FeatureSampler.simulatedAnnealingSamplerFor(space, sa_params), 1),
+    'dist_bo': (distBOSampler, 0.02),
+}
+
+#: Cases which cannot be run, with the reason.
+unsupported = {
+    ('grid', space): 'grid sampler enumerates the whole grid'
+    for space in ('box', 'categorical_struct', 'array', 'feature_lists')
+}
+
+def feedback(sampler_name):
+    """Function producing random feedback for a sampler."""
+    if sampler_name == 'dist_bo':
+        return lambda: [random.uniform(-1, 1), random.uniform(-1, 1)]
+    return lambda: random.uniform(-1, 1)
+
+## Benchmarking
+
+def run_case(sampler_name, space_name, space, num_samples, seed=0):
+    """Benchmark one sampler on one space, returning a dict of results."""
+    random.seed(seed)
+    np.random.seed(seed)
+    makeSampler, scale = samplers[sampler_name]
+    num_samples = max(1, int(num_samples * scale))
+    result = {'name': f'{sampler_name}/{space_name}', 'sampler': sampler_name,
+              'space': space_name}
+    reason = unsupported.get((sampler_name, space_name))
+    if reason is not None:
+        result['skipped'] = reason
+        return result
+    try:
+        start = time.perf_counter()
+        sampler = makeSampler(space)
+        result['setup_ms'] = 1000 * (time.perf_counter() - start)
+    except (RuntimeError, ModuleNotFoundError) as e:
+        result['skipped'] = str(e)
+        return result
+    makeFeedback = feedback(sampler_name)
+    timings = Instrumentation()
+    start = time.perf_counter()
+    for i in range(num_samples):
+        try:
+            with timings.phase('sample'):
+                sample = sampler.getSample()
+        except TerminationException:
+            break       # e.g. grid exhausted
+        rho = makeFeedback()
+        with timings.phase('update'):
+            sample.complete(rho)
+    elapsed = time.perf_counter() - start
+    summary = timings.summary()
+    count = summary['update']['count'] if 'update' in summary else 0
+    result.update(samples=count, seconds=elapsed,
+                  samples_per_sec=count / elapsed if elapsed > 0 else None)
+    for phase in ('sample', 'update'):
+        stats = summary.get(phase)
+        if stats is None:
+            continue
+        for statistic in ('mean', 'p50', 'p99', 'max'):
+            result[f'{phase}_ms_{statistic}'] = 1000 * stats[statistic]
+    return result
+
+def run(num_samples=1000, dimension=50, select=(), seed=0, verbose=False):
+    """Run all selected benchmark cases, returning a list of results."""
+    results = []
+    for space_name, space in spaces(dimension).items():
+        for sampler_name in samplers:
+            if not common.selected(f'{sampler_name}/{space_name}', select):
+                continue
+            result = run_case(sampler_name, space_name, space, num_samples, seed=seed)
+            if verbose:
+                if 'skipped' in result:
+                    status = f'skipped ({result["skipped"]})'
+                elif result['samples'] == 0:
+                    status = 'no samples'
+                else:
+                    status = (f'{result["samples_per_sec"]:10.1f} samples/s, '
+                              f'update p50 {result["update_ms_p50"]:.3f} ms')
+                print(f'{result["name"]:<32}{status}', file=sys.stderr)
+            results.append(result)
+    return results
+
+#: Metrics compared against baselines: True if higher is better.
+metrics = {'samples_per_sec': True, 'sample_ms_p50': False, 'update_ms_p50': False}
+
+def main(args=None):
+    parser = common.argument_parser(__doc__.split('\n')[0])
+    parser.add_argument('-n', '--num-samples', type=int, default=1000,
+                        help='samples to draw per case (default 1000; GP-based '
+                             'samplers draw 2%% of this)')
+    parser.add_argument('-d', '--dimension', type=int, default=50,
+                        help='dimension of the Box space (default 50)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+    results = run(num_samples=args.num_samples, dimension=args.dimension,
+                  select=args.select, seed=args.seed, verbose=args.output != '-')
+    return common.finish('samplers', results, args, metrics)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Cache of simulation results, to avoid rerunning the simulator on repeated points."""
+
+from collections import OrderedDict
+import hashlib
+import re
+import sqlite3
+import types
+
+import dill
+
+class ResultCache:
+    """Least-recently-used cache mapping points of a sample space to monitor values.
+
+    Pass an instance as the ``result_cache`` server option: the server then
+    looks up each sample before simulating it, and only runs the simulator
+    for points it has not seen before. Points are identified by their
+    flattened static coordinates (see `FeatureSpace.flattenStaticSample`),
+    so samples equal as `CompletedSample` objects share an entry.
+
+    Entries are kept in memory, and optionally also in an SQLite database on
+    disk so that they persist across runs. Each level evicts its least
+    recently used entries when full.
+
+    Cached values are only valid for the sample space and monitor which
+    produced them. Servers therefore `bind` the cache to a fingerprint of
+    their space and monitor (see `fingerprint`), which is saved in the
+    database; a cache holding entries for a different fingerprint is either
+    refused or cleared, depending on ``on_mismatch``. The fingerprint covers
+    the code of monitor functions, but not e.g. the simulator or data files
+    the monitor reads: if those change, pass an explicit ``fingerprint``
+    (e.g. a version number) or use a new file. Falsification thresholds are
+    applied to the cached values, so they can be changed freely.
+
+    Args:
+        max_entries (int): maximum number of entries kept in memory.
+        path (str; optional): database file for the on-disk cache.
+        max_disk_entries (int; optional): maximum number of entries kept on
+          disk (default `None`, meaning no limit).
+        fingerprint (str; optional): identifies what the cached values were
+          computed from, instead of the fingerprint given by servers.
+        on_mismatch (str): ``'error'`` (the default) to raise an error when
+          bound to a fingerprint other than the one of the existing entries,
+          or ``'clear'`` to discard those entries.
+    """
+    def __init__(self, max_entries=10000, path=None, max_disk_entries=None,
+                 fingerprint=None, on_mismatch='error'):
+        if on_mismatch not in ('error', 'clear'):
+            raise RuntimeError(f'unknown on_mismatch option "{on_mismatch}"')
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.fingerprint = fingerprint
+        self.fixed_fingerprint = fingerprint is not None
+        self.on_mismatch = on_mismatch
+        self.entries = OrderedDict()
+        self.hits = self.disk_hits = self.misses = 0
+        self._open()
+
+    def _open(self):
+        self._db = None
+        if self.path is None:
+            return
+        self._db = sqlite3.connect(self.path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                         '(key TEXT PRIMARY KEY, value BLOB, last_used INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS metadata '
+                         '(name TEXT PRIMARY KEY, value TEXT)')
+        self._db.commit()
+        self._clock = self._db.execute(
+            'SELECT COALESCE(MAX(last_used), 0) FROM results').fetchone()[0]
+        if self.fingerprint is not None:
+            self._check_disk_fingerprint()
+
+    def bind(self, fingerprint):
+        """Check that the cache holds values computed for the given fingerprint.
+
+        Called by servers with the fingerprint of their sample space and
+        monitor; does nothing if the cache was created with an explicit
+        fingerprint. If the existing entries were computed for another
+        fingerprint, raises a `RuntimeError` or clears them (see
+        ``on_mismatch``).
+        """
+        if self.fixed_fingerprint or fingerprint == self.fingerprint:
+            return
+        if self.fingerprint is not None and self.entries:
+            self._mismatch()
+        self.fingerprint = fingerprint
+        if self._db is not None:
+            self._check_disk_fingerprint()
+
+    def _check_disk_fingerprint(self):
+        row = self._db.execute("SELECT value FROM metadata WHERE name = 'fingerprint'"
+                               ).fetchone()
+        if row is not None and row[0] == self.fingerprint:
+            return
+        if row is not None or self._db.execute('SELECT COUNT(*) FROM results'
+                                               ).fetchone()[0] > 0:
+            self._mismatch()
+        self._db.execute("INSERT OR REPLACE INTO metadata VALUES ('fingerprint', ?)",
+                         (self.fingerprint,))
+        self._db.commit()
+
+    def _mismatch(self):
+        if self.on_mismatch == 'error':
+            raise RuntimeError(
+                'result cache holds values for a different sample space or monitor'
+                + ('' if self.path is None else f' (in "{self.path}")'))
+        self.clear()
+
+    def clear(self):
+        """Remove all entries from the cache (including on disk)."""
+        self.entries.clear()
+        if self._db is not None:
+            self._db.execute('DELETE FROM results')
+            self._db.execute("DELETE FROM metadata WHERE name = 'fingerprint'")
+            self._db.commit()
+
+    def get(self, key):
+        """Look up a key; returns a pair (found, value)."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key]
+        if self._db is not None:
+            disk_key = repr(key)
+            row = self._db.execute('SELECT value FROM results WHERE key = ?',
+                                   (disk_key,)).fetchone()
+            if row is not None:
+                self._clock += 1
+                self._db.execute('UPDATE results SET last_used = ? WHERE key = ?',
+                                 (self._clock, disk_key))
+                self._db.commit()
+                value = dill.loads(row[0])
+                self._remember(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        """Add an entry to the cache."""
+        self._remember(key, value)
+        if self._db is not None:
+            self._clock += 1
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                             (repr(key), dill.dumps(value), self._clock))
+            if self.max_disk_entries is not None:
+                self._db.execute(
+                    'DELETE FROM results WHERE key IN (SELECT key FROM results '
+                    'ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_disk_entries,))
+            self._db.commit()
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        """Number of entries in the cache (on disk, if there is a database)."""
+        if self._db is not None:
+            return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0
+
+    def stats(self):
+        """Statistics on cache lookups so far, as a dict."""
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'hit_rate': self.hit_rate,
+                'entries': len(self)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_db']
+        state.pop('_clock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+def fingerprint(*objects):
+    """Fingerprint of the given objects (e.g. a sample space and a monitor).
+
+    Computed from their representations, or for objects without a custom
+    representation from their types and attributes; functions are described
+    by their code, constants, closure variables and the global variables
+    they use (modules and classes only by name). Memory addresses are left
+    out, so that the fingerprint is stable across runs.
+    """
+    digest = hashlib.sha256()
+    for obj in objects:
+        digest.update(_describe(obj, set()).encode())
+    return digest.hexdigest()
+
+_address = re.compile(r' at 0x[0-9a-fA-F]+')
+
+def _describe(obj, seen):
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return repr(obj)
+    if id(obj) in seen:
+        return '<cycle>'
+    seen = seen | {id(obj)}
+    if isinstance(obj, types.MethodType):
+        return f'method({_describe(obj.__func__, seen)}, {_describe(obj.__self__, seen)})'
+    if isinstance(obj, types.FunctionType):
+        closure = tuple(cell.cell_contents for cell in obj.__closure__ or ())
+        used = {name: obj.__globals__[name] for name in sorted(_global_names(obj.__code__))
+                if name in obj.__globals__}
+        return (f'function({obj.__module__}.{obj.__qualname__}, '
+                f'{_describe(obj.__code__, seen)}, {_describe(closure, seen)}, '
+                f'{_describe(obj.__defaults__, seen)}, {_describe(used, seen)})')
+    if isinstance(obj, types.ModuleType):
+        return f'module({obj.__name__})'
+    if isinstance(obj, type):
+        return f'class({obj.__module__}.{obj.__qualname__})'
+    if isinstance(obj, types.CodeType):
+        consts = _describe(obj.co_consts, seen)
+        return f'code({obj.co_code.hex()}, {consts}, {obj.co_names})'
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        items = [_describe(item, seen) for item in obj]
+        if isinstance(obj, (set, frozenset)):
+            items.sort()
+        return f'{type(obj).__name__}({", ".join(items)})'
+    if isinstance(obj, dict):
+        items = (f'{_describe(key, seen)}: {_describe(value, seen)}'
+                 for key, value in obj.items())
+        return '{' + ', '.join(items) + '}'
+    cls = type(obj)
+    if cls.__repr__ is object.__repr__ and hasattr(obj, '__dict__'):
+        return (f'{cls.__module__}.{cls.__qualname__}'
+                f'({_describe(vars(obj), seen)})')
+    return _address.sub('', repr(obj))
+
+def _global_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
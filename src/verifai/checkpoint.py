@@ -0,0 +1,77 @@
+"""Storage for checkpoints of falsification runs.
+
+A checkpoint is a directory holding a base file, with the configuration of the
+falsifier, and a sequence of numbered delta files, each recording what changed
+since the previous one: new results, new table rows, counters, and the current
+sampler. Every file is written atomically, so a crash while checkpointing
+leaves the previous checkpoint intact.
+
+See `verifai.falsifier.resume_falsifier` for resuming a run.
+"""
+
+import os
+
+import dill
+
+_BASE = 'base.pkl'
+_DELTA = 'delta-{:08d}.pkl'
+
+def atomic_dump(obj, path):
+    """Pickle an object to a file, replacing any existing file atomically."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as outfile:
+        dill.dump(obj, outfile)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temp_path, path)
+
+class Checkpointer:
+    """Reads and writes the files of a checkpoint directory.
+
+    Args:
+        path (str): checkpoint directory (created if necessary).
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        deltas = self.delta_numbers()
+        self.next_delta = deltas[-1] + 1 if deltas else 0
+
+    def delta_numbers(self):
+        numbers = []
+        for name in os.listdir(self.path):
+            if name.startswith('delta-') and name.endswith('.pkl'):
+                numbers.append(int(name[len('delta-'):-len('.pkl')]))
+        return sorted(numbers)
+
+    @property
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, _BASE))
+
+    def clear(self):
+        """Delete any existing checkpoint in the directory."""
+        for number in self.delta_numbers():
+            os.remove(os.path.join(self.path, _DELTA.format(number)))
+        base = os.path.join(self.path, _BASE)
+        if os.path.exists(base):
+            os.remove(base)
+        self.next_delta = 0
+
+    def write_base(self, state):
+        atomic_dump(state, os.path.join(self.path, _BASE))
+
+    def write_delta(self, delta):
+        atomic_dump(delta, os.path.join(self.path, _DELTA.format(self.next_delta)))
+        self.next_delta += 1
+
+    def read_base(self):
+        if not self.exists:
+            raise RuntimeError(f'no checkpoint found in "{self.path}"')
+        with open(os.path.join(self.path, _BASE), 'rb') as infile:
+            return dill.load(infile)
+
+    def read_deltas(self):
+        """Iterate over the deltas in order, loading one at a time."""
+        for number in self.delta_numbers():
+            with open(os.path.join(self.path, _DELTA.format(number)), 'rb') as infile:
+                yield dill.load(infile)
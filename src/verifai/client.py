@@ -1,17 +1,32 @@
 from abc import ABC, abstractmethod
+import asyncio
+import inspect
 import socket
 import dill
 
+from verifai.protocol import send_message, receive_message, write_message, read_message
+from verifai.codec import DillCodec, hello_message, codec_from_reply, default_codecs
+
 
 class Client(ABC):
     """Generic client for running simulations based on samples from the server.
 
     Users must implement the abstract method `simulate` to run a simulation.
+
+    If ``persistent`` is True, the client keeps a single connection open to the
+    server and each call to `run_client` handles one sample over it; the server
+    must be started with the ``persistent`` option as well. Persistent clients
+    agree with the server on a codec (see `verifai.codec`) from those named in
+    ``codecs``.
     """
 
-    def __init__(self, port, bufsize):
+    def __init__(self, port, bufsize, persistent=False, codecs=default_codecs):
         self.port = port
         self.bufsize = bufsize
+        self.persistent = persistent
+        self.codecs = codecs
+        self.codec = DillCodec()
+        self.socket = None
 
     def initialize(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -24,9 +39,24 @@ class Client(ABC):
         except OSError as e:
             self.close()
             raise RuntimeError('unable to connect to server') from e
+        if self.persistent:
+            try:
+                send_message(self.socket, hello_message(self.codecs))
+                self.codec = codec_from_reply(receive_message(self.socket))
+            except OSError:
+                self.close()
+                return False
         return True
 
     def receive(self):
+        if self.persistent:
+            try:
+                msg = receive_message(self.socket)
+            except OSError:
+                return False, None
+            if msg is None:
+                return False, None
+            return True, self.codec.decode(msg)
         data = []
         try:
             while True:
@@ -40,14 +70,22 @@ class Client(ABC):
         return True, data
 
     def send(self, data):
-        msg = dill.dumps(data)
-        self.socket.send(msg)
-        self.socket.shutdown(socket.SHUT_WR)
+        if self.persistent:
+            send_message(self.socket, self.codec.encode(data))
+        else:
+            msg = dill.dumps(data)
+            self.socket.send(msg)
+            self.socket.shutdown(socket.SHUT_WR)
 
     def close(self):
-        self.socket.close()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        self.codec.close()
 
     def run_client(self):
+        if self.persistent:
+            return self.run_session_step()
         success = self.initialize()
         try:
             if success:
@@ -61,6 +99,27 @@ class Client(ABC):
         finally:
             self.close()
 
+    def run_session_step(self):
+        """Handle one sample over a persistent connection, opening it if needed.
+
+        Returns False once the server ends the session.
+        """
+        if self.socket is None and not self.initialize():
+            print("No new sample received from server.")
+            return False
+        success, sample = self.receive()
+        if not success:
+            print("No new sample received from server.")
+            self.close()
+            return False
+        sim = self.simulate(sample)
+        try:
+            self.send(sim)
+        except OSError:     # server ended the session while we were simulating
+            self.close()
+            return False
+        return True
+
     @abstractmethod
     def simulate(self, sample):
         """Run a simulation from the given sample.
@@ -70,3 +129,52 @@ class Client(ABC):
             passed to the monitor.
         """
         pass
+
+
+class AsyncClient(ABC):
+    """Client running simulations inside an asyncio event loop.
+
+    Connects once to an `AsyncServer` (or a persistent `Server`) and handles
+    samples until the server ends the session. Users implement `simulate`,
+    which may be either an ordinary method or a coroutine.
+    """
+
+    def __init__(self, port, host='127.0.0.1', codecs=default_codecs):
+        self.port = port
+        self.host = host
+        self.codecs = codecs
+
+    async def run(self):
+        """Handle samples until the server ends the session."""
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        codec = DillCodec()
+        try:
+            await write_message(writer, hello_message(self.codecs))
+            codec = codec_from_reply(await read_message(reader))
+            while True:
+                try:
+                    msg = await read_message(reader)
+                except OSError:
+                    break
+                if msg is None:
+                    break
+                sim = self.simulate(codec.decode(msg))
+                if inspect.isawaitable(sim):
+                    sim = await sim
+                try:
+                    await write_message(writer, codec.encode(sim))
+                except OSError:     # server ended the session while we were simulating
+                    break
+        finally:
+            writer.close()
+            codec.close()
+
+    @abstractmethod
+    def simulate(self, sample):
+        """Run a simulation from the given sample.
+
+        Returns:
+            The outcome of the simulation, to be passed to the monitor; may
+            also return an awaitable producing it.
+        """
+        pass
@@ -0,0 +1,477 @@
+"""Codecs for encoding samples and simulation results sent between server and client.
+
+`DillCodec` pickles everything with dill, and is always available. `BinaryCodec`
+uses a compact tagged format: numeric NumPy arrays are sent as raw buffers
+behind a small header (without being copied), sequences of floats (and
+sequences of equal-length rows of floats) are packed as arrays, and samples
+are sent as their flattened coordinates. Objects it cannot represent are
+pickled with dill individually, so any data dill can handle can still be
+sent.
+
+Persistent clients negotiate a codec when they connect: the client sends the
+names of the codecs it supports (see `hello_message`), and the server replies
+with its choice (see `CodecNegotiator`). The reply to a client choosing the
+binary codec includes the server's `FeatureSpace`, so that samples can be
+rebuilt from their coordinates.
+
+Clients on the same host as the server may also use `SharedMemoryCodec`,
+which passes large arrays through shared memory instead of the socket. It is
+not used unless requested, by including ``'shm'`` in the ``codecs`` server
+option and client argument.
+"""
+
+from abc import ABC, abstractmethod
+import struct
+
+from multiprocessing import shared_memory, resource_tracker
+
+import dill
+import numpy as np
+
+class Codec(ABC):
+    """Abstract codec, converting objects to and from messages."""
+    name = None
+    #: whether decoded objects may refer to memory reused by later messages
+    zero_copy = False
+
+    @abstractmethod
+    def encode(self, obj):
+        """Encode an object as a bytes-like object or a list of them."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def decode(self, data):
+        """Decode an object from a bytes-like object."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the codec."""
+        pass
+
+class DillCodec(Codec):
+    name = 'dill'
+
+    def encode(self, obj):
+        return dill.dumps(obj)
+
+    def decode(self, data):
+        return dill.loads(data)
+
+_u8 = struct.Struct('!B')
+_u32 = struct.Struct('!I')
+_u64 = struct.Struct('!Q')
+_i64 = struct.Struct('!q')
+_f64 = struct.Struct('!d')
+
+# arrays at least this large are sent as separate buffers rather than copied
+_SEPARATE_BUFFER_SIZE = 1 << 16
+
+_NONE, _TRUE, _FALSE = b'N', b'T', b'F'
+_INT, _FLOAT, _STR, _BYTES = b'i', b'd', b's', b'b'
+_LIST, _TUPLE, _DICT = b'l', b't', b'm'
+_FLOAT_LIST, _FLOAT_TUPLE, _FLOAT_ROWS = b'v', b'w', b'r'
+_ARRAY, _SCALAR = b'a', b'g'
+_SAMPLE, _PICKLED = b'S', b'P'
+_INLINE, _SHARED = b'I', b'M'
+
+class BinaryCodec(Codec):
+    """Compact binary codec.
+
+    Args:
+        space (`FeatureSpace`; optional): if given, static samples from this
+            space are encoded as their flattened coordinates.
+    """
+    name = 'binary'
+
+    def __init__(self, space=None):
+        self.space = space
+        self.point_type = None if space is None else space.makeStaticPoint
+
+    def encode(self, obj):
+        chunks = [bytearray()]
+        self._encode_onto(obj, chunks)
+        return chunks
+
+    def decode(self, data):
+        view = memoryview(data).cast('B')
+        obj, offset = self._decode_from(view, 0)
+        if offset != len(view):
+            raise ValueError('trailing data after encoded object')
+        return obj
+
+    def _encode_onto(self, obj, chunks):
+        out = chunks[-1]
+        obj_type = type(obj)
+        if obj is None:
+            out += _NONE
+        elif obj_type is bool:
+            out += _TRUE if obj else _FALSE
+        elif obj_type is int and -2**63 <= obj < 2**63:
+            out += _INT
+            out += _i64.pack(obj)
+        elif obj_type is float:
+            out += _FLOAT
+            out += _f64.pack(obj)
+        elif obj_type is str:
+            data = obj.encode('utf-8')
+            out += _STR
+            out += _u32.pack(len(data))
+            out += data
+        elif obj_type is bytes:
+            out += _BYTES
+            out += _u32.pack(len(obj))
+            out += obj
+        elif obj_type is list or obj_type is tuple:
+            if _is_float_sequence(obj):
+                out += _FLOAT_LIST if obj_type is list else _FLOAT_TUPLE
+                out += _u32.pack(len(obj))
+                out += struct.pack(f'!{len(obj)}d', *obj)
+            elif _is_float_rows(obj):
+                # e.g. a trajectory given as a list of position tuples
+                flags = (obj_type is tuple) | ((type(obj[0]) is tuple) << 1)
+                width = len(obj[0])
+                out += _FLOAT_ROWS
+                out += _u8.pack(flags)
+                out += _u32.pack(len(obj))
+                out += _u32.pack(width)
+                out += struct.pack(f'!{len(obj) * width}d',
+                                   *(x for row in obj for x in row))
+            else:
+                out += _LIST if obj_type is list else _TUPLE
+                out += _u32.pack(len(obj))
+                for item in obj:
+                    self._encode_onto(item, chunks)
+        elif obj_type is dict:
+            out += _DICT
+            out += _u32.pack(len(obj))
+            for key, value in obj.items():
+                self._encode_onto(key, chunks)
+                self._encode_onto(value, chunks)
+        elif obj_type is np.ndarray and obj.dtype.kind in 'biufc':
+            out += _ARRAY
+            self._encode_array_onto(obj, chunks)
+        elif isinstance(obj, np.generic) and obj.dtype.kind in 'biufc':
+            out += _SCALAR
+            self._encode_array_onto(np.asarray(obj), chunks)
+        elif obj_type is self.point_type and self.point_type is not None:
+            out += _SAMPLE
+            self._encode_onto(list(self.space.flattenStaticSample(obj)), chunks)
+        else:
+            data = dill.dumps(obj)
+            out += _PICKLED
+            out += _u32.pack(len(data))
+            out += data
+
+    def _encode_array_onto(self, array, chunks):
+        out = chunks[-1]
+        if not array.flags.c_contiguous:
+            array = array.copy(order='C')
+        dtype = array.dtype.str.encode('ascii')
+        out += _u8.pack(len(dtype))
+        out += dtype
+        out += _u8.pack(array.ndim)
+        for length in array.shape:
+            out += _u64.pack(length)
+        self._encode_array_data_onto(memoryview(array.reshape(-1).view(np.uint8)), chunks)
+
+    def _encode_array_data_onto(self, data, chunks):
+        out = chunks[-1]
+        out += _INLINE
+        if len(data) >= _SEPARATE_BUFFER_SIZE:
+            chunks.append(data)
+            chunks.append(bytearray())
+        else:
+            out += data
+
+    def _decode_from(self, view, offset):
+        tag = bytes(view[offset:offset+1])
+        offset += 1
+        if tag == _NONE:
+            return None, offset
+        elif tag == _TRUE:
+            return True, offset
+        elif tag == _FALSE:
+            return False, offset
+        elif tag == _INT:
+            return _i64.unpack_from(view, offset)[0], offset + 8
+        elif tag == _FLOAT:
+            return _f64.unpack_from(view, offset)[0], offset + 8
+        elif tag == _STR or tag == _BYTES or tag == _PICKLED:
+            length = _u32.unpack_from(view, offset)[0]
+            offset += 4
+            data = view[offset:offset+length]
+            if tag == _STR:
+                obj = str(data, 'utf-8')
+            elif tag == _BYTES:
+                obj = bytes(data)
+            else:
+                obj = dill.loads(data)
+            return obj, offset + length
+        elif tag == _LIST or tag == _TUPLE:
+            length = _u32.unpack_from(view, offset)[0]
+            offset += 4
+            items = []
+            for i in range(length):
+                item, offset = self._decode_from(view, offset)
+                items.append(item)
+            return (items if tag == _LIST else tuple(items)), offset
+        elif tag == _FLOAT_LIST or tag == _FLOAT_TUPLE:
+            length = _u32.unpack_from(view, offset)[0]
+            offset += 4
+            items = struct.unpack_from(f'!{length}d', view, offset)
+            return (list(items) if tag == _FLOAT_LIST else items), offset + 8*length
+        elif tag == _FLOAT_ROWS:
+            flags = _u8.unpack_from(view, offset)[0]
+            length = _u32.unpack_from(view, offset + 1)[0]
+            width = _u32.unpack_from(view, offset + 5)[0]
+            offset += 9
+            size = length * width
+            items = struct.unpack_from(f'!{size}d', view, offset)
+            rows = [items[i:i+width] for i in range(0, size, width)]
+            if not flags & 2:
+                rows = [list(row) for row in rows]
+            return (tuple(rows) if flags & 1 else rows), offset + 8*size
+        elif tag == _DICT:
+            length = _u32.unpack_from(view, offset)[0]
+            offset += 4
+            obj = {}
+            for i in range(length):
+                key, offset = self._decode_from(view, offset)
+                obj[key], offset = self._decode_from(view, offset)
+            return obj, offset
+        elif tag == _ARRAY or tag == _SCALAR:
+            array, offset = self._decode_array_from(view, offset)
+            return (array if tag == _ARRAY else array[()]), offset
+        elif tag == _SAMPLE:
+            if self.space is None:
+                raise ValueError('received a sample but no FeatureSpace is known')
+            coords, offset = self._decode_from(view, offset)
+            return self.space.unflattenStaticSample(coords), offset
+        else:
+            raise ValueError(f'unknown tag {tag!r} in encoded data')
+
+    def _decode_array_from(self, view, offset):
+        length = _u8.unpack_from(view, offset)[0]
+        offset += 1
+        dtype = np.dtype(str(view[offset:offset+length], 'ascii'))
+        offset += length
+        ndim = _u8.unpack_from(view, offset)[0]
+        offset += 1
+        shape = tuple(_u64.unpack_from(view, offset + 8*i)[0] for i in range(ndim))
+        offset += 8*ndim
+        count = int(np.prod(shape, dtype=np.int64))
+        array, offset = self._decode_array_data_from(view, offset, dtype, count)
+        return array.reshape(shape), offset
+
+    def _decode_array_data_from(self, view, offset, dtype, count):
+        storage = bytes(view[offset:offset+1])
+        if storage != _INLINE:
+            raise ValueError('array data is not part of the message')
+        offset += 1
+        array = np.frombuffer(view, dtype=dtype, count=count, offset=offset)
+        if view.readonly:   # don't hand out arrays which can't be written
+            array = array.copy()
+        return array, offset + array.nbytes
+
+class SharedMemoryCodec(BinaryCodec):
+    """Binary codec passing large arrays through shared memory.
+
+    For clients running on the same host as the server. Each sender writes the
+    data of large arrays into a shared memory segment it owns, and the message
+    only holds the name of the segment and the offset of the data. Arrays are
+    decoded as views into the segment, without copying them.
+
+    Since each client has at most one message outstanding, the sender reuses
+    its segment for every message (growing it if necessary). The arrays in a
+    message are therefore only valid until the sender's next message: a
+    monitor which keeps them around after evaluation must copy them.
+
+    Args:
+        space (`FeatureSpace`; optional): as for `BinaryCodec`.
+        size (int): initial size of the shared memory segment, in bytes.
+        threshold (int): arrays with fewer bytes than this are sent inline.
+    """
+    name = 'shm'
+    zero_copy = True
+
+    def __init__(self, space=None, size=1 << 24, threshold=1 << 12):
+        super().__init__(space)
+        self.size = size
+        self.threshold = threshold
+        self.segment = None
+        self.retired = []
+        self.position = 0
+        self.attached = {}
+
+    def encode(self, obj):
+        # the previous message has been consumed, so its space can be reused
+        self.position = 0
+        for segment in self.retired:
+            _destroy(segment)
+        self.retired = []
+        return super().encode(obj)
+
+    def _encode_array_data_onto(self, data, chunks):
+        size = len(data)
+        if size < self.threshold:
+            super()._encode_array_data_onto(data, chunks)
+            return
+        if self.segment is None or self.position + size > self.segment.size:
+            if self.segment is not None:
+                self.retired.append(self.segment)
+            self.size = max(self.size, 2 * size)
+            self.segment = _Segment(create=True, size=self.size)
+            _created_segments.add(self.segment.name)
+            self.position = 0
+        self.segment.buf[self.position:self.position+size] = data
+        name = self.segment.name.encode('ascii')
+        out = chunks[-1]
+        out += _SHARED
+        out += _u8.pack(len(name))
+        out += name
+        out += _u64.pack(self.position)
+        self.position += size
+
+    def _decode_array_data_from(self, view, offset, dtype, count):
+        storage = bytes(view[offset:offset+1])
+        if storage != _SHARED:
+            return super()._decode_array_data_from(view, offset, dtype, count)
+        length = _u8.unpack_from(view, offset + 1)[0]
+        offset += 2
+        name = str(view[offset:offset+length], 'ascii')
+        offset += length
+        position = _u64.unpack_from(view, offset)[0]
+        segment = self.attached.get(name)
+        if segment is None:
+            # the sender has moved on to a new segment, so drop the old ones
+            self._detach()
+            segment = self.attached[name] = _attach(name)
+        array = np.frombuffer(segment.buf, dtype=dtype, count=count, offset=position)
+        return array, offset + 8
+
+    def _detach(self):
+        for segment in self.attached.values():
+            segment.close()
+        self.attached = {}
+
+    def close(self):
+        self._detach()
+        for segment in self.retired + [self.segment]:
+            if segment is not None:
+                _destroy(segment)
+        self.segment = None
+        self.retired = []
+
+class _Segment(shared_memory.SharedMemory):
+    def close(self):
+        # If arrays still refer to the segment, its memory is unmapped once
+        # they are all gone.
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+# names of shared memory segments created by this process
+_created_segments = set()
+
+def _attach(name):
+    segment = _Segment(name=name)
+    # Only the creator of a segment should unlink it; before Python 3.13,
+    # attaching also registers the segment with this process's resource
+    # tracker, which would unlink it when we exit.
+    if name not in _created_segments and hasattr(resource_tracker, 'unregister'):
+        resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+def _destroy(segment):
+    segment.close()
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+    _created_segments.discard(segment.name)
+
+def _is_float_sequence(obj):
+    return len(obj) > 1 and all(isinstance(x, float) for x in obj)
+
+def _is_float_rows(obj):
+    if len(obj) < 2:
+        return False
+    row_type = type(obj[0])
+    if row_type is not tuple and row_type is not list:
+        return False
+    width = len(obj[0])
+    return width > 0 and all(type(row) is row_type and len(row) == width
+                             and all(isinstance(x, float) for x in row)
+                             for row in obj)
+
+#: Codecs available by name.
+codecs = {
+    SharedMemoryCodec.name: SharedMemoryCodec,
+    BinaryCodec.name: BinaryCodec,
+    DillCodec.name: DillCodec,
+}
+
+#: Codec names in the default order of preference.
+default_codecs = (BinaryCodec.name, DillCodec.name)
+
+_HELLO = b'verifai-codecs:'
+
+def hello_message(names=default_codecs):
+    """Message sent by a client on connecting, listing the codecs it supports."""
+    return _HELLO + ','.join(names).encode('ascii')
+
+def codec_from_reply(reply):
+    """Build the codec chosen by the server from its reply to `hello_message`."""
+    if reply is None:
+        raise ConnectionError('server did not choose a codec')
+    name, _, payload = bytes(reply).partition(b'\n')
+    name = name.decode('ascii')
+    if name not in codecs:
+        raise RuntimeError(f'server chose unknown codec "{name}"')
+    if issubclass(codecs[name], BinaryCodec):
+        space = dill.loads(payload) if payload else None
+        return codecs[name](space)
+    return codecs[name]()
+
+class CodecNegotiator:
+    """Server side of codec negotiation.
+
+    Args:
+        preferences (tuple): names of codecs the server accepts, in order of
+            preference; dill is always accepted as a last resort.
+        space (`FeatureSpace`): space of the samples being sent.
+    """
+    def __init__(self, preferences=default_codecs, space=None):
+        self.preferences = tuple(preferences)
+        self.space = space
+        self._space_payload = None
+
+    def accept(self, hello):
+        """Choose a codec given a client's hello message.
+
+        Returns:
+            A pair consisting of the codec to use and the reply to send.
+        """
+        if hello is None or not bytes(hello).startswith(_HELLO):
+            raise ConnectionError('client did not negotiate a codec')
+        offered = bytes(hello)[len(_HELLO):].decode('ascii').split(',')
+        for name in self.preferences + (DillCodec.name,):
+            if name in offered and name in codecs:
+                break
+        else:
+            raise ConnectionError('no codec supported by both client and server')
+        if not issubclass(codecs[name], BinaryCodec):
+            return codecs[name](), name.encode('ascii')
+        payload = self.space_payload
+        space = self.space if payload else None
+        return codecs[name](space), name.encode('ascii') + b'\n' + payload
+
+    @property
+    def space_payload(self):
+        if self._space_payload is None:
+            try:
+                self._space_payload = dill.dumps(self.space) if self.space is not None else b''
+            except Exception:   # space can't be sent; fall back to pickling samples
+                self._space_payload = b''
+        return self._space_payload
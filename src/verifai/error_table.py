@@ -1,12 +1,63 @@
 # This files defiens the error table as a panda object
 import pandas as pd
 import numpy as np
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.neighbors import NearestNeighbors
 from dotmap import DotMap
 from collections import defaultdict
 from kmodes.kmodes import KModes
 
+class _column_buffer():
+    """Growable typed buffer holding one column of an error table.
+
+    Numerical columns are stored as float64 (with NaN for missing values) and
+    others as objects. Rows before the column was created are NaN, as they
+    would be after concatenating DataFrames.
+    """
+    def __init__(self, numerical, length=0, capacity=64):
+        dtype = np.float64 if numerical else object
+        self.data = np.full(max(capacity, 2*length), np.nan, dtype=dtype)
+        self.length = length
+
+    @classmethod
+    def from_values(cls, values, numerical):
+        column = cls(numerical and values.dtype.kind in 'biuf', length=len(values))
+        column.data[:len(values)] = values
+        return column
+
+    def append(self, value):
+        if self.length == len(self.data):
+            data = np.full(2*len(self.data), np.nan, dtype=self.data.dtype)
+            data[:self.length] = self.data
+            self.data = data
+        try:
+            self.data[self.length] = value
+        except (TypeError, ValueError):     # value not numerical after all
+            self.make_categorical()
+            self.data[self.length] = value
+        self.length += 1
+
+    def extend(self, values):
+        end = self.length + len(values)
+        if end > len(self.data):
+            data = np.full(max(2*len(self.data), end), np.nan, dtype=self.data.dtype)
+            data[:self.length] = self.data[:self.length]
+            self.data = data
+        try:
+            self.data[self.length:end] = values
+        except (TypeError, ValueError):
+            self.make_categorical()
+            self.data[self.length:end] = values
+        self.length = end
+
+    def make_categorical(self):
+        if self.data.dtype != object:
+            self.data = self.data.astype(object)
+
+    def values(self, start=0):
+        return self.data[start:self.length]
+
 class error_table():
     def __init__(self, space=None, table=None, column_type = None):
         assert space is not None or table is not None
@@ -14,57 +65,151 @@ class error_table():
             self.space= space
             self.column_names = []
             self.column_type = {}
-            for i in range(space.fixedFlattenedDimension):
-                self.column_names.append(space.meaningOfFlatCoordinate(i))
-                self.column_type[space.meaningOfFlatCoordinate(i)] = \
-                    space.coordinateIsNumerical(i)
+            for coordinate in space.flatLayout:
+                name = coordinate.meaning()
+                self.column_names.append(name)
+                self.column_type[name] = coordinate.isNumerical
             self.column_names.append("rho")
             self.column_type["rho"] = True # Set to numerical by default. Can be updated later.
-            self.table = pd.DataFrame(columns=self.column_names)
-            self.ignore_locs = []
+            self._columns = {name: _column_buffer(self.column_type[name])
+                             for name in self.column_names}
+            self._num_rows = 0
+            self._table = None
+            self._ignore_locs = set()
+            self.online = None
         else:
-            self.table = table
-            self.column_names = table.columns
             if column_type is None:
-                self.column_type = {col:True for col in self.column_names}
+                self.column_type = {col:True for col in table.columns}
             else:
                 self.column_type = column_type
-            self.ignore_locs = []
-
-
+            self.table = table
+            self._ignore_locs = set()
+
+    @property
+    def table(self):
+        """The table as a DataFrame, built from the column buffers when needed."""
+        if self._table is None:
+            data = {name: self._columns[name].values() for name in self.column_names}
+            self._table = pd.DataFrame(data, columns=self.column_names).infer_objects()
+        return self._table
+
+    @table.setter
+    def table(self, table):
+        self.column_names = list(table.columns)
+        self._columns = None    # built from the DataFrame if rows are added
+        self._num_rows = len(table)
+        self._table = table
+        self.online = None
+
+    def _buffers(self):
+        if self._columns is None:
+            self._columns = {
+                name: _column_buffer.from_values(self._table[name].to_numpy(),
+                                                 self.column_type.get(name, True))
+                for name in self.column_names
+            }
+        return self._columns
+
+    @property
+    def num_rows(self):
+        return self._num_rows
+
+    @property
+    def ignore_locs(self):
+        return sorted(self._ignore_locs)
+
+    @ignore_locs.setter
+    def ignore_locs(self, locs):
+        self._ignore_locs = set(locs)
+
+    def tail(self, n=1):
+        """Return the last n rows as a DataFrame, without building the whole table."""
+        start = max(0, self._num_rows - n)
+        if self._columns is None:
+            return self._table.iloc[start:]
+        data = {name: self._columns[name].values(start) for name in self.column_names}
+        index = pd.RangeIndex(start, self._num_rows)
+        return pd.DataFrame(data, columns=self.column_names, index=index).infer_objects()
 
     def update_column_names(self, column_names):
-        assert len(self.table.columns) == len(column_names)
-        self.table.columns = column_names
-        self.column_names = column_names
+        assert len(self.column_names) == len(column_names)
+        if self._columns is not None:
+            self._columns = {new: self._columns[old]
+                             for old, new in zip(self.column_names, column_names)}
+        self.column_type = {new: self.column_type.get(old, True)
+                            for old, new in zip(self.column_names, column_names)}
+        self.column_names = list(column_names)
+        if self._table is not None:
+            self._table.columns = column_names
 
     def update_error_table(self, sample, rho):
         sample = self.space.flatten(sample, fixedDimension=True)
-        sample_dict = {}
-        for k, v in zip(self.table.columns, list(sample)):
-            if np.any(np.array(sample) == None):
-                locs = np.where(np.array(sample) == None)
-                self.ignore_locs = self.ignore_locs + list(locs[0])
-            sample_dict[k] = float(v) if self.column_type[k] and v is not None else v
+        columns = self._buffers()
+        row = {}
+        for k, v in zip(self.column_names, sample):
+            if v is None:
+                self._ignore_locs.add(len(row))
+            row[k] = float(v) if self.column_type[k] and v is not None else v
         if isinstance(rho, (list, tuple)):
             for i,r in enumerate(rho[:-1]):
-                if "rho_" + str(i) not in self.column_names:
-                    self.column_names.append("rho_"+str(i))
-                    if isinstance(r, bool):
-                        self.column_type["rho_" + str(i)] = False
-                    else:
-                        self.column_type["rho_" + str(i)] = True
-                sample_dict["rho_"+str(i)]  = r
-            sample_dict["rho"] = rho[-1]
-            if isinstance(rho[-1], bool) and self.column_type["rho"]:
-                self.column_type["rho"] = False
+                name = "rho_" + str(i)
+                if name not in columns:
+                    self.column_names.append(name)
+                    self.column_type[name] = not isinstance(r, bool)
+                    columns[name] = _column_buffer(self.column_type[name],
+                                                         length=self._num_rows)
+                row[name] = r
+            row["rho"] = rho[-1]
         else:
-            sample_dict["rho"] = rho
-            if isinstance(rho, bool) and self.column_type["rho"]:
-                self.column_type["rho"] = False
-        self.ignore_locs = list(set(tuple(self.ignore_locs)))
-        new_row = pd.DataFrame(sample_dict, index=[0])
-        self.table = pd.concat([self.table, new_row], ignore_index=True)
+            row["rho"] = rho
+        if isinstance(row["rho"], bool) and self.column_type["rho"]:
+            self.column_type["rho"] = False
+            columns["rho"].make_categorical()
+        for name, column in columns.items():
+            column.append(row.get(name, np.nan))
+        self._num_rows += 1
+        self._table = None
+        if self.online is not None:
+            self.online.update()
+
+    def append_rows(self, rows):
+        """Append the rows of a DataFrame, e.g. saved from another table.
+
+        Columns missing from the DataFrame are filled with NaN, and new ones
+        are added to the table.
+        """
+        columns = self._buffers()
+        for name in rows.columns:
+            if name not in columns:
+                self.column_names.append(name)
+                self.column_type.setdefault(name, True)
+                columns[name] = _column_buffer(self.column_type[name],
+                                               length=self._num_rows)
+        for name, column in columns.items():
+            if not self.column_type.get(name, True):
+                column.make_categorical()
+            if name in rows.columns:
+                column.extend(rows[name].to_numpy())
+            else:
+                column.extend(np.full(len(rows), np.nan))
+        self._num_rows += len(rows)
+        self._table = None
+        if self.online is not None:
+            self.online.update()
+
+    def enable_online_analysis(self, column_names=None, k=4, n_components=1,
+                               batch_size=100):
+        """Start updating an `online_analysis` of the table as rows are added.
+
+        The analysis is available as the ``online`` attribute; see
+        `online_analysis` for the arguments. Rows already in the table are
+        included.
+        """
+        self.online = online_analysis(self, column_names=column_names, k=k,
+                                      n_components=n_components,
+                                      batch_size=batch_size)
+        self.online.update()
+        return self.online
 
 
     def get_column_by_index(self, index):
@@ -139,7 +284,7 @@ class error_table():
             return pd.DataFrame(), pd.DataFrame()
 
         # Normalize tables (only for numerical table)
-        stats = numerical.describe()
+        stats = self._describe(numerical)
 
         normalized_dict = {r: (numerical[r] - stats[r]['min']) / (stats[r]['max'] - stats[r]['min'])
                          for r in numerical.columns}
@@ -162,7 +307,7 @@ class error_table():
             return pd.DataFrame(), pd.DataFrame()
 
         # Normalize tables (only for numerical table)
-        stats = numerical.describe()
+        stats = self._describe(numerical)
 
         standardized_dict = {r: (numerical[r] - stats[r]['mean']) / stats[r]['std']
                              for r in numerical.columns}
@@ -172,6 +317,14 @@ class error_table():
                np.array([stats[r]['mean'] for r in numerical.columns]),\
                np.array([stats[r]['std'] for r in numerical.columns])
 
+    def _describe(self, numerical):
+        # Use running statistics if the online analysis has them up to date
+        online = self.online
+        if (online is not None and online.rows_seen == self._num_rows
+            and set(numerical.columns) <= set(online.column_names)):
+            return online.stats[numerical.columns]
+        return numerical.describe()
+
     def dist_element(self, numerical, point_n):
 
         d=np.zeros(len(self.table))
@@ -222,7 +375,20 @@ class error_table():
         return result
 
 
-    def k_closest_samples(self, column_names=None, k = None, dist_type=True):
+    def k_closest_samples(self, column_names=None, k = None, dist_type=True,
+                          approximate=False, num_candidates=1000):
+        """Find the k rows of the table closest together.
+
+        For each row, the distances to its k nearest rows (including itself)
+        are summed, and the k rows around the row with the smallest sum are
+        returned, nearest first. Neighbors are found with a KD-tree or ball
+        tree (or blocked brute-force search in high dimensions), so the full
+        distance matrix is never built. Constant columns are ignored; rows
+        with other missing values are handled by brute-force search.
+
+        If approximate is True, only num_candidates randomly-chosen rows are
+        considered as the center of the group, for use on very large tables.
+        """
         # dist_type is True for using normalized, False for standardized
         if k is None or k >= len(self.table):
              return np.array(range(len(self.table)))
@@ -231,21 +397,46 @@ class error_table():
             numerical, categorical, _, _ = self.build_normalized(column_names=column_names)
         else:
             numerical, categorical, _, _ = self.build_standardized(column_names=column_names)
+        points = numerical.values.astype(float)
+        # Constant columns normalize to NaN (0/0) and do not affect distances
+        points = points[:, ~np.isnan(points).all(axis=0)]
+        if points.shape[1] == 0:
+            return np.array(range(k))
+        if approximate and num_candidates < len(points):
+            candidates = np.random.choice(len(points), num_candidates, replace=False)
+        else:
+            candidates = np.arange(len(points))
 
-        # Norm distance between table rows
-        d_rows = np.zeros((len(self.table), len(self.table)))
-        for i in range(len(self.table)):
-            d_rows[i] = self.dist_element(numerical, numerical.values[i])
+        if np.isnan(points).any():
+            distances, neighbors = self._k_nearest_with_nan(points, candidates, k)
+        else:
+            nn = NearestNeighbors(n_neighbors=k).fit(points)
+            distances, neighbors = nn.kneighbors(points[candidates])
 
         # Now the row associated with the min sum is the largest set of correlated elements
-        sum_rows = []
-        correlated_rows = []
-        for r in d_rows:
-            ks = np.argpartition(r, k)[:k]
-            sum_rows.append(sum(r[ks]))
-            correlated_rows.append(ks)
-
-        return correlated_rows[np.array(sum_rows).argmin()]
+        best = distances.sum(axis=1).argmin()
+        return neighbors[best]
+
+    @staticmethod
+    def _k_nearest_with_nan(points, candidates, k, block_size=1<<22):
+        """Blocked brute-force k-nearest neighbors, for points with missing coordinates.
+
+        As in a dense distance computation, distances involving missing
+        coordinates are NaN and such neighbors come last.
+        """
+        rows = max(1, block_size // points.size)
+        distances = np.empty((len(candidates), k))
+        neighbors = np.empty((len(candidates), k), dtype=int)
+        for start in range(0, len(candidates), rows):
+            block = candidates[start:start+rows]
+            d = np.linalg.norm(points[np.newaxis, :, :] - points[block, np.newaxis, :],
+                               axis=2)
+            ks = np.argpartition(d, k, axis=1)[:, :k]
+            kd = np.take_along_axis(d, ks, axis=1)
+            order = np.argsort(kd, axis=1)
+            neighbors[start:start+rows] = np.take_along_axis(ks, order, axis=1)
+            distances[start:start+rows] = np.take_along_axis(kd, order, axis=1)
+        return distances, neighbors
 
     def pca_analysis(self, column_names=None, n_components= 1):
         # Returns the direction of the principal component among the samples
@@ -295,9 +486,12 @@ class error_table():
                     if 'columns' in analysis_params.k_closest_params else None
                 k = analysis_params.k_closest_params.k \
                     if 'k' in analysis_params.k_closest_params else None
+                approximate = analysis_params.k_closest_params.approximate \
+                    if 'approximate' in analysis_params.k_closest_params else False
             else:
-                columns, k = None, None
-            analysis_data.k_closest = self.k_closest_samples(column_names=columns, k=k)
+                columns, k, approximate = None, None, False
+            analysis_data.k_closest = self.k_closest_samples(column_names=columns, k=k,
+                                                             approximate=approximate)
 
 
         if analysis_params is None or ('random' in analysis_params and analysis_params.random) or 'random' not in analysis_params:
@@ -317,9 +511,171 @@ class error_table():
             else:
                 columns, k = None, None
             analysis_data.k_clusters = self.k_clusters(column_names=columns, k=k)
-        return analysis_data
-
-
 
+        if self.online is not None:
+            analysis_data.online = self.online.analyze()
+        return analysis_data
 
 
+class online_analysis():
+    """Analysis of the numerical columns of an error table, updated as rows arrive.
+
+    Running minimum, maximum, mean and standard deviation are kept for each
+    column. Cluster centers (from mini-batch k-means on the normalized
+    columns) and principal components (from incremental PCA) are refined
+    every ``batch_size`` new rows, so they can be consulted at any point
+    during a long run without refitting on the whole table.
+
+    Normalization uses the running minimum and maximum at the time each batch
+    is processed; when they change, the cluster centers found so far are
+    converted to the new normalization before the batch is included. Missing
+    values are replaced by the running mean.
+    Categorical columns are not supported.
+
+    Args:
+        table (error_table): table to analyze.
+        column_names (list; optional): columns to use; by default all
+          numerical columns.
+        k (int): number of clusters.
+        n_components (int): number of principal components.
+        batch_size (int): number of new rows triggering an update of the
+          clusters and principal components.
+    """
+    def __init__(self, table, column_names=None, k=4, n_components=1, batch_size=100):
+        if column_names is None:
+            column_names = [c for c in table.column_names if table.column_type[c]]
+        else:
+            column_names = list(column_names)
+            for c in column_names:
+                if not table.column_type[c]:
+                    raise RuntimeError(f'online analysis of categorical column "{c}"'
+                                       ' is not supported')
+        if not column_names:
+            raise RuntimeError('online analysis requires numerical columns')
+        self.table = table
+        self.column_names = column_names
+        buffers = table._buffers()
+        self._buffers = [buffers[c] for c in column_names]
+        self.k = k
+        self.n_components = min(n_components, len(column_names))
+        self.batch_size = max(batch_size, k, self.n_components)
+        self.kmeans = MiniBatchKMeans(n_clusters=k, random_state=0, n_init=3)
+        self.pca = IncrementalPCA(n_components=self.n_components)
+        self.rows_seen = 0      # rows included in the running statistics
+        self.rows_fitted = 0    # rows used to fit the models
+        dims = len(column_names)
+        self.count = np.zeros(dims)
+        self.mean = np.zeros(dims)
+        self._m2 = np.zeros(dims)
+        self.min = np.full(dims, np.nan)
+        self.max = np.full(dims, np.nan)
+
+    def _rows(self, start, end):
+        rows = np.empty((end - start, len(self._buffers)))
+        for i, buffer in enumerate(self._buffers):
+            values = buffer.values(start)[:end-start]
+            if values.dtype == object:
+                values = [np.nan if v is None else v for v in values]
+            rows[:, i] = values
+        return rows
+
+    def update(self, force=False):
+        """Include rows added to the table since the last update.
+
+        The clusters and principal components are only updated once at least
+        ``batch_size`` new rows are available, unless force is True.
+        """
+        end = self.table.num_rows
+        if end > self.rows_seen:
+            self._update_stats(self._rows(self.rows_seen, end))
+            self.rows_seen = end
+        pending = end - self.rows_fitted
+        if pending >= self.batch_size or (force and pending > 0):
+            minimum = self.n_components if self.fitted else max(self.k, self.n_components)
+            if pending < minimum:
+                return      # too few rows to update the models
+            rows = self._rows(self.rows_fitted, end)
+            self._fit(rows)
+            self.rows_fitted = end
+
+    def _update_stats(self, rows):
+        present = ~np.isnan(rows)
+        count = present.sum(axis=0)
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(rows, axis=0) / count, 0)
+            m2 = np.nansum((rows - mean)**2, axis=0)
+            delta = mean - self.mean
+            self._m2 += m2 + delta**2 * self.count * count / np.maximum(total, 1)
+            self.mean += np.where(total > 0, delta * count / np.maximum(total, 1), 0)
+        self.count = total
+        self.min = np.fmin(self.min, np.fmin.reduce(rows, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(rows, axis=0))
+
+    @property
+    def std(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, np.sqrt(self._m2 / (self.count - 1)), np.nan)
+
+    @property
+    def stats(self):
+        """Running statistics, in the format of `pandas.DataFrame.describe`."""
+        return pd.DataFrame([self.count, self.mean, self.std, self.min, self.max],
+                            index=['count', 'mean', 'std', 'min', 'max'],
+                            columns=self.column_names)
+
+    @property
+    def fitted(self):
+        return self.rows_fitted > 0
+
+    def _normalize(self, rows):
+        scale = self.max - self.min
+        scale = np.where(scale > 0, scale, 1)
+        return (rows - self.min) / scale, scale
+
+    def _impute(self, rows):
+        return np.where(np.isnan(rows), np.nan_to_num(self.mean), rows)
+
+    def _fit(self, rows):
+        rows = self._impute(rows)
+        normalized, scale = self._normalize(rows)
+        offset = np.nan_to_num(self.min)
+        if self.fitted:
+            # express the centers learned so far in the current normalization
+            centers = self.kmeans.cluster_centers_ * self._center_scale + self._center_offset
+            self.kmeans.cluster_centers_ = (centers - offset) / scale
+        self.kmeans.partial_fit(np.nan_to_num(normalized))
+        self._center_offset, self._center_scale = offset, scale
+        self.pca.partial_fit(rows)
+
+    def clusters(self):
+        """Current cluster centers, in the original units of the columns.
+
+        Returns the same format as the numerical case of
+        `error_table.k_clusters`, without labels; None if not enough rows
+        have been seen yet.
+        """
+        if not self.fitted:
+            return None
+        centers = self.kmeans.cluster_centers_ * self._center_scale + self._center_offset
+        return {'clusters': dict(enumerate(centers)), 'columns': self.column_names}
+
+    def labels(self, rows=None):
+        """Cluster labels of the given rows (by default, all rows of the table)."""
+        if not self.fitted:
+            return None
+        if rows is None:
+            rows = self._rows(0, self.table.num_rows)
+        normalized = (self._impute(rows) - self._center_offset) / self._center_scale
+        return self.kmeans.predict(np.nan_to_num(normalized))
+
+    def principal_components(self):
+        """Current principal components, in the format of `error_table.pca_analysis`."""
+        if not self.fitted:
+            return None
+        return {'columns': self.column_names, 'pivot': self.mean.copy(),
+                'directions': self.pca.components_}
+
+    def analyze(self):
+        return DotMap(stats=self.stats, k_clusters=self.clusters(),
+                      pca=self.principal_components())
@@ -1,10 +1,18 @@
 from abc import ABC
+import array
+import collections.abc
+import random
+import dill
 from verifai.server import Server, ParallelServer
 from verifai.scenic_server import ScenicServer, ParallelScenicServer
 from verifai.samplers import TerminationException
 from dotmap import DotMap
 from verifai.monitor import mtl_specification, specification_monitor, multi_objective_monitor
 from verifai.error_table import error_table
+from verifai.table_io import TableWriter
+from verifai.checkpoint import Checkpointer
+from verifai.instrumentation import timed
+from verifai.features import CompletedSample
 import numpy as np
 import progressbar
 from statsmodels.stats.proportion import proportion_confint
@@ -28,6 +36,11 @@ class falsifier(ABC):
         params = DotMap(
             save_error_table=True, save_safe_table=True,
             error_table_path=None, safe_table_path=None,
+            table_format=None, table_flush_rows=100, table_flush_interval=10,
+            streaming=False, stop_condition=None, sinks=(), history_path=None,
+            compact_samples=False,
+            online_analysis=None,
+            checkpoint_path=None, checkpoint_results=100, checkpoint_interval=None,
             n_iters=1000, ce_num_max=np.inf, fal_thres=0,
             max_time=None,
             sampler_params=None, verbosity=0,
@@ -43,6 +56,23 @@ class falsifier(ABC):
         self.save_safe_table = params.save_safe_table
         self.error_table_path = params.error_table_path
         self.safe_table_path = params.safe_table_path
+        self.table_format = params.table_format
+        self.table_flush_rows = params.table_flush_rows
+        self.table_flush_interval = params.table_flush_interval
+        self.streaming = params.streaming
+        self.stop_condition = params.stop_condition
+        self.sinks = list(params.sinks)
+        self.history_path = params.history_path
+        self.compact_samples = params.compact_samples
+        self.online_analysis = params.online_analysis
+        self.checkpoint_path = params.checkpoint_path
+        self.checkpoint_results = params.checkpoint_results
+        self.checkpoint_interval = params.checkpoint_interval
+        self.checkpointer = None
+        self.run_id = 0
+        self.timing_summary = None
+        self._timing_mark = None
+        self._resumed = None
         if not hasattr(self, 'num_workers'):
             self.num_workers = 1
         self.n_iters, self.ce_num_max = params.n_iters, params.ce_num_max
@@ -54,6 +84,7 @@ class falsifier(ABC):
         server_params = DotMap(init=True)
         if server_options is not None:
             server_params.update(server_options)
+        self.server_options, self.server_class = server_params, server_class
         if server_params.init:
             self.init_server(server_params, server_class)
             self.init_error_table()
@@ -75,27 +106,45 @@ class falsifier(ABC):
 
     def init_error_table(self):
         # Initializing error table
+        self.error_table_writer = self.safe_table_writer = None
         if self.save_error_table:
             self.error_table = error_table(space = self.server.sample_space)
+            if self.error_table_path:
+                self.error_table_writer = self.table_writer(self.error_table,
+                                                            self.error_table_path)
         if self.save_safe_table:
             self.safe_table = error_table(space = self.server.sample_space)
+            if self.safe_table_path:
+                self.safe_table_writer = self.table_writer(self.safe_table,
+                                                           self.safe_table_path)
+
+        if self.online_analysis:
+            options = {} if self.online_analysis is True else dict(self.online_analysis)
+            for table in (self.error_table if self.save_error_table else None,
+                          self.safe_table if self.save_safe_table else None):
+                if table is not None:
+                    table.enable_online_analysis(**options)
+
+    def table_writer(self, table, path):
+        return TableWriter(table, path, format=self.table_format,
+                           flush_rows=self.table_flush_rows,
+                           flush_interval=self.table_flush_interval)
 
     def populate_error_table(self, sample, rho, error=True):
         if error:
             self.error_table.update_error_table(sample, rho)
-            if self.error_table_path:
-                self.write_table(self.error_table.table, self.error_table_path)
+            if self.error_table_writer:
+                self.error_table_writer.update()
         else:
             self.safe_table.update_error_table(sample, rho)
-            if self.safe_table_path:
-                self.write_table(self.safe_table.table, self.safe_table_path)
+            if self.safe_table_writer:
+                self.safe_table_writer.update()
 
-    @staticmethod
-    def write_table(table, path):
-        if len(table) <= 1:
-            table.to_csv(path)
-        else:
-            table.tail(1).to_csv(path, mode='a', header=False)
+    def close_table_writers(self):
+        """Write out any table rows not yet saved to disk."""
+        for writer in (self.error_table_writer, self.safe_table_writer):
+            if writer:
+                writer.close()
 
     def analyze_error_table(self, analysis_params= None, error=None):
         if self.save_error_table and (error is None or error is True):
@@ -119,16 +168,85 @@ class falsifier(ABC):
 
     def get_confidence_interval(self, confidence_level=0.95):
         N = len(self.samples)
-        c = len(self.error_table.table)
+        c = self.error_table.num_rows
         return proportion_confint(c, N, alpha=1 - confidence_level, method='beta')
 
     def run_falsifier(self):
-        i = 0
-        ce_num = 0
-        server_samples = []
-        rhos = []
-        self.total_sample_time = 0
-        self.total_simulate_time = 0
+        bar = self._start_run()
+        server_samples, rhos = self.run_samples, self.run_rhos
+        completed = False
+        try:
+            while True:
+                try:
+                    sample, rho, timings = self.server.run_server()
+                except TerminationException:
+                    if self.verbosity >= 1:
+                        print("Sampler has generated all possible samples")
+                    break
+                if self._record_result(sample, rho, timings, server_samples, rhos, bar):
+                    break
+            completed = True
+        finally:
+            if self.verbosity >= 1:
+                bar.finish()
+            self.server.terminate()
+            if self.streaming or not completed:
+                self._finish_run(completed)
+        if not self.streaming:
+            self._populate_tables(server_samples, rhos)
+
+    async def run_falsifier_async(self):
+        """Variant of `run_falsifier` for use with an `AsyncServer`.
+
+        Results are processed as soon as each simulation finishes, in whatever
+        order they complete. Run it with e.g.
+        ``asyncio.run(falsifier.run_falsifier_async())``.
+        """
+        bar = self._start_run()
+        server_samples, rhos = self.run_samples, self.run_rhos
+        results = self.server.results()
+        completed = False
+        try:
+            async for sample, rho, timings in results:
+                if self._record_result(sample, rho, timings, server_samples, rhos, bar):
+                    break
+            else:
+                if self.verbosity >= 1:
+                    print("Sampler has generated all possible samples")
+            completed = True
+        finally:
+            await results.aclose()
+            if self.verbosity >= 1:
+                bar.finish()
+            await self.server.aclose()
+            if self.streaming or not completed:
+                self._finish_run(completed)
+        if not self.streaming:
+            self._populate_tables(server_samples, rhos)
+
+    def _start_run(self):
+        if self._resumed is not None:
+            # continue the run interrupted when the checkpoint was saved
+            state, self._resumed = self._resumed, None
+            self.__dict__.update(state.counters)
+            self.run_samples, self.run_rhos = state.run_samples, state.run_rhos
+            self._run_start_time = time.time() - state.elapsed
+        else:
+            self.total_sample_time = 0
+            self.total_simulate_time = 0
+            self.num_results = 0
+            self.ce_num = 0
+            self.run_samples, self.run_rhos = [], []
+            self.run_id += 1
+            instrumentation = self.instrumentation
+            self._timing_mark = (None if instrumentation is None
+                                 else instrumentation.mark())
+            if self.history_path is not None:
+                if isinstance(self.samples, SampleHistory):
+                    self.samples.close()
+                self.samples = SampleHistory(self.history_path)
+        if self.checkpoint_path is not None:
+            self._start_checkpoints()
         if self.verbosity >= 1:
             suffix = ''
             if self.n_iters:
@@ -139,6 +257,7 @@ class falsifier(ABC):
         if self.verbosity >= 2:
             print(f'Server class is {type(self.server)}')
 
+        bar = None
         if self.verbosity >= 1:
             if self.n_iters is not None:
                 bar = progressbar.ProgressBar(max_value=self.n_iters)
@@ -146,47 +265,270 @@ class falsifier(ABC):
                 widgets = ['Samples generated: ', progressbar.Counter('%(value)d'),
                 ' (', progressbar.Timer(), ')']
                 bar = progressbar.ProgressBar(widgets=widgets)
+        return bar
 
-        try:
-            while True:
-                try:
-                    sample, rho, timings = self.server.run_server()
-                    self.total_sample_time += timings.sample_time
-                    self.total_simulate_time += timings.simulate_time
-                except TerminationException:
-                    if self.verbosity >= 1:
-                        print("Sampler has generated all possible samples")
-                    break
-                if self.verbosity >= 2:
-                    print("Sample no: ", i, "\nSample: ", sample, "\nRho: ", rho)
-                self.samples[i] = sample
-                server_samples.append(sample)
-                rhos.append(rho)
-                i += 1
-                if self.verbosity >= 1:
-                    bar.update(i)
-                if i == 1:
-                    t0 = time.time()
-                if self.n_iters is not None and i == self.n_iters:
-                    break
-                if self.max_time is not None and time.time() - t0 >= self.max_time:
-                    break
-        finally:
-            if self.verbosity >= 1:
-                bar.finish()
-            self.server.terminate()
-        for sample, rho in zip(server_samples, rhos):
-            ce = any([r <= self.fal_thres for r in rho]) if self.multi else rho <= self.fal_thres
-            if ce:
-                if self.save_error_table:
-                    self.populate_error_table(sample, rho)
-                ce_num = ce_num + 1
-                if ce_num >= self.ce_num_max:
-                    break
-            elif self.save_safe_table:
-                self.populate_error_table(sample, rho, error=False)
+    def _record_result(self, sample, rho, timings, server_samples, rhos, bar):
+        """Record one result of the run; returns True if the run should stop.
+
+        In streaming mode the result is processed immediately; otherwise it is
+        saved in ``server_samples`` and ``rhos`` for `_populate_tables`.
+        """
+        i = self.num_results
+        self.total_sample_time += timings.sample_time
+        self.total_simulate_time += timings.simulate_time
+        if self.verbosity >= 2:
+            print("Sample no: ", i, "\nSample: ", sample, "\nRho: ", rho)
+        self._store_sample(i, sample, rho)
+        i = self.num_results = i + 1
+        if not self.streaming:
+            server_samples.append(sample)
+            rhos.append(rho)
         if self.verbosity >= 1:
+            bar.update(i)
+        if i == 1:
+            self._run_start_time = time.time()
+        stop = self.streaming and self._process_result(sample, rho)
+        if self.checkpointer is not None and self._checkpoint_due():
+            with timed(self.instrumentation, 'checkpoint'):
+                self.checkpoint()
+        if stop:
+            return True
+        if self.n_iters is not None and i == self.n_iters:
+            return True
+        if (self.max_time is not None
+            and time.time() - self._run_start_time >= self.max_time):
+            return True
+        return False
+
+    def _process_result(self, sample, rho):
+        """Add a result to the tables and sinks; returns True if the run should stop."""
+        with timed(self.instrumentation, 'record'):
+            return self._add_result(sample, rho)
+
+    def _add_result(self, sample, rho):
+        ce = any([r <= self.fal_thres for r in rho]) if self.multi else rho <= self.fal_thres
+        if ce:
+            if self.save_error_table:
+                self.populate_error_table(sample, rho)
+            self.ce_num = self.ce_num + 1
+        elif self.save_safe_table:
+            self.populate_error_table(sample, rho, error=False)
+        for sink in self.sinks:
+            sink(sample, rho, ce)
+        if ce and self.ce_num >= self.ce_num_max:
+            return True
+        return bool(self.stop_condition and self.stop_condition(sample, rho))
+
+    def _store_sample(self, i, sample, rho):
+        self.samples[i] = self._compacted(sample)
+        if self.checkpointer is not None:
+            self._new_results.append((sample, rho))
+
+    def _compacted(self, sample):
+        if self.compact_samples and isinstance(sample, CompletedSample):
+            return sample.space.compactSample(sample)
+        return sample
+
+    def _populate_tables(self, server_samples, rhos):
+        for sample, rho in zip(server_samples, rhos):
+            if self._process_result(sample, rho):
+                break
+        self._finish_run()
+
+    def _finish_run(self, completed=True):
+        self.close_table_writers()
+        if isinstance(self.samples, SampleHistory):
+            self.samples.flush()
+        if self.checkpointer is not None:
+            self.checkpoint(finished=completed)
+        if completed and self.verbosity >= 1:
             print('Falsification complete.')
+            cache = getattr(self.server, 'cache', None)
+            if cache is not None:
+                print(f'Result cache: {cache.hits} hits, {cache.misses} misses '
+                      f'({cache.hit_rate:.1%} hit rate)')
+        instrumentation = self.instrumentation
+        if completed and instrumentation is not None:
+            self.timing_summary = instrumentation.summary(since=self._timing_mark)
+            if self.verbosity >= 1:
+                print('Time taken by each phase:')
+                print(instrumentation.report(since=self._timing_mark))
+
+    @property
+    def instrumentation(self):
+        """The `Instrumentation` of the server, if any."""
+        return getattr(self.server, 'instrumentation', None)
+
+    ## Checkpoints
+
+    def _start_checkpoints(self):
+        if self.checkpointer is None:
+            self.checkpointer = Checkpointer(self.checkpoint_path)
+            self.checkpointer.clear()
+            self._new_results = []
+            self._checkpoint_rows = {}
+        base = {name: value for name, value in self.__dict__.items()
+                if not name.startswith('_') and name not in self._not_checkpointed}
+        self.checkpointer.write_base({'class': type(self), 'state': base})
+        self._last_checkpoint = time.monotonic()
+
+    _not_checkpointed = {
+        'server', 'samples', 'error_table', 'safe_table', 'error_table_writer',
+        'safe_table_writer', 'checkpointer', 'run_samples', 'run_rhos',
+    }
+
+    def _checkpoint_due(self):
+        if len(self._new_results) >= self.checkpoint_results:
+            return True
+        return (self.checkpoint_interval is not None
+                and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval)
+
+    def checkpoint(self, finished=False):
+        """Save the changes in the falsifier's state since the last checkpoint.
+
+        Called automatically during runs when the ``checkpoint_path``
+        parameter is set; see `resume_falsifier`.
+        """
+        if self.checkpointer is None:
+            raise RuntimeError('checkpoint_path was not set')
+        tables = {}
+        for name in ('error_table', 'safe_table'):
+            table = getattr(self, name, None)
+            if table is None:
+                continue
+            start = self._checkpoint_rows.get(name, 0)
+            tables[name] = {
+                'rows': table.tail(table.num_rows - start) if table.num_rows > start else None,
+                'column_type': dict(table.column_type),
+                'ignore_locs': table.ignore_locs,
+            }
+            self._checkpoint_rows[name] = table.num_rows
+        started = self.num_results > 0 and hasattr(self, '_run_start_time')
+        delta = {
+            'run_id': self.run_id,
+            'finished': finished,
+            'results': self._new_results,
+            'counters': {
+                'num_results': self.num_results,
+                'ce_num': self.ce_num,
+                'total_sample_time': self.total_sample_time,
+                'total_simulate_time': self.total_simulate_time,
+            },
+            'elapsed': time.time() - self._run_start_time if started else 0,
+            'tables': tables,
+            'sampler': (random.getstate(), np.random.get_state(), self.server.sampler),
+        }
+        self.checkpointer.write_delta(delta)
+        self._new_results = []
+        self._last_checkpoint = time.monotonic()
+
+    def _restore(self, checkpointer):
+        self.init_server(self.server_options, self.server_class)
+        self.init_error_table()
+        self.samples = {}
+        last = None
+        for delta in checkpointer.read_deltas():
+            if last is None or delta['run_id'] != last['run_id']:
+                run_samples, run_rhos = [], []
+                if self.history_path is not None:
+                    if isinstance(self.samples, SampleHistory):
+                        self.samples.close()
+                    self.samples = SampleHistory(self.history_path)
+            start = delta['counters']['num_results'] - len(delta['results'])
+            for i, (sample, rho) in enumerate(delta['results'], start=start):
+                self.samples[i] = self._compacted(sample)
+                run_samples.append(sample)
+                run_rhos.append(rho)
+            for name, info in delta['tables'].items():
+                table = getattr(self, name)
+                table.column_type.update(info['column_type'])
+                table.ignore_locs = info['ignore_locs']
+                if info['rows'] is not None:
+                    table.append_rows(info['rows'])
+            last = delta
+        if last is not None:
+            random_state, numpy_state, sampler = last['sampler']
+            random.setstate(random_state)
+            np.random.set_state(numpy_state)
+            self.server.sampler = sampler
+            if self.sampler is not None:
+                self.sampler = sampler
+            self.__dict__.update(last['counters'])
+            if not last['finished']:
+                self._resumed = DotMap(counters=last['counters'], elapsed=last['elapsed'],
+                                       run_samples=run_samples, run_rhos=run_rhos)
+        self.checkpointer = checkpointer
+        self._new_results = []
+        self._checkpoint_rows = {name: getattr(self, name).num_rows
+                                 for name in ('error_table', 'safe_table')
+                                 if getattr(self, name, None) is not None}
+
+def resume_falsifier(path):
+    """Recreate a falsifier from the checkpoint saved in the given directory.
+
+    Checkpoints are saved when the ``checkpoint_path`` falsifier parameter is
+    set. The falsifier is restored with its tables, samples, counters and
+    sampler state; if its last run was interrupted, calling `run_falsifier`
+    (or `run_falsifier_async`) continues that run, so that e.g. ``n_iters``
+    counts the samples evaluated before the interruption. Samples which were
+    being simulated when the checkpoint was saved are not rerun. Parallel
+    falsifiers save checkpoints as results arrive, like the others.
+
+    Each checkpoint stores the results, table rows and counters added since
+    the previous one, but also a pickled copy of the whole sampler, since
+    samplers do not record what changed in their state. For samplers with
+    large state (e.g. the Gaussian process models of Bayesian optimization)
+    checkpoints can therefore be slow and large: use the
+    ``checkpoint_results`` and ``checkpoint_interval`` parameters to save
+    them less often.
+    """
+    checkpointer = Checkpointer(path)
+    base = checkpointer.read_base()
+    cls = base['class']
+    falsifier = cls.__new__(cls)
+    falsifier.__dict__.update(base['state'])
+    falsifier._resumed = None
+    falsifier._restore(checkpointer)
+    return falsifier
+
+class SampleHistory(collections.abc.Mapping):
+    """Samples evaluated by a falsifier, stored in a file instead of in memory.
+
+    Used for ``falsifier.samples`` when the ``history_path`` falsifier
+    parameter is set. It maps the index of each sample to the sample, like the
+    dict normally used, but only the file offset of each sample is kept in
+    memory; samples are loaded from the file as needed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w+b')
+        self.offsets = array.array('q')
+
+    def __setitem__(self, index, sample):
+        if index != len(self.offsets):
+            raise RuntimeError('samples must be added to SampleHistory in order')
+        self.file.seek(0, 2)
+        self.offsets.append(self.file.tell())
+        dill.dump(sample, self.file)
+
+    def __getitem__(self, index):
+        if not isinstance(index, int) or not 0 <= index < len(self.offsets):
+            raise KeyError(index)
+        self.file.flush()
+        self.file.seek(self.offsets[index])
+        return dill.load(self.file)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(range(len(self.offsets)))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
 
 class generic_falsifier(falsifier):
     def __init__(self,  monitor=None, sampler_type= None, sample_space=None, sampler=None,
@@ -253,26 +595,35 @@ class generic_parallel_falsifier(parallel_falsifier):
         self.monitor, options=server_options, max_time=self.max_time, sampler=self.sampler)
 
     def run_falsifier(self):
-        i = 0
-        ce_num = 0
+        resumed = self._resumed is not None
+        self._start_run()
+        if resumed:
+            # only run what remains of the interrupted run
+            if self.n_iters is not None:
+                self.server.n_iters = self.n_iters - self.num_results
+            if self.max_time is not None:
+                elapsed = time.time() - self._run_start_time
+                self.server.max_time = max(self.max_time - elapsed, 0)
+        completed = False
         try:
-            outputs = self.server.run_server()
+            if not resumed or self.server.n_iters is None or self.server.n_iters > 0:
+                self.server.run_server(on_result=self._record_parallel_result)
+            completed = True
         finally:
             self.server.terminate()
-        samples, rhos = zip(*outputs)
-        if isinstance(self.monitor, multi_objective_monitor):
-            counterexamples = [any([r <= self.fal_thres for r in rho]) for rho in rhos]
-        else:
-            counterexamples = [r <= self.fal_thres for r in rhos]
-        for i, (sample, ce, rho) in enumerate(zip(samples, counterexamples, rhos)):
-            if self.verbosity >= 1:
-                print("Sample no: ", i, "\nSample: ", sample, "\nRho: ", rho)
-            self.samples[i] = sample
-            if ce:
-                if self.save_error_table:
-                    self.populate_error_table(sample, rho)
-                ce_num = ce_num + 1
-                if ce_num >= self.ce_num_max:
-                    break
-            elif self.save_safe_table:
-                self.populate_error_table(sample, rho, error=False)
+            self._finish_run(completed)
+
+    def _record_parallel_result(self, sample, rho):
+        """Process one result as soon as the server has it; returns True to stop."""
+        i = self.num_results
+        if self.verbosity >= 1:
+            print("Sample no: ", i, "\nSample: ", sample, "\nRho: ", rho)
+        self._store_sample(i, sample, rho)
+        self.num_results = i + 1
+        if i == 0:
+            self._run_start_time = time.time()
+        stop = self._process_result(sample, rho)
+        if self.checkpointer is not None and self._checkpoint_due():
+            with timed(self.instrumentation, 'checkpoint'):
+                self.checkpoint()
+        return stop
@@ -10,25 +10,100 @@ import random
 import itertools
 import functools
 from abc import ABC, abstractmethod
-from collections import OrderedDict, namedtuple
+from collections import Counter, OrderedDict, namedtuple
 from collections.abc import Sequence
 
 import numpy as np
+from scipy.spatial.distance import cdist
 
-from verifai.utils.utils import RejectionException, cached_property
+from verifai.utils.utils import (RejectionException, AcceptanceRate, cached_property,
+                                 LazyMapping)
 
 ### Domains
 
+class FlatCoordinate(namedtuple('FlatCoordinate',
+                                ('prefix', 'suffix', 'pandasIndex',
+                                 'isNumerical', 'domain'))):
+    """Description of one coordinate of flattened points (see Domain.flatLayout).
+
+    Attributes:
+        prefix, suffix (str): the meaning of the coordinate for a point
+          stored in the variable ``point`` is ``prefix + 'point' + suffix``.
+        pandasIndex (tuple): as returned by pandasIndexForFlatCoordinate.
+        isNumerical (bool): as returned by coordinateIsNumerical.
+        domain (Domain): the primitive domain the coordinate comes from, or
+          None for the lengths of feature lists and time series.
+    """
+    __slots__ = ()
+
+    def meaning(self, pointName='point'):
+        return f'{self.prefix}{pointName}{self.suffix}'
+
+    def nested(self, suffix, pandasIndex):
+        """The same coordinate, inside a larger point at the given position."""
+        return FlatCoordinate(self.prefix, suffix + self.suffix,
+                              pandasIndex + self.pandasIndex,
+                              self.isNumerical, self.domain)
+
 class Domain:
     """Abstract class of domains"""
 
     def distance(self, pointA, pointB):
         raise NotImplementedError('domain distance metric not implemented')
 
+    def pairwiseDistances(self, pointsA, pointsB):
+        """Matrix of distances between two lists of points.
+
+        Entry (i, j) is the distance between pointsA[i] and pointsB[j].
+        Domains which can vectorize the computation override this; by
+        default it simply calls distance for each pair.
+        """
+        distances = [[self.distance(pointA, pointB) for pointB in pointsB]
+                     for pointA in pointsA]
+        return np.array(distances, dtype=float).reshape(len(pointsA), len(pointsB))
+
     def uniformPoint(self):
         """Sample a uniformly random point in this Domain"""
         raise NotImplementedError('domain uniform sampling not implemented')
 
+    def uniformPoints(self, n):
+        """Sample a list of n independent uniformly random points.
+
+        Domains which can vectorize sampling override this; by default it
+        simply calls uniformPoint repeatedly.
+        """
+        return [self.uniformPoint() for i in range(n)]
+
+    def uniformFlatPoints(self, n):
+        """Sample n independent uniformly random points, flattened.
+
+        Returns the same as ``flattenPoints(uniformPoints(n))``; domains
+        whose points are naturally generated as arrays override this to
+        avoid building the points.
+        """
+        return self.flattenPoints(self.uniformPoints(n))
+
+    def uniformCandidates(self, n):
+        """Sample n candidate points for rejection sampling.
+
+        Returns a list of n independent uniformly random points, drawn
+        ignoring any filters of this Domain, and a boolean array saying which
+        of them pass the filters (or None if this Domain has none); rejected
+        candidates may be replaced by None. Used to
+        draw and filter whole blocks of points at once: see
+        `FilteredDomain.uniformPoints` and `RejectionSampler`.
+        """
+        if not self.requiresRejection:
+            return self.uniformPoints(n), None
+        points, accepted = [], np.ones(n, dtype=bool)
+        for i in range(n):
+            try:
+                points.append(self.uniformPoint())
+            except RejectionException:
+                points.append(None)
+                accepted[i] = False
+        return points, accepted
+
     def flatten(self, point):
         """Flatten a point in this Domain to a tuple of coordinates.
 
@@ -82,6 +157,20 @@ class Domain:
         """
         return NotImplementedError('domain flattening not implemented')
 
+    @cached_property
+    def flatLayout(self):
+        """Tuple of `FlatCoordinate` describing each coordinate of flattened points.
+
+        Domains built from other domains assemble this table from those of
+        their sub-domains, once, and answer meaningOfFlatCoordinate etc. from it.
+        """
+        return tuple(
+            FlatCoordinate('', self.meaningOfFlatCoordinate(i, pointName=''),
+                           self.pandasIndexForFlatCoordinate(i),
+                           self.coordinateIsNumerical(i), self)
+            for i in range(self.flattenedDimension)
+        )
+
     def numericizeCoordinate(self, coord):
         """Make a coordinate numeric. For internal use."""
         return coord
@@ -102,6 +191,23 @@ class Domain:
         """Unflatten an iterator of coordinates to a point in this Domain."""
         raise NotImplementedError('domain unflattening not implemented')
 
+    def flattenPoints(self, points):
+        """Flatten a list of points into an array with one row per point.
+
+        Domains which can vectorize flattening override this; by default it
+        simply calls flattenOnto for each point.
+        """
+        array = np.empty((len(points), self.flattenedDimension))
+        for row, point in zip(array, points):
+            coords = []
+            self.flattenOnto(point, coords)
+            row[:] = coords
+        return array
+
+    def unflattenPoints(self, array):
+        """Unflatten an array of flattened points (one per row) to a list."""
+        return [self.unflatten(row) for row in array.tolist()]
+
     def standardize(self, point):
         """Map the point into a hyperbox, preserving measure.
 
@@ -151,6 +257,39 @@ class Domain:
         raise RuntimeError(
             f'Domain {self.__class__.__name__} does not support standardize')
 
+    def standardizeArray(self, points):
+        """Standardize a list of points into an array with one row per point.
+
+        Domains whose standardization is an affine map of their flattened
+        coordinates (see affineStandardization) apply it to the whole batch at
+        once; otherwise this simply calls standardize for each point.
+        """
+        affine = self.affineStandardization
+        if affine is not None:
+            offsets, scales = affine
+            return (self.flattenPoints(points) - offsets) / scales
+        width = max(self.standardizedDimension, len(self.standardizedIntervals))
+        array = np.array([self.standardize(point) for point in points], dtype=float)
+        return array.reshape(len(points), width)
+
+    def unstandardizeArray(self, array):
+        """Unstandardize an array of standardized points (one per row) to a list."""
+        affine = self.affineStandardization
+        if affine is not None:
+            offsets, scales = affine
+            return self.unflattenPoints(np.asarray(array, dtype=float) * scales + offsets)
+        return [self.unstandardize(row) for row in np.asarray(array).tolist()]
+
+    @cached_property
+    def affineStandardization(self):
+        """Pair of arrays (offsets, scales) mapping flattened to standardized points.
+
+        If the standardization of this Domain is an affine map of flattened
+        coordinates, then a point flattened to ``flat`` standardizes to
+        ``(flat - offsets) / scales``. Otherwise, this is None.
+        """
+        return None
+
     @cached_property
     def requiresRejection(self):
         """Whether sampling from this Domain requires rejection sampling."""
@@ -191,9 +330,15 @@ class Constant(Domain):
     def distance(self, pointA, pointB):
         return 0
 
+    def pairwiseDistances(self, pointsA, pointsB):
+        return np.zeros((len(pointsA), len(pointsB)))
+
     def uniformPoint(self):
         return self.value
 
+    def uniformPoints(self, n):
+        return [self.value] * n
+
     def flattenOnto(self, point, targetList):
         pass    # do nothing: no point in encoding the constant value
 
@@ -213,6 +358,12 @@ class Constant(Domain):
     def unflattenIterator(self, coords):
         return self.value
 
+    def flattenPoints(self, points):
+        return np.empty((len(points), 0))
+
+    def unflattenPoints(self, array):
+        return [self.value] * len(array)
+
     def __eq__(self, other):
         return (type(other) is Constant and self.value == other.value)
 
@@ -242,9 +393,18 @@ class Categorical(Domain):
     def distance(self, pointA, pointB):
         return 0 if pointA == pointB else 1
 
+    def pairwiseDistances(self, pointsA, pointsB):
+        indicesA = self.flattenPoints(pointsA)
+        indicesB = self.flattenPoints(pointsB)
+        return (indicesA != indicesB.T).astype(float)
+
     def uniformPoint(self):
         return random.choice(self.values)
 
+    def uniformPoints(self, n):
+        values = self.values
+        return [values[i] for i in np.random.randint(len(values), size=n)]
+
     def flattenOnto(self, point, targetList):
         targetList.append(self.numericizeCoordinate(point))
 
@@ -273,6 +433,15 @@ class Categorical(Domain):
     def unflattenIterator(self, coords):
         return self.denumericizeCoordinate(next(coords))
 
+    def flattenPoints(self, points):
+        index = self.index
+        return np.array([index[point] for point in points],
+                        dtype=float).reshape(len(points), 1)
+
+    def unflattenPoints(self, array):
+        values = self.values
+        return [values[i] for i in np.rint(array[:, 0]).astype(int).tolist()]
+
     def standardizeOnto(self, point, targetList):
         targetList.append(self.numericizeCoordinate(point))
 
@@ -283,6 +452,10 @@ class Categorical(Domain):
     def unstandardizeIterator(self, coords):
         return self.denumericizeCoordinate(next(coords))
 
+    @cached_property
+    def affineStandardization(self):
+        return np.zeros(1), np.ones(1)
+
     @cached_property
     def pointsAreScalars(self):
         return True     # TODO hmm
@@ -305,7 +478,10 @@ class Real(Domain):
     """Domain of real numbers"""
 
     def distance(self, pointA, pointB):
-        return math.abs(pointA - pointB)
+        return abs(pointA - pointB)
+
+    def pairwiseDistances(self, pointsA, pointsB):
+        return np.abs(self.flattenPoints(pointsA) - self.flattenPoints(pointsB).T)
 
     def uniformPoint(self):
         raise RuntimeError('cannot sample uniformly from all real numbers')
@@ -332,6 +508,12 @@ class Real(Domain):
     def unflattenIterator(self, coords):
         return next(coords)
 
+    def flattenPoints(self, points):
+        return np.array(points, dtype=float).reshape(len(points), 1)
+
+    def unflattenPoints(self, array):
+        return array[:, 0].tolist()
+
     @cached_property
     def pointsAreScalars(self):
         return True
@@ -349,7 +531,10 @@ class Integer(Domain):
     """Domain of integers"""
 
     def distance(self, pointA, pointB):
-        return math.abs(pointA - pointB)
+        return abs(pointA - pointB)
+
+    def pairwiseDistances(self, pointsA, pointsB):
+        return np.abs(self.flattenPoints(pointsA) - self.flattenPoints(pointsB).T)
 
     def uniformPoint(self):
         raise RuntimeError('cannot sample uniformly from all integers')
@@ -376,6 +561,12 @@ class Integer(Domain):
     def unflattenIterator(self, coords):
         return next(coords)
 
+    def flattenPoints(self, points):
+        return np.array(points, dtype=float).reshape(len(points), 1)
+
+    def unflattenPoints(self, array):
+        return np.rint(array[:, 0]).astype(int).tolist()
+
     @cached_property
     def pointsAreScalars(self):
         return True
@@ -419,6 +610,9 @@ class AbstractBox(Domain):
         pa, pb = np.array(pointA), np.array(pointB)
         return np.linalg.norm(pa - pb)
 
+    def pairwiseDistances(self, pointsA, pointsB):
+        return cdist(self.flattenPoints(pointsA), self.flattenPoints(pointsB))
+
     def flattenOnto(self, point, targetList):
         targetList.extend(point)
 
@@ -441,6 +635,12 @@ class AbstractBox(Domain):
     def unflattenIterator(self, coords):
         return tuple(itertools.islice(coords, self.dimension))
 
+    def flattenPoints(self, points):
+        return np.array(points, dtype=float).reshape(len(points), self.dimension)
+
+    def unflattenPoints(self, array):
+        return [tuple(row) for row in array.tolist()]
+
     @cached_property
     def pointsAreScalars(self):
         return self.dimension == 1
@@ -466,6 +666,13 @@ class Box(AbstractBox):
     def uniformPoint(self):
         return tuple(random.uniform(lo, hi) for lo, hi in self.intervals)
 
+    def uniformPoints(self, n):
+        return self.unflattenPoints(self.uniformFlatPoints(n))
+
+    def uniformFlatPoints(self, n):
+        lows, highs = zip(*self.intervals)
+        return np.random.uniform(lows, highs, size=(n, self.dimension))
+
     def standardizeOnto(self, point, targetList):
         for coord, left, length in zip(point, self.lefts, self.lengths):
             targetList.append((coord - left) / length)
@@ -482,6 +689,10 @@ class Box(AbstractBox):
         assert len(point) == self.dimension
         return point
 
+    @cached_property
+    def affineStandardization(self):
+        return np.array(self.lefts, dtype=float), np.array(self.lengths, dtype=float)
+
     def __repr__(self):
         args = ', '.join(repr(interval) for interval in self.intervals)
         return f'Box({args})'
@@ -503,6 +714,13 @@ class DiscreteBox(AbstractBox):
     def uniformPoint(self):
         return tuple(random.randint(lo, hi) for lo, hi in self.intervals)
 
+    def uniformPoints(self, n):
+        return [tuple(row) for row in self.uniformFlatPoints(n).tolist()]
+
+    def uniformFlatPoints(self, n):
+        lows, highs = zip(*self.intervals)
+        return np.random.randint(lows, np.add(highs, 1), size=(n, self.dimension))
+
     def standardizeOnto(self, point, targetList):
         targetList.extend(point)
 
@@ -513,6 +731,13 @@ class DiscreteBox(AbstractBox):
     def unstandardizeIterator(self, coords):
         return tuple(itertools.islice(coords, self.dimension))
 
+    @cached_property
+    def affineStandardization(self):
+        return np.zeros(self.dimension), np.ones(self.dimension)
+
+    def unflattenPoints(self, array):
+        return [tuple(row) for row in np.rint(array).astype(int).tolist()]
+
     def __iter__(self):
         ranges = (range(left, right+1) for left, right in self.intervals)
         yield from itertools.product(*ranges)
@@ -593,9 +818,37 @@ class Array(Domain):
                     yield from iterateLevel(j, sublevel)
         yield from iterateLevel(0, point)
 
+    def distance(self, pointA, pointB):
+        """Sum of the distances between corresponding elements."""
+        return sum(self.domain.distance(eltA, eltB)
+                   for eltA, eltB in zip(self.elementsOfPoint(pointA),
+                                         self.elementsOfPoint(pointB)))
+
+    def pairwiseDistances(self, pointsA, pointsB):
+        distances = np.zeros((len(pointsA), len(pointsB)))
+        elementsA = [tuple(self.elementsOfPoint(point)) for point in pointsA]
+        elementsB = [tuple(self.elementsOfPoint(point)) for point in pointsB]
+        for i in range(self.numElements):
+            distances += self.domain.pairwiseDistances(
+                [elements[i] for elements in elementsA],
+                [elements[i] for elements in elementsB])
+        return distances
+
     def uniformPoint(self):
         return self.pointWithElements(iter(self.domain.uniformPoint, None))
 
+    def uniformPoints(self, n):
+        elements = iter(self.domain.uniformPoints(n * self.numElements))
+        return [self.pointWithElements(elements) for i in range(n)]
+
+    def uniformCandidates(self, n):
+        if not self.requiresRejection:
+            return self.uniformPoints(n), None
+        elements, accepted = self.domain.uniformCandidates(n * self.numElements)
+        elements = iter(elements)
+        points = [self.pointWithElements(elements) for i in range(n)]
+        return points, accepted.reshape(n, self.numElements).all(axis=1)
+
     def flattenOnto(self, point, targetList):
         for element in self.elementsOfPoint(point):
             self.domain.flattenOnto(element, targetList)
@@ -604,39 +857,57 @@ class Array(Domain):
     def flattenedDimension(self):
         return self.numElements * self.domain.flattenedDimension
 
-    def meaningOfFlatCoordinate(self, index, pointName='point'):
+    @cached_property
+    def flatLayout(self):
+        layout = []
+        subLayout = self.domain.flatLayout
+        for indices in itertools.product(*map(range, self.shape)):
+            suffix = ''.join(f'[{i}]' for i in indices)
+            layout.extend(coord.nested(suffix, indices) for coord in subLayout)
+        return tuple(layout)
+
+    def _flatCoordinate(self, index):
+        # computed from the layout of the elements rather than from flatLayout,
+        # which can be large for big arrays
         assert 0 <= index < self.flattenedDimension
-        ourIndex = index // self.domain.flattenedDimension
-        subIndex = index % self.domain.flattenedDimension
+        ourIndex, subIndex = divmod(index, self.domain.flattenedDimension)
         indices = []
         for levelSize in reversed(self.shape):
-            levelIndex = ourIndex % levelSize
-            indices.insert(0, f'[{levelIndex}]')
-            ourIndex = ourIndex // levelSize
-        meaning = pointName + ''.join(indices)
-        return self.domain.meaningOfFlatCoordinate(subIndex, pointName=meaning)
+            ourIndex, levelIndex = divmod(ourIndex, levelSize)
+            indices.append(levelIndex)
+        indices.reverse()
+        return indices, self.domain.flatLayout[subIndex]
+
+    def meaningOfFlatCoordinate(self, index, pointName='point'):
+        indices, coord = self._flatCoordinate(index)
+        meaning = pointName + ''.join(f'[{i}]' for i in indices)
+        return coord.meaning(meaning)
 
     def pandasIndexForFlatCoordinate(self, index):
-        assert 0 <= index < self.flattenedDimension
-        ourIndex = index // self.domain.flattenedDimension
-        subIndex = index % self.domain.flattenedDimension
-        indices = []
-        for levelSize in reversed(self.shape):
-            levelIndex = ourIndex % levelSize
-            indices.insert(0, levelIndex)
-            ourIndex = ourIndex // levelSize
-        subPandasIndex = self.domain.pandasIndexForFlatCoordinate(subIndex)
-        return tuple(indices) + subPandasIndex
+        indices, coord = self._flatCoordinate(index)
+        return tuple(indices) + coord.pandasIndex
 
     def coordinateIsNumerical(self, index):
         assert 0 <= index < self.flattenedDimension
         subIndex = index % self.domain.flattenedDimension
-        return self.domain.coordinateIsNumerical(subIndex)
+        return self.domain.flatLayout[subIndex].isNumerical
 
     def unflattenIterator(self, coords):
         it = iter(lambda: self.domain.unflattenIterator(coords), None)
         return self.pointWithElements(it)
 
+    def flattenPoints(self, points):
+        elements = [element for point in points
+                    for element in self.elementsOfPoint(point)]
+        flat = self.domain.flattenPoints(elements)
+        return flat.reshape(len(points), self.flattenedDimension)
+
+    def unflattenPoints(self, array):
+        flat = array.reshape(len(array) * self.numElements,
+                             self.domain.flattenedDimension)
+        elements = iter(self.domain.unflattenPoints(flat))
+        return [self.pointWithElements(elements) for i in range(len(array))]
+
     def standardizeOnto(self, point, targetList):
         for element in self.elementsOfPoint(point):
             self.domain.standardizeOnto(element, targetList)
@@ -654,6 +925,13 @@ class Array(Domain):
         it = iter(lambda: self.domain.unstandardizeIterator(coords), None)
         return self.pointWithElements(it)
 
+    @cached_property
+    def affineStandardization(self):
+        affine = self.domain.affineStandardization
+        if affine is None:
+            return None
+        return tuple(np.tile(vector, self.numElements) for vector in affine)
+
     def partition(self, predicate):
         if self.numElements == 0:   # length-0 arrays count as leaves
             return super().partition(predicate)
@@ -719,6 +997,12 @@ class ScalarArray(Array):
         values = list(itertools.islice(coords, self.numElements))
         return np.reshape(np.array(values), self.shape)
 
+    def flattenPoints(self, points):
+        return np.array(points, dtype=float).reshape(len(points), self.numElements)
+
+    def unflattenPoints(self, array):
+        return [np.reshape(row, self.shape) for row in array]
+
     def __repr__(self):
         return f'ScalarArray({self.domain}, {self.shape})'
 
@@ -745,9 +1029,38 @@ class Struct(Domain):
         self.domains = tuple(self.domainNamed.values())
         self.makePoint = namedtuple('StructPoint', self.domainNamed.keys())
 
+    def distance(self, pointA, pointB):
+        """Sum of the distances between corresponding sub-points."""
+        return sum(domain.distance(subA, subB)
+                   for domain, subA, subB in zip(self.domains, pointA, pointB))
+
+    def pairwiseDistances(self, pointsA, pointsB):
+        distances = np.zeros((len(pointsA), len(pointsB)))
+        for i, domain in enumerate(self.domains):
+            distances += domain.pairwiseDistances([point[i] for point in pointsA],
+                                                  [point[i] for point in pointsB])
+        return distances
+
     def uniformPoint(self):
         return self.makePoint(*(d.uniformPoint() for d in self.domains))
 
+    def uniformPoints(self, n):
+        if not self.domains:
+            return [self.makePoint() for i in range(n)]
+        columns = [d.uniformPoints(n) for d in self.domains]
+        return [self.makePoint(*values) for values in zip(*columns)]
+
+    def uniformCandidates(self, n):
+        if not self.requiresRejection:
+            return self.uniformPoints(n), None
+        columns, accepted = [], np.ones(n, dtype=bool)
+        for domain in self.domains:
+            values, valuesAccepted = domain.uniformCandidates(n)
+            columns.append(values)
+            if valuesAccepted is not None:
+                accepted &= valuesAccepted
+        return [self.makePoint(*values) for values in zip(*columns)], accepted
+
     def flattenOnto(self, point, targetList):
         for subPoint, domain in zip(point, self.domains):
             domain.flattenOnto(subPoint, targetList)
@@ -756,33 +1069,59 @@ class Struct(Domain):
     def flattenedDimension(self):
         return sum(domain.flattenedDimension for domain in self.domains)
 
+    @cached_property
+    def flatLayout(self):
+        return tuple(coord.nested(f'.{name}', (name,))
+                     for name, domain in self.namedDomains
+                     for coord in domain.flatLayout)
+
+    @cached_property
+    def _fieldOffsets(self):
+        """Sub-domain and offset in flattened points of each field."""
+        offsets = {}
+        offset = 0
+        for name, domain in self.namedDomains:
+            offsets[name] = (domain, offset)
+            offset += domain.flattenedDimension
+        return offsets
+
     def meaningOfFlatCoordinate(self, index, pointName='point'):
         assert 0 <= index < self.flattenedDimension
-        for name, domain in self.namedDomains:
-            if index < domain.flattenedDimension:
-                subPoint = f'{pointName}.{name}'
-                return domain.meaningOfFlatCoordinate(index,
-                                                      pointName=subPoint)
-            index -= domain.flattenedDimension
+        return self.flatLayout[index].meaning(pointName)
 
     def pandasIndexForFlatCoordinate(self, index):
         assert 0 <= index < self.flattenedDimension
-        for name, domain in self.namedDomains:
-            if index < domain.flattenedDimension:
-                return (name,) + domain.pandasIndexForFlatCoordinate(index)
-            index -= domain.flattenedDimension
+        return self.flatLayout[index].pandasIndex
 
     def coordinateIsNumerical(self, index):
         assert 0 <= index < self.flattenedDimension
-        for name, domain in self.namedDomains:
-            if index < domain.flattenedDimension:
-                return domain.coordinateIsNumerical(index)
-            index -= domain.flattenedDimension
+        return self.flatLayout[index].isNumerical
 
     def unflattenIterator(self, coords):
         subPts = (domain.unflattenIterator(coords) for domain in self.domains)
         return self.makePoint(*subPts)
 
+    def flattenPoints(self, points):
+        array = np.empty((len(points), self.flattenedDimension))
+        offset = 0
+        for i, domain in enumerate(self.domains):
+            dim = domain.flattenedDimension
+            array[:, offset:offset+dim] = domain.flattenPoints(
+                [point[i] for point in points])
+            offset += dim
+        return array
+
+    def unflattenPoints(self, array):
+        columns = []
+        offset = 0
+        for domain in self.domains:
+            dim = domain.flattenedDimension
+            columns.append(domain.unflattenPoints(array[:, offset:offset+dim]))
+            offset += dim
+        if not columns:
+            return [self.makePoint() for i in range(len(array))]
+        return [self.makePoint(*values) for values in zip(*columns)]
+
     def standardizeOnto(self, point, targetList):
         for subPoint, domain in zip(point, self.domains):
             domain.standardizeOnto(subPoint, targetList)
@@ -813,6 +1152,15 @@ class Struct(Domain):
         subPts = (dom.unstandardizeIterator(coords) for dom in self.domains)
         return self.makePoint(*subPts)
 
+    @cached_property
+    def affineStandardization(self):
+        affines = [domain.affineStandardization for domain in self.domains]
+        if any(affine is None for affine in affines):
+            return None
+        if not affines:
+            return np.empty(0), np.empty(0)
+        return tuple(np.concatenate(vectors) for vectors in zip(*affines))
+
     def partition(self, predicate):
         leftSubs, rightSubs = {}, {}
         for name, domain in self.namedDomains:
@@ -853,11 +1201,32 @@ class Struct(Domain):
         return f'Struct({self.domainNamed})'
 
 class FilteredDomain(Domain):
-    """A domain filtered from another by an arbitrary function."""
+    """A domain filtered from another by an arbitrary function.
+
+    Args:
+        domain (Domain): the domain to filter.
+        filterFunction (function): predicate saying whether a point of the
+          underlying domain belongs to this one.
+        batchFilter (function; optional): vectorized version of the
+          predicate, taking an array whose rows are points of the underlying
+          domain flattened as by `Domain.flattenPoints`, and returning a
+          boolean array. If given, it is used when filtering many points at
+          once (e.g. by `uniformPoints` and `RejectionSampler`).
+    """
 
-    def __init__(self, domain, filterFunction):
+    #: Number of candidates drawn per point before `uniformPoints` gives up.
+    maxRejections = 1000
+
+    def __init__(self, domain, filterFunction, batchFilter=None):
         self.domain = domain
         self.filter = filterFunction
+        self.batchFilter = batchFilter
+
+    def distance(self, pointA, pointB):
+        return self.domain.distance(pointA, pointB)
+
+    def pairwiseDistances(self, pointsA, pointsB):
+        return self.domain.pairwiseDistances(pointsA, pointsB)
 
     def uniformPoint(self):
         sample = self.domain.uniformPoint()
@@ -866,6 +1235,48 @@ class FilteredDomain(Domain):
         else:
             raise RejectionException
 
+    def uniformPoints(self, n):
+        statistics = AcceptanceRate()
+        points = []
+        while len(points) < n:
+            if statistics.candidates >= self.maxRejections * n:
+                raise RejectionException
+            size = statistics.blockSize(n - len(points))
+            candidates, accepted = self.uniformCandidates(size)
+            accepted = np.flatnonzero(accepted)
+            statistics.record(size, len(accepted))
+            points.extend(candidates[i] for i in accepted[:n - len(points)])
+        return points
+
+    def uniformCandidates(self, n):
+        domain = self.domain
+        if self.batchFilter is not None and not domain.requiresRejection:
+            # filter the flattened candidates, building only accepted points
+            flat = domain.uniformFlatPoints(n)
+            accepted = self._batchFiltered(flat)
+            indices = np.flatnonzero(accepted)
+            points = [None] * n
+            for i, point in zip(indices, domain.unflattenPoints(flat[indices])):
+                points[i] = point
+            return points, accepted
+        points, accepted = domain.uniformCandidates(n)
+        if accepted is None:
+            return points, self.filterPoints(points)
+        indices = np.flatnonzero(accepted)
+        accepted[indices] = self.filterPoints([points[i] for i in indices])
+        return points, accepted
+
+    def filterPoints(self, points):
+        """Boolean array saying which points of the underlying domain are in this one."""
+        if self.batchFilter is not None:
+            if not points:
+                return np.zeros(0, dtype=bool)
+            return self._batchFiltered(self.domain.flattenPoints(points))
+        return np.fromiter(map(self.filter, points), dtype=bool, count=len(points))
+
+    def _batchFiltered(self, flat):
+        return np.asarray(self.batchFilter(flat), dtype=bool).reshape(len(flat))
+
     def flattenOnto(self, point, targetList):
         self.domain.flattenOnto(point, targetList)
 
@@ -873,6 +1284,10 @@ class FilteredDomain(Domain):
     def flattenedDimension(self):
         return self.domain.flattenedDimension
 
+    @cached_property
+    def flatLayout(self):
+        return self.domain.flatLayout
+
     def meaningOfFlatCoordinate(self, index, pointName='point'):
         return self.domain.meaningOfFlatCoordinate(index,
                                                    pointName=pointName)
@@ -886,6 +1301,12 @@ class FilteredDomain(Domain):
     def unflattenIterator(self, coords):
         return self.domain.unflattenIterator(coords)
 
+    def flattenPoints(self, points):
+        return self.domain.flattenPoints(points)
+
+    def unflattenPoints(self, array):
+        return self.domain.unflattenPoints(array)
+
     @cached_property
     def requiresRejection(self):
         return True
@@ -900,7 +1321,8 @@ class FilteredDomain(Domain):
     def __eq__(self, other):
         if type(other) is not FilteredDomain:
             return NotImplemented
-        return (self.domain == other.domain and self.filter == other.filter)
+        return (self.domain == other.domain and self.filter == other.filter
+                and self.batchFilter == other.batchFilter)
 
     def __hash__(self):
         return hash((self.domain, self.filter))
@@ -966,6 +1388,18 @@ class Feature:
         else:
             return self.distanceMetric(valueA, valueB)
 
+    def pairwiseDistances(self, valuesA, valuesB):
+        """Matrix of distances between two lists of values of this feature.
+
+        Uses the vectorized `Domain.pairwiseDistances` unless the feature has
+        a custom distance metric or is a feature list.
+        """
+        if self.distanceMetric is None and not self.lengthDomain:
+            return self.domain.pairwiseDistances(valuesA, valuesB)
+        distances = [[self.distance(valueA, valueB) for valueB in valuesB]
+                     for valueA in valuesA]
+        return np.array(distances, dtype=float).reshape(len(valuesA), len(valuesB))
+
     @staticmethod
     def _timeExpandDomain(domain, timeBound):
         return domain
@@ -1096,6 +1530,236 @@ class CompletedSample(_SampleBase):
     def __hash__(self):
         return hash((self.staticSample, self.dynamicSamples))
 
+class CompactSample(_SampleBase):
+    """A completed sample stored as a single NumPy array of coordinates.
+
+    Created with `FeatureSpace.compactSample`. Features are accessed as for a
+    `CompletedSample`, e.g. ``sample.egoCar.position[0]``, but values in
+    Structs, Arrays and feature lists are lazy views into the array: only the
+    parts of the sample which are used get converted back into Python objects.
+    Storing, hashing and pickling the sample then only involves the array.
+
+    CompactSamples compare equal to each other when they have the same values;
+    use `expand` to compare them with ordinary `CompletedSample` objects.
+    """
+
+    def __init__(self, space, data, duration, dynamicSampleLengths):
+        super().__init__(space, dynamicSampleLengths)
+        self.data = data
+        self.duration = duration
+        self._hash = None
+
+    def __getattr__(self, attr):
+        space = super().__getattribute__('space')
+        layout = space._compactLayout
+        if attr in space.staticFeatureNamed:
+            feature, offset = layout.static[attr]
+            if feature.lengthDomain:
+                return _CompactListView(feature.domain, self.data, offset)
+            return _compactView(feature.domain, self.data, offset)
+        elif attr in space.dynamicFeatureNamed:
+            return _CompactTimeSeriesView(self, attr)
+        else:
+            return super().__getattribute__(attr)
+
+    @property
+    def staticSample(self):
+        space = self.space
+        values = (_compactValue(getattr(self, name))
+                  for name in space.staticFeatureNamed)
+        return space.makeStaticPoint(*values)
+
+    @property
+    def dynamicSamples(self):
+        space = self.space
+        series = [getattr(self, name) for name in space.dynamicFeatureNamed]
+        return tuple(
+            space.makeDynamicPoint(*(_compactValue(values[time])
+                                     for values in series))
+            for time in range(self.duration)
+        )
+
+    def expand(self):
+        """Convert this sample into an ordinary `CompletedSample`."""
+        return CompletedSample(self.staticSample, self.dynamicSamples, self.space,
+                               dict(self.dynamicSampleLengths))
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactSample):
+            return False
+        return (np.array_equal(self.data, other.data, equal_nan=True)
+                and self.duration == other.duration
+                and self.dynamicSampleLengths == other.dynamicSampleLengths)
+
+    def __hash__(self):
+        if self._hash is None:
+            # adding 0 identifies -0.0 with 0.0, as for the floats themselves
+            self._hash = hash(((self.data + 0.0).tobytes(), self.duration))
+        return self._hash
+
+    def __getstate__(self):
+        return (self.space, self.data, self.duration, self.dynamicSampleLengths)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return f'CompactSample({self.staticSample}, {self.dynamicSamples})'
+
+class _CompactLayout:
+    """Positions of the features of a `FeatureSpace` within a `CompactSample`.
+
+    Derived from `FeatureSpace.flatLayout`. The static features come first,
+    laid out as in points flattened with fixedDimension=True. They are
+    followed by one block per time step, in which each time series feature
+    takes a fixed number of coordinates (enough for the maximum length of
+    feature lists).
+    """
+    def __init__(self, space):
+        sizes = Counter(coord.pandasIndex[0] for coord in space.flatLayout)
+        self.static = {}
+        offset = 0
+        for name, feature in space.staticFeatureNamed.items():
+            self.static[name] = (feature, offset)
+            offset += sizes[name]
+        self.staticDimension = offset
+        self.dynamic = {}
+        offset = 0
+        for name, feature in space.dynamicFeatureNamed.items():
+            self.dynamic[name] = (feature, offset)
+            # flatLayout has the length of a feature list once, followed by
+            # the elements for every time step; here each step has its length
+            length = 1 if feature.lengthDomain else 0
+            offset += length + (sizes[name] - length) // space.timeBound
+        self.stepSize = offset
+
+def _flattenCompactOnto(feature, value, length, targetList):
+    domain = feature.domain
+    if feature.lengthDomain:
+        targetList.append(length)
+        for element in value:
+            domain.flattenOnto(element, targetList)
+        padding = (feature.maxLength - length) * domain.flattenedDimension
+        targetList.extend(None for i in range(padding))
+    else:
+        domain.flattenOnto(value, targetList)
+
+def _compactView(domain, data, offset):
+    """Lazy view of a point of the given domain stored in a `CompactSample`."""
+    while isinstance(domain, FilteredDomain):
+        domain = domain.domain
+    if isinstance(domain, Struct):
+        return _CompactStructView(domain, data, offset)
+    elif isinstance(domain, Array):
+        return _CompactArrayView(domain.domain, domain.shape, data, offset)
+    else:
+        dim = domain.flattenedDimension
+        return domain.unflattenPoints(data[offset:offset+dim].reshape(1, dim))[0]
+
+def _compactValue(value):
+    """Convert a view from a `CompactSample` into an ordinary point."""
+    if isinstance(value, _CompactView):
+        return value.value()
+    return value
+
+class _CompactView:
+    __slots__ = ()
+
+    def value(self):
+        """The point viewed, as an ordinary Python object."""
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return self.value() == _compactValue(other)
+
+    def __hash__(self):
+        return hash(self.value())
+
+    def __repr__(self):
+        return repr(self.value())
+
+class _CompactStructView(_CompactView):
+    __slots__ = ('_domain', '_data', '_offset')
+
+    def __init__(self, domain, data, offset):
+        self._domain, self._data, self._offset = domain, data, offset
+
+    def __getattr__(self, attr):
+        try:
+            domain, offset = self._domain._fieldOffsets[attr]
+        except KeyError:
+            raise AttributeError(attr) from None
+        return _compactView(domain, self._data, self._offset + offset)
+
+    def value(self):
+        dim = self._domain.flattenedDimension
+        array = self._data[self._offset:self._offset+dim].reshape(1, dim)
+        return self._domain.unflattenPoints(array)[0]
+
+class _CompactSequenceView(_CompactView, Sequence):
+    """View of a sequence of points stored consecutively."""
+    __slots__ = ()
+
+    def _element(self, i):
+        raise NotImplementedError
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self._element(j) for j in range(*i.indices(len(self))))
+        length = len(self)
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError('index out of range')
+        return self._element(i)
+
+    def value(self):
+        return tuple(_compactValue(self._element(i)) for i in range(len(self)))
+
+class _CompactArrayView(_CompactSequenceView):
+    __slots__ = ('_domain', '_shape', '_data', '_offset', '_stride')
+
+    def __init__(self, domain, shape, data, offset):
+        self._domain, self._shape = domain, shape
+        self._data, self._offset = data, offset
+        self._stride = math.prod(shape[1:]) * domain.flattenedDimension
+
+    def __len__(self):
+        return self._shape[0]
+
+    def _element(self, i):
+        offset = self._offset + i * self._stride
+        if len(self._shape) == 1:
+            return _compactView(self._domain, self._data, offset)
+        return _CompactArrayView(self._domain, self._shape[1:], self._data, offset)
+
+class _CompactListView(_CompactArrayView):
+    """View of a feature list: its length followed by its (padded) elements."""
+    __slots__ = ()
+
+    def __init__(self, domain, data, offset):
+        super().__init__(domain, (int(data[offset]),), data, offset + 1)
+
+class _CompactTimeSeriesView(_CompactSequenceView):
+    __slots__ = ('_sample', '_feature', '_offset')
+
+    def __init__(self, sample, name):
+        layout = sample.space._compactLayout
+        self._sample = sample
+        self._feature, offset = layout.dynamic[name]
+        self._offset = layout.staticDimension + offset
+
+    def __len__(self):
+        return self._sample.duration
+
+    def _element(self, i):
+        layout = self._sample.space._compactLayout
+        offset = self._offset + i * layout.stepSize
+        data = self._sample.data
+        if self._feature.lengthDomain:
+            return _CompactListView(self._feature.domain, data, offset)
+        return _compactView(self._feature.domain, data, offset)
+
 class _PrecomputedSample(Sample):
     """A precompleted sample, which has fully computed static and dynamic points.
 
@@ -1128,17 +1792,37 @@ class _PrecomputedSample(Sample):
         if self._i >= self.space.timeBound:
             raise RuntimeError("Exceeded `timeBound` of `FeatureSpace`")
         
-        assert self._i < len(self._dynamicSampleList)
-
-        dynamic_sample = self._dynamicSampleList[self._i]
+        dynamic_sample = self._dynamicPoint(self._i)
         self._i += 1
 
         return dynamic_sample
 
+    def _dynamicPoint(self, time):
+        assert time < len(self._dynamicSampleList)
+        return self._dynamicSampleList[time]
+
     def complete(self, rho):
         self._completeCallback(rho)
         return super().complete(rho)
 
+class _LazySample(_PrecomputedSample):
+    """A sample whose dynamic points are only generated when requested.
+
+    Note: This class is an implementation detail, and one should only assume the `Sample` API
+    with it.
+
+    Args are as for `_PrecomputedSample`, except that instead of a list of
+    dynamic points, makeDynamicPoint is a function taking a time step and
+    returning the dynamic point for it. It is called once for each time
+    step, in order, as `getDynamicSample` is called.
+    """
+    def __init__(self, space, staticSample, makeDynamicPoint, completeCallback, dynamicSampleLengths):
+        super().__init__(space, staticSample, None, completeCallback, dynamicSampleLengths)
+        self._makeDynamicPoint = makeDynamicPoint
+
+    def _dynamicPoint(self, time):
+        return self._makeDynamicPoint(time)
+
 class FeatureSpace:
     """A space consisting of named features.
 
@@ -1147,6 +1831,8 @@ class FeatureSpace:
         distanceMetric (function; optional): An optional distance metric to be used with this space.
         timeBound (int; optional): An upper bound on the number of timesteps of a simulation using
             this space.
+        maxCachedDomains (int; optional): If not None, the maximum number of
+            fixed-length Domains kept in `domains` (see below).
 
     .. testcode::
 
@@ -1157,7 +1843,7 @@ class FeatureSpace:
         })
     """
 
-    def __init__(self, features, distanceMetric=None, timeBound=0):
+    def __init__(self, features, distanceMetric=None, timeBound=0, maxCachedDomains=None):
         self.namedFeatures = tuple(sorted(features.items(), key=lambda i: i[0]))
         self.featureNamed = OrderedDict(self.namedFeatures)
         self.features = tuple(self.featureNamed.values())
@@ -1174,6 +1860,7 @@ class FeatureSpace:
 
         self.distanceMetric = distanceMetric
         self.timeBound = timeBound
+        self.maxCachedDomains = maxCachedDomains
 
         if len(self.dynamicFeatureNamed) > 0 and self.timeBound == 0:
             raise ValueError("must specify timeBound when creating a FeatureSpace with a TimeSeriesFeature")
@@ -1183,16 +1870,54 @@ class FeatureSpace:
         """Return the expanded domain or domains associated with this space.
 
         Returns a pair consisting of the Domain of all lengths of feature
-        lists, plus a dict mapping each (flattened) point in that Domain to the
+        lists, plus a mapping from each (flattened) point in that Domain to the
         corresponding Domain of other features. If the FeatureSpace has no
         feature lists, then returns (None, dom) where dom is the fixed Domain
         of all features. If any Features are TimeSeriesFeatures then they are
         expanded to a max of timeBound.
+
+        The number of combinations of lengths can be huge, so the mapping is a
+        `LazyMapping` which only builds the Domain for a combination when it is
+        looked up, keeping at most ``maxCachedDomains`` of them.
+        """
+        return self._expandedDomains(includeTimeSeries=True)
+
+    @cached_property
+    def staticDomains(self):
+        """Like `domains`, but leaving out the TimeSeriesFeatures.
+
+        The Domain of lengths still includes the lengths of lists of
+        TimeSeriesFeatures, so that the mapping has the same keys as for
+        `domains`. Used to sample time series one time step at a time,
+        without expanding them to timeBound (see `timeStepDomain`).
         """
+        return self._expandedDomains(includeTimeSeries=False)
+
+    def timeStepDomain(self, dynamicSampleLengths):
+        """Domain of the values of all TimeSeriesFeatures at a single time step.
+
+        Args:
+            dynamicSampleLengths (dict): the length of each list of
+              TimeSeriesFeatures, as in `Sample.dynamicSampleLengths`.
+        """
+        domains = {}
+        for name, feature in self.dynamicFeatureNamed.items():
+            if feature.lengthDomain:
+                length = dynamicSampleLengths[name]
+                domains[name] = Array(feature.domain, (length,))
+            else:
+                domains[name] = feature.domain
+        return Struct(domains)
+
+    def _expandedDomains(self, includeTimeSeries):
         fixedDomains = {}
         lengthDomains = {}
         variableDomains = {}
         for name, feature in self.namedFeatures:
+            if not includeTimeSeries and name in self.dynamicFeatureNamed:
+                if feature.lengthDomain:
+                    lengthDomains[name] = feature.lengthDomain
+                continue
             if feature.lengthDomain:
                 lengthDomains[name] = feature.lengthDomain
                 variableDomains[name] = feature.fixedDomains(self.timeBound)
@@ -1201,28 +1926,86 @@ class FeatureSpace:
         if len(lengthDomains) == 0:
             return (None, Struct(fixedDomains))
         lengthDomain = Struct(lengthDomains)
-        domainForLengths = {}
-        for lengths in lengthDomain:
+        intervals = tuple(domain.intervals[0] for domain in lengthDomain.domains)
+        def isLengths(lengths):
+            try:
+                return (len(lengths) == len(intervals)
+                        and all(len(length) == 1 and left <= length[0] <= right
+                                for length, (left, right) in zip(lengths, intervals)))
+            except TypeError:
+                return False
+        def domainForLengths(lengths):
             domains = dict(fixedDomains)
             # add domains for all feature lists with nonzero lengths
-            for name, length in zip(lengths._fields, lengths):
-                vdomains = variableDomains[name]
+            for name, length in zip(lengthDomain.domainNamed, lengths):
+                vdomains = variableDomains.get(name)
+                if vdomains is None:    # time series left out
+                    continue
                 length = length[0]
                 domains[name] = vdomains[length]
             # combine domains into whole domain for this assignment of lengths
-            domainForLengths[lengths] = Struct(domains)
-        return (lengthDomain, domainForLengths)
+            return Struct(domains)
+        size = math.prod(right - left + 1 for left, right in intervals)
+        domains = LazyMapping(lengthDomain.__iter__, size, isLengths,
+                              domainForLengths, maxSize=self.maxCachedDomains)
+        return (lengthDomain, domains)
 
     def distance(self, pointA, pointB):
         distances = tuple(
             feature.distance(subptA, subptB)
-            for feature, subptA, subptB in zip(self.features, pointA, pointB)
+            for feature, subptA, subptB in zip(self.staticFeatureNamed.values(),
+                                               pointA, pointB)
         )
         if self.distanceMetric is None:
             return np.linalg.norm(distances)
         else:
             return self.distanceMetric(distances)
 
+    def pairwiseDistances(self, samplesA, samplesB):
+        """Matrix of distances between two lists of samples from this space.
+
+        Entry (i, j) is ``distance(samplesA[i], samplesB[j])``, computed for
+        all pairs at once feature by feature. The samples can be static points
+        or `Sample`/`CompletedSample` objects, of which only the static
+        features are compared.
+        """
+        pointsA = [self._staticPointOf(sample) for sample in samplesA]
+        pointsB = [self._staticPointOf(sample) for sample in samplesB]
+        perFeature = [
+            feature.pairwiseDistances([point[i] for point in pointsA],
+                                      [point[i] for point in pointsB])
+            for i, feature in enumerate(self.staticFeatureNamed.values())
+        ]
+        if not perFeature:
+            return np.zeros((len(pointsA), len(pointsB)))
+        perFeature = np.stack(perFeature, axis=-1)
+        if self.distanceMetric is None:
+            return np.sqrt(np.sum(perFeature * perFeature, axis=-1))
+        metric = self.distanceMetric
+        distances = [[metric(tuple(pair)) for pair in row]
+                     for row in perFeature.tolist()]
+        return np.array(distances, dtype=float).reshape(len(pointsA), len(pointsB))
+
+    def nearestNeighbors(self, query, samples, k=1):
+        """The k samples closest to the query sample (see `pairwiseDistances`).
+
+        Returns a pair of arrays giving the indices of those samples in
+        ``samples``, and their distances to the query, in order of increasing
+        distance.
+        """
+        distances = self.pairwiseDistances([query], samples)[0]
+        k = min(k, len(distances))
+        if k < len(distances):
+            nearest = np.argpartition(distances, k)[:k]
+        else:
+            nearest = np.arange(len(distances))
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        return nearest, distances[nearest]
+
+    @staticmethod
+    def _staticPointOf(sample):
+        return sample.staticSample if isinstance(sample, _SampleBase) else sample
+
     def flatten(self, point, fixedDimension=False):
         """Flatten a point in this space. See Domain.flatten.
 
@@ -1230,23 +2013,12 @@ class FeatureSpace:
         lists had their maximum lengths and time steps, with None as a placeholder.
         This means that all points in the space will flatten to the same length.
         """
+        if isinstance(point, CompactSample):
+            point = point.expand()
         assert isinstance(point, CompletedSample)
 
         flattened = []
-        for feature, value in zip(self.staticFeatureNamed.values(), point.staticSample):
-            domain = feature.domain
-            if feature.lengthDomain:
-                length = len(value)
-                flattened.append(length)
-                fixedDomain = feature.fixedDomains(None)[length]
-                fixedDomain.flattenOnto(value, flattened)
-                if fixedDimension:      # add padding to maximum length
-                    sizePerElt = domain.flattenedDimension
-                    needed = (feature.maxLength - length) * sizePerElt
-                    for i in range(needed):
-                        flattened.append(None)
-            else:
-                domain.flattenOnto(value, flattened)
+        self._flattenStaticOnto(point.staticSample, flattened, fixedDimension)
 
         if self.hasTimeSeries:
             duration = len(point.dynamicSamples)
@@ -1286,6 +2058,138 @@ class FeatureSpace:
             assert len(flattened_point) == self.fixedFlattenedDimension
         return tuple(flattened)
 
+    def flattenBatch(self, samples):
+        """Flatten a list of `CompletedSample` objects into a 2D array.
+
+        Equivalent to calling `flatten` with fixedDimension=True on each sample
+        and stacking the results, but flattens each feature for all samples at
+        once. Returns a masked array of floats with one row per sample and
+        `fixedFlattenedDimension` columns; the padding of feature lists shorter
+        than their maximum length (None in `flatten`) is masked, and NaN in the
+        underlying data. Categorical values are flattened to their indices.
+
+        Spaces with `TimeSeriesFeature` objects are not supported.
+        """
+        if self.hasTimeSeries:
+            raise RuntimeError('flattenBatch does not support TimeSeriesFeatures')
+        n = len(samples)
+        data = np.empty((n, self.fixedFlattenedDimension))
+        mask = np.zeros(data.shape, dtype=bool)
+        static = self._compactLayout.static.values()
+        for i, (feature, offset) in enumerate(static):
+            values = [sample.staticSample[i] for sample in samples]
+            domain = feature.domain
+            dim = domain.flattenedDimension
+            if not feature.lengthDomain:
+                data[:, offset:offset+dim] = domain.flattenPoints(values)
+                continue
+            lengths = np.array([len(value) for value in values], dtype=int)
+            data[:, offset] = lengths
+            rows, positions = self._listPositions(lengths)
+            elements = domain.flattenPoints([elt for value in values for elt in value])
+            block = np.full((n, feature.maxLength, dim), np.nan)
+            block[rows, positions] = elements
+            blockMask = np.ones(block.shape, dtype=bool)
+            blockMask[rows, positions] = False
+            width = feature.maxLength * dim
+            data[:, offset+1:offset+1+width] = block.reshape(n, width)
+            mask[:, offset+1:offset+1+width] = blockMask.reshape(n, width)
+        return np.ma.MaskedArray(data, mask=mask)
+
+    def unflattenBatch(self, array):
+        """Inverse of `flattenBatch`, returning a list of `CompletedSample` objects.
+
+        Padding entries are ignored, so they need not be masked.
+        """
+        if self.hasTimeSeries:
+            raise RuntimeError('unflattenBatch does not support TimeSeriesFeatures')
+        data = np.ma.getdata(array)
+        if data.ndim != 2 or data.shape[1] != self.fixedFlattenedDimension:
+            raise RuntimeError(f'array to unflatten has shape {data.shape}, '
+                               f'expected (n, {self.fixedFlattenedDimension})')
+        n = len(data)
+        columns = []
+        for feature, offset in self._compactLayout.static.values():
+            domain = feature.domain
+            dim = domain.flattenedDimension
+            if not feature.lengthDomain:
+                columns.append(domain.unflattenPoints(data[:, offset:offset+dim]))
+                continue
+            lengths = np.rint(data[:, offset]).astype(int)
+            rows, positions = self._listPositions(lengths)
+            width = feature.maxLength * dim
+            block = data[:, offset+1:offset+1+width].reshape(n, feature.maxLength, dim)
+            elements = domain.unflattenPoints(block[rows, positions])
+            ends = np.cumsum(lengths).tolist()
+            starts = [0] + ends[:-1]
+            columns.append([tuple(elements[start:end])
+                            for start, end in zip(starts, ends)])
+        if not columns:
+            staticSamples = [self.makeStaticPoint() for i in range(n)]
+        else:
+            staticSamples = [self.makeStaticPoint(*values) for values in zip(*columns)]
+        return [CompletedSample(staticSample, [], self, {})
+                for staticSample in staticSamples]
+
+    def compactSample(self, sample):
+        """Convert a `CompletedSample` into a `CompactSample`.
+
+        The compact form stores the whole sample in one NumPy array, which
+        takes much less memory for samples with large Arrays, feature lists or
+        time series; use `CompactSample.expand` to convert it back.
+        """
+        layout = self._compactLayout
+        flattened = []
+        for name, value in zip(self.staticFeatureNamed, sample.staticSample):
+            feature = self.staticFeatureNamed[name]
+            length = len(value) if feature.lengthDomain else None
+            _flattenCompactOnto(feature, value, length, flattened)
+        lengths = sample.dynamicSampleLengths
+        for dynamicPoint in sample.dynamicSamples:
+            for name, value in zip(self.dynamicFeatureNamed, dynamicPoint):
+                feature = self.dynamicFeatureNamed[name]
+                _flattenCompactOnto(feature, value, lengths.get(name), flattened)
+        data = np.array(flattened, dtype=float)
+        return CompactSample(self, data, len(sample.dynamicSamples), dict(lengths))
+
+    @cached_property
+    def _compactLayout(self):
+        return _CompactLayout(self)
+
+    @staticmethod
+    def _listPositions(lengths):
+        """Sample and position within its list of each element of feature lists."""
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        positions = np.arange(len(rows)) - np.repeat(starts, lengths)
+        return rows, positions
+
+    def flattenStaticSample(self, staticSample):
+        """Flatten the static part of a sample (e.g. `Sample.staticSample`).
+
+        This is the prefix of the vector returned by `flatten`, and can be
+        inverted with `unflattenStaticSample`.
+        """
+        flattened = []
+        self._flattenStaticOnto(staticSample, flattened, False)
+        return tuple(flattened)
+
+    def _flattenStaticOnto(self, staticSample, flattened, fixedDimension):
+        for feature, value in zip(self.staticFeatureNamed.values(), staticSample):
+            domain = feature.domain
+            if feature.lengthDomain:
+                length = len(value)
+                flattened.append(length)
+                fixedDomain = feature.fixedDomains(None)[length]
+                fixedDomain.flattenOnto(value, flattened)
+                if fixedDimension:      # add padding to maximum length
+                    sizePerElt = domain.flattenedDimension
+                    needed = (feature.maxLength - length) * sizePerElt
+                    for i in range(needed):
+                        flattened.append(None)
+            else:
+                domain.flattenOnto(value, flattened)
+
     @cached_property
     def fixedFlattenedDimension(self):
         """Length of vector returned by flatten with fixedDimension=True.
@@ -1305,64 +2209,52 @@ class FeatureSpace:
                 dim += timeMult * domain.flattenedDimension
         return dim
 
-    def meaningOfFlatCoordinate(self, index, pointName='point'):
-        """Meaning of a coordinate of a flattened point in this space.
+    @cached_property
+    def flatLayout(self):
+        """Tuple of `FlatCoordinate` describing each coordinate of flattened points.
 
-        See the corresponding function of Domain. Works only for points
-        flattened with fixedDimension=True, since otherwise a given index can
-        have different meaning depending on the lengths of feature lists.
+        Like Domain.flatLayout, for points flattened with fixedDimension=True.
         """
-        assert 0 <= index < self.fixedFlattenedDimension
-        for name, feature in self.staticFeatureNamed.items():
+        layout = []
+        def addFeature(name, feature, steps):
             domain = feature.domain
             if feature.lengthDomain:
-                if index == 0:
-                    return f'len({pointName}.{name})'
+                if steps is None:
+                    length = FlatCoordinate('len(', f'.{name})', (name, 'length'),
+                                            True, None)
                 else:
-                    index -= 1
-                    elem = index // domain.flattenedDimension
-                    if elem < feature.maxLength:
-                        subIndex = index % domain.flattenedDimension
-                        subPoint = f'{pointName}.{name}[{elem}]'
-                        return domain.meaningOfFlatCoordinate(subIndex,
-                            pointName=subPoint)
-                    index -= feature.maxLength * domain.flattenedDimension
-            else:
-                if index < domain.flattenedDimension:
-                    subPoint = f'{pointName}.{name}'
-                    return domain.meaningOfFlatCoordinate(index,
-                                                          pointName=subPoint)
-                index -= domain.flattenedDimension
+                    length = FlatCoordinate('', f'.dynamicSampleLengths["{name}"]',
+                                            (name, 'length'), True, None)
+                layout.append(length)
+            for step in ('',) if steps is None else steps:
+                if feature.lengthDomain:
+                    for elem in range(feature.maxLength):
+                        layout.extend(coord.nested(f'.{name}{step}[{elem}]', (name, elem))
+                                      for coord in domain.flatLayout)
+                else:
+                    layout.extend(coord.nested(f'.{name}{step}', (name,))
+                                  for coord in domain.flatLayout)
 
-        if index == 0:
-            return f'len({pointName}.dynamicSampleHistory)'
-        index -= 1
+        for name, feature in self.staticFeatureNamed.items():
+            addFeature(name, feature, None)
+        if self.hasTimeSeries:
+            layout.append(FlatCoordinate('len(', '.dynamicSampleHistory)',
+                                         ('dynamicSamples', 'length'), True, None))
+            steps = [f'[{time_i}]' for time_i in range(self.timeBound)]
+            for name, feature in self.dynamicFeatureNamed.items():
+                addFeature(name, feature, steps)
+        assert len(layout) == self.fixedFlattenedDimension
+        return tuple(layout)
 
-        for name, feature in self.dynamicFeatureNamed.items():
-            domain = feature.domain
-            if feature.lengthDomain:
-                if index == 0:
-                    return f'{pointName}.dynamicSampleLengths["{name}"]'
-                else:
-                    index -= 1
-                    for time_i in range(self.timeBound):
-                        elem = index // domain.flattenedDimension
-                        if elem < feature.maxLength:
-                            subIndex = index % domain.flattenedDimension
-                            subPoint = f'{pointName}.{name}[{time_i}][{elem}]'
-                            return domain.meaningOfFlatCoordinate(subIndex,
-                                pointName=subPoint)
-                        index -= feature.maxLength * domain.flattenedDimension
-            else:
-                index -= 1
-                for time_i in range(self.timeBound):
-                    if index < domain.flattenedDimension:
-                        subPoint = f'{pointName}.{name}[{time_i}]'
-                        return domain.meaningOfFlatCoordinate(index,
-                                                            pointName=subPoint)
-                    index -= domain.flattenedDimension
+    def meaningOfFlatCoordinate(self, index, pointName='point'):
+        """Meaning of a coordinate of a flattened point in this space.
 
-        raise RuntimeError('impossible index arithmetic')
+        See the corresponding function of Domain. Works only for points
+        flattened with fixedDimension=True, since otherwise a given index can
+        have different meaning depending on the lengths of feature lists.
+        """
+        assert 0 <= index < self.fixedFlattenedDimension
+        return self.flatLayout[index].meaning(pointName)
 
     def pandasIndexForFlatCoordinate(self, index):
         """Pandas index of a coordinate of a flattened point in this space.
@@ -1370,52 +2262,7 @@ class FeatureSpace:
         See meaningOfFlatCoordinate, and Domain.pandasIndexForFlatCoordinate.
         """
         assert 0 <= index < self.fixedFlattenedDimension
-        for name, feature in self.staticFeatureNamed.items():
-            domain = feature.domain
-            if feature.lengthDomain:
-                if index == 0:
-                    return (name, 'length')
-                else:
-                    index -= 1
-                    elem = index // domain.flattenedDimension
-                    if elem < feature.maxLength:
-                        subIndex = index % domain.flattenedDimension
-                        panda = domain.pandasIndexForFlatCoordinate(subIndex)
-                        return (name, elem) + panda
-                    index -= feature.maxLength * domain.flattenedDimension
-            else:
-                if index < domain.flattenedDimension:
-                    panda = domain.pandasIndexForFlatCoordinate(index)
-                    return (name,) + panda
-                index -= domain.flattenedDimension
-
-        if index == 0:
-            return ("dynamicSamples", "length")
-        index -= 1
-
-        for name, feature in self.dynamicFeatureNamed.items():
-            domain = feature.domain
-            if feature.lengthDomain:
-                if index == 0:
-                    return (name, 'length')
-                else:
-                    index -= 1
-                    for time_i in range(self.timeBound):
-                        elem = index // domain.flattenedDimension
-                        if elem < feature.maxLength:
-                            subIndex = index % domain.flattenedDimension
-                            panda = domain.pandasIndexForFlatCoordinate(subIndex)
-                            return (name, elem) + panda
-                        index -= feature.maxLength * domain.flattenedDimension
-            else:
-                for time_i in range(self.timeBound):
-                    if index < domain.flattenedDimension:
-                        panda = domain.pandasIndexForFlatCoordinate(index)
-                        return (name,) + panda
-                    index -= domain.flattenedDimension
-
-        raise RuntimeError('impossible index arithmetic')
-
+        return self.flatLayout[index].pandasIndex
 
     def coordinateIsNumerical(self, index):
         """Whether the value of a coordinate is intrinsically numerical.
@@ -1423,68 +2270,12 @@ class FeatureSpace:
         See meaningOfFlatCoordinate, and Domain.coordinateIsNumerical.
         """
         assert 0 <= index < self.fixedFlattenedDimension
-        for name, feature in self.staticFeatureNamed.items():
-            domain = feature.domain
-            if feature.lengthDomain:
-                if index == 0:
-                    return True
-                else:
-                    index -= 1
-                    elem = index // domain.flattenedDimension
-                    if elem < feature.maxLength:
-                        subIndex = index % domain.flattenedDimension
-                        return domain.coordinateIsNumerical(subIndex)
-                    index -= feature.maxLength * domain.flattenedDimension
-            else:
-                if index < domain.flattenedDimension:
-                    return domain.coordinateIsNumerical(index)
-                index -= domain.flattenedDimension
-
-        if index == 0:
-            return True
-        index -= 1
-
-        for name, feature in self.dynamicFeatureNamed.items():
-            domain = feature.domain
-            if feature.lengthDomain:
-                if index == 0:
-                    return True
-                else:
-                    index -= 1
-                    for time_i in range(self.timeBound):
-                        elem = index // domain.flattenedDimension
-                        if elem < feature.maxLength:
-                            subIndex = index % domain.flattenedDimension
-                            return domain.coordinateIsNumerical(subIndex)
-                        index -= feature.maxLength * domain.flattenedDimension
-            else:
-                for time_i in range(self.timeBound):
-                    if index < domain.flattenedDimension:
-                        return domain.coordinateIsNumerical(index)
-                    index -= domain.flattenedDimension
-
-        raise RuntimeError('impossible index arithmetic')
+        return self.flatLayout[index].isNumerical
 
     def unflatten(self, coords, fixedDimension=False):
         """Unflatten a tuple of coordinates to a point in this space."""
-        staticValues = []
         iterator = iter(coords)
-
-        for feature in self.staticFeatureNamed.values():
-            domain = feature.domain
-            if feature.lengthDomain:
-                length = next(iterator)
-                fixedDomain = feature.fixedDomains(None)[length]
-                staticValues.append(fixedDomain.unflattenIterator(iterator))
-                if fixedDimension:      # consume padding
-                    sizePerElt = domain.flattenedDimension
-                    needed = (feature.maxLength - length) * sizePerElt
-                    for i in range(needed):
-                        next(iterator)
-            else:
-                staticValues.append(domain.unflattenIterator(iterator))
-
-        staticSample = self.makeStaticPoint(*staticValues)
+        staticSample = self._unflattenStaticIterator(iterator, fixedDimension)
 
         if self.hasTimeSeries:
             duration = next(iterator)
@@ -1524,6 +2315,27 @@ class FeatureSpace:
 
         return sample
 
+    def unflattenStaticSample(self, coords):
+        """Inverse of `flattenStaticSample`."""
+        return self._unflattenStaticIterator(iter(coords), False)
+
+    def _unflattenStaticIterator(self, iterator, fixedDimension):
+        staticValues = []
+        for feature in self.staticFeatureNamed.values():
+            domain = feature.domain
+            if feature.lengthDomain:
+                length = next(iterator)
+                fixedDomain = feature.fixedDomains(None)[length]
+                staticValues.append(fixedDomain.unflattenIterator(iterator))
+                if fixedDimension:      # consume padding
+                    sizePerElt = domain.flattenedDimension
+                    needed = (feature.maxLength - length) * sizePerElt
+                    for i in range(needed):
+                        next(iterator)
+            else:
+                staticValues.append(domain.unflattenIterator(iterator))
+        return self.makeStaticPoint(*staticValues)
+
     def __repr__(self):
         rep = f'FeatureSpace({self.featureNamed}'
         if self.distanceMetric is not None:
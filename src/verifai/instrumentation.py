@@ -0,0 +1,141 @@
+"""Timing instrumentation for the phases of a falsification run."""
+
+import array
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import csv
+import json
+import time
+
+import numpy as np
+
+#: Phases recorded by the servers and falsifiers, in the order they occur.
+phases = (
+    'sample',       # generating a sample
+    'cache',        # looking up the result cache
+    'accept',       # waiting for a client to connect
+    'encode',       # serializing a sample
+    'send',         # sending it to the client
+    'simulate',     # waiting for the result (simulation plus transfer)
+    'decode',       # deserializing the result
+    'monitor',      # evaluating the monitor
+    'complete',     # completing the sample, updating the sampler
+    'record',       # adding the result to the tables and sinks
+    'checkpoint',   # saving a checkpoint
+)
+
+class Instrumentation:
+    """Records how long each phase of a run takes.
+
+    Pass an instance as the ``instrumentation`` server option to time the
+    phases of every sample (see `phases`). Durations are kept for each
+    phase, so that percentiles and histograms can be computed, and can be
+    exported as JSON or CSV.
+
+    Subclasses can override `record` to forward measurements elsewhere.
+    """
+    def __init__(self):
+        self.durations = OrderedDict()
+
+    def record(self, phase, seconds):
+        """Record one occurrence of a phase."""
+        durations = self.durations.get(phase)
+        if durations is None:
+            durations = self.durations[phase] = array.array('d')
+        durations.append(seconds)
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager timing the code it encloses as the given phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def reset(self):
+        self.durations.clear()
+
+    def mark(self):
+        """Mark the current point, so that later statistics can exclude what
+        was recorded before it (see the ``since`` argument of `summary`)."""
+        return {phase: len(durations) for phase, durations in self.durations.items()}
+
+    def values(self, phase, since=None):
+        """Array of the recorded durations of a phase (after the given mark)."""
+        if phase not in self.durations:
+            return np.empty(0)
+        start = since.get(phase, 0) if since else 0
+        return np.frombuffer(self.durations[phase], dtype=float)[start:]
+
+    def summary(self, percentiles=(50, 90, 99), since=None):
+        """Statistics for each phase recorded, as a dict of dicts.
+
+        For each phase, gives the number of occurrences, total, mean, minimum
+        and maximum time, and the given percentiles (as e.g. ``p90``), all in
+        seconds. If ``since`` is a mark returned by `mark`, only durations
+        recorded after it are included.
+        """
+        result = OrderedDict()
+        for phase in self.durations:
+            values = self.values(phase, since)
+            if len(values) == 0:
+                continue
+            stats = {'count': len(values), 'total': float(values.sum()),
+                     'mean': float(values.mean()), 'min': float(values.min()),
+                     'max': float(values.max())}
+            for p, value in zip(percentiles, np.percentile(values, percentiles)):
+                stats[f'p{p:g}'] = float(value)
+            result[phase] = stats
+        return result
+
+    def histogram(self, phase, bins=20, since=None):
+        """Histogram of the durations of a phase, as in `numpy.histogram`."""
+        return np.histogram(self.values(phase, since), bins=bins)
+
+    def report(self, since=None):
+        """A human-readable table summarizing the phases."""
+        summary = self.summary(since=since)
+        overall = sum(stats['total'] for stats in summary.values())
+        lines = [f'{"phase":<12}{"count":>9}{"total (s)":>12}{"share":>8}'
+                 f'{"mean (ms)":>11}{"p50 (ms)":>10}{"p99 (ms)":>10}']
+        for phase, stats in summary.items():
+            share = stats['total'] / overall if overall > 0 else 0
+            lines.append(f'{phase:<12}{stats["count"]:>9}{stats["total"]:>12.3f}'
+                         f'{share:>8.1%}{1000*stats["mean"]:>11.3f}'
+                         f'{1000*stats["p50"]:>10.3f}{1000*stats["p99"]:>10.3f}')
+        return '\n'.join(lines)
+
+    def write_json(self, path, bins=20):
+        """Save the summary and histograms of each phase as JSON."""
+        data = OrderedDict()
+        for phase, stats in self.summary().items():
+            counts, edges = self.histogram(phase, bins=bins)
+            data[phase] = dict(stats, histogram={'counts': counts.tolist(),
+                                                 'edges': edges.tolist()})
+        with open(path, 'w') as outfile:
+            json.dump(data, outfile, indent=2)
+
+    def write_csv(self, path, raw=False):
+        """Save the summary of each phase as CSV, one row per phase.
+
+        If raw is True, save every recorded duration instead, one per row.
+        """
+        with open(path, 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            if raw:
+                writer.writerow(['phase', 'seconds'])
+                for phase, durations in self.durations.items():
+                    writer.writerows((phase, value) for value in durations)
+                return
+            summary = self.summary()
+            columns = next(iter(summary.values())).keys() if summary else ()
+            writer.writerow(['phase', *columns])
+            for phase, stats in summary.items():
+                writer.writerow([phase, *stats.values()])
+
+def timed(instrumentation, phase):
+    """Context manager timing a phase, or doing nothing if instrumentation is None."""
+    if instrumentation is None:
+        return nullcontext()
+    return instrumentation.phase(phase)
@@ -0,0 +1,112 @@
+"""Wire protocol shared by `Server` and `Client`.
+
+In the original one-shot mode, each connection carries a single message in
+each direction, delimited by shutting down the sending half of the socket.
+
+In persistent (session) mode, a single connection carries many messages, each
+framed by an 8-byte big-endian length header. A frame of length zero marks the
+end of the session.
+"""
+
+import asyncio
+import struct
+
+HEADER = struct.Struct('!Q')
+
+# maximum number of buffers passed to a single sendmsg call (cf. IOV_MAX)
+MAX_BUFFERS = 512
+
+def send_message(sock, payload):
+    """Send one framed message over a connected socket.
+
+    The payload may be a bytes-like object or a list of them, as returned by
+    `Codec.encode`.
+    """
+    buffers = _as_buffers(payload)
+    size = sum(len(buf) for buf in buffers)
+    send_buffers(sock, [HEADER.pack(size)] + buffers)
+
+def _as_buffers(payload):
+    if not isinstance(payload, list):
+        payload = [payload]
+    return [memoryview(buf).cast('B') for buf in payload]
+
+def send_buffers(sock, buffers):
+    """Send several buffers back to back, without joining them first.
+
+    Writing the header and payload in one call avoids small-packet delays
+    (Nagle's algorithm) between consecutive writes.
+    """
+    buffers = [memoryview(buf).cast('B') for buf in buffers if len(buf) > 0]
+    if not hasattr(sock, 'sendmsg'):    # e.g. on Windows
+        sock.sendall(b''.join(buffers))
+        return
+    while buffers:
+        sent = sock.sendmsg(buffers[:MAX_BUFFERS])
+        while sent > 0:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+def send_end_of_session(sock):
+    """Tell the other end that no further messages will be sent."""
+    sock.sendall(HEADER.pack(0))
+
+def receive_message(sock):
+    """Receive one framed message from a connected socket.
+
+    Returns None if the session was ended or the connection was closed
+    between messages; otherwise the payload, as a `bytearray`.
+    """
+    header = _receive_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size == 0:
+        return None
+    payload = _receive_exactly(sock, size)
+    if payload is None:
+        raise ConnectionError('connection closed in the middle of a message')
+    return payload
+
+def _receive_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return None
+            raise ConnectionError('connection closed in the middle of a message')
+        received += n
+    return buffer
+
+async def write_message(writer, payload):
+    """Send one framed message over an asyncio stream."""
+    buffers = _as_buffers(payload)
+    size = sum(len(buf) for buf in buffers)
+    writer.writelines([HEADER.pack(size)] + buffers)
+    await writer.drain()
+
+async def read_message(reader):
+    """Receive one framed message from an asyncio stream.
+
+    Like `receive_message`, returns None at the end of the session.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError('connection closed in the middle of a message') from e
+        return None
+    size, = HEADER.unpack(header)
+    if size == 0:
+        return None
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError('connection closed in the middle of a message') from e
@@ -47,9 +47,15 @@ class CrossEntropySampler(DomainSampler):
     def getSample(self):
         return self.split_sampler.getSample()
 
+    def getSamples(self, n):
+        return self.split_sampler.getSamples(n)
+
     def update(self, sample, info, rho):
         self.split_sampler.update(sample, info, rho)
 
+    def updateSamples(self, samples, infos, rhos):
+        self.split_sampler.updateSamples(samples, infos, rhos)
+
 class ContinuousCrossEntropySampler(BoxSampler):
     def __init__(self, domain, alpha, thres,
                  buckets=10, dist=None):
@@ -78,6 +84,14 @@ class ContinuousCrossEntropySampler(BoxSampler):
               in zip(self.buckets, bucket_samples))
         return ret, bucket_samples
 
+    def getVectors(self, n):
+        bucket_samples = np.stack([np.random.choice(int(b), size=n, p=self.dist[i])
+                                   for i, b in enumerate(self.buckets)], axis=1)
+        if n > 0:
+            self.current_sample = bucket_samples[-1]
+        vectors = (bucket_samples + np.random.uniform(size=bucket_samples.shape)) / self.buckets
+        return vectors, list(bucket_samples)
+
     def updateVector(self, vector, info, rho):
         if rho is None or rho >= self.thres:
             return
@@ -85,6 +99,11 @@ class ContinuousCrossEntropySampler(BoxSampler):
             row *= self.alpha
             row[b] += 1 - self.alpha
 
+    def updateVectors(self, vectors, infos, rhos):
+        hits = [info for info, rho in zip(infos, rhos)
+                if rho is not None and rho < self.thres]
+        _decayTowardsBuckets(self.dist, hits, self.alpha)
+
 class DiscreteCrossEntropySampler(DiscreteBoxSampler):
     def __init__(self, domain, alpha, thres, dist=None):
         super().__init__(domain)
@@ -104,6 +123,14 @@ class DiscreteCrossEntropySampler(DiscreteBoxSampler):
                      for i, (left, right) in enumerate(self.domain.standardizedIntervals))
         return self.current_sample, None
 
+    def getVectors(self, n):
+        intervals = self.domain.standardizedIntervals
+        vectors = np.stack([left + np.random.choice(right-left+1, size=n, p=self.dist[i])
+                            for i, (left, right) in enumerate(intervals)], axis=1)
+        if n > 0:
+            self.current_sample = tuple(vectors[-1])
+        return vectors, [None] * n
+
     def updateVector(self, vector, info, rho):
         assert rho is not None
         if rho >= self.thres:
@@ -112,6 +139,28 @@ class DiscreteCrossEntropySampler(DiscreteBoxSampler):
             row *= self.alpha
             row[b-left] += 1 - self.alpha
 
+    def updateVectors(self, vectors, infos, rhos):
+        assert all(rho is not None for rho in rhos)
+        lefts = [left for left, right in self.domain.standardizedIntervals]
+        hits = [np.subtract(vector, lefts) for vector, rho in zip(vectors, rhos)
+                if rho < self.thres]
+        _decayTowardsBuckets(self.dist, hits, self.alpha)
+
+def _decayTowardsBuckets(dist, hits, alpha):
+    """Apply the cross-entropy update for each list of bucket indices in hits.
+
+    Equivalent to sequentially scaling each row of dist by alpha and adding
+    1 - alpha to the chosen bucket, but done with one pass per row.
+    """
+    k = len(hits)
+    if k == 0:
+        return
+    hits = np.array(hits, dtype=int).reshape(k, -1)
+    weights = (1 - alpha) * alpha ** np.arange(k-1, -1, -1)
+    for i, row in enumerate(dist):
+        row *= alpha ** k
+        np.add.at(row, hits[:, i], weights)
+
 class MultiContinuousCrossEntropySampler(ContinuousCrossEntropySampler):
     
     def __init__(self, domain, alpha, thres, priority_graph=None,
@@ -123,6 +172,10 @@ class MultiContinuousCrossEntropySampler(ContinuousCrossEntropySampler):
         super().__init__(domain, alpha, thres, buckets=10, dist=dist)
         self.counts = np.array([np.zeros(int(b)) for b in self.buckets])
 
+    # epsilon-greedy choices depend on every previous sample, so don't batch
+    getVectors = BoxSampler.getVectors
+    updateVectors = BoxSampler.updateVectors
+
     def getVector(self):
         if not self.still_sampling:
             self.sample_randomly = np.random.uniform() < self.epsilon
@@ -2,6 +2,8 @@
 """Samplers generating points in a Domain, possibly subject to specifications.
 """
 
+import numpy as np
+
 ### Exceptions pertaining to sampling
 
 class SamplingError(Exception):
@@ -17,6 +19,11 @@ class TerminationException(Exception):
 
 ### Samplers defined over fixed Domains
 
+#: Standardized dimension from which Box and DiscreteBox samplers convert
+#: single points with Domain.standardizeArray/unstandardizeArray, when
+#: possible: below it, the overhead of NumPy exceeds the savings.
+vectorizedDimension = 32
+
 ## Abstract samplers
 
 class DomainSampler:
@@ -34,6 +41,21 @@ class DomainSampler:
         method after the sample is evaluated.
         """
         raise NotImplementedError('tried to use abstract Sampler')
+
+    def getSamples(self, n):
+        """Generate a batch of n samples, given the current distribution.
+
+        Returns a pair consisting of a list of samples and a list of the
+        corresponding sampler-specific info, as for `getSample`. The default
+        implementation simply calls `getSample` repeatedly; subclasses which
+        can draw many points at once should override it.
+        """
+        samples, infos = [], []
+        for i in range(n):
+            sample, info = self.getSample()
+            samples.append(sample)
+            infos.append(info)
+        return samples, infos
     
     def update(self, sample, info, rho):
         """
@@ -47,6 +69,14 @@ class DomainSampler:
         """
         pass
 
+    def updateSamples(self, samples, infos, rhos):
+        """Update the state of the sampler after evaluating a batch of samples.
+
+        Equivalent to calling `update` on each sample in order.
+        """
+        for sample, info, rho in zip(samples, infos, rhos):
+            self.update(sample, info, rho)
+
     def __iter__(self):
         try:
             while True:
@@ -78,11 +108,29 @@ class SplitSampler(DomainSampler):
             infos.append(info)
         return self.domain.rejoinPoints(*samples), (samples, infos)
 
+    def getSamples(self, n):
+        subsamples, subinfos = [], []
+        for sampler in self.samplers:
+            samples, infos = sampler.getSamples(n)
+            subsamples.append(samples)
+            subinfos.append(infos)
+        points, infos = [], []
+        for samples, sinfos in zip(zip(*subsamples), zip(*subinfos)):
+            points.append(self.domain.rejoinPoints(*samples))
+            infos.append((list(samples), list(sinfos)))
+        return points, infos
+
     def update(self, sample, info, rho):
         samples, infos = info
         for sampler, subsample, i in zip(self.samplers, samples, infos):
             sampler.update(subsample, i, rho)
 
+    def updateSamples(self, samples, infos, rhos):
+        for j, sampler in enumerate(self.samplers):
+            subsamples = [info[0][j] for info in infos]
+            subinfos = [info[1][j] for info in infos]
+            sampler.updateSamples(subsamples, subinfos, rhos)
+
     @classmethod
     def fromPartition(cls, domain, partition, defaultSampler=None):
         """Make a SplitSampler by partitioning a domain by predicates.
@@ -132,6 +180,10 @@ class SplitSampler(DomainSampler):
                                  ((predicate, leftSampler),),
                                  rightSampler)
 
+def _vectorized(domain, dimension):
+    return (dimension >= vectorizedDimension
+            and domain.affineStandardization is not None)
+
 class BoxSampler(DomainSampler):
     """Samplers defined only over unit hyperboxes"""
     def __init__(self, domain):
@@ -140,20 +192,57 @@ class BoxSampler(DomainSampler):
             raise RuntimeError(f'{self.__class__.__name__} supports only'
                                ' continuous standardizable Domains')
         super().__init__(domain)
-    
+        self._vectorized = _vectorized(domain, self.dimension)
+
     def getSample(self):
         sample, info = self.getVector()
+        if self._vectorized:
+            vector = np.asarray(sample, dtype=float).reshape(1, self.dimension)
+            return self.domain.unstandardizeArray(vector)[0], info
         return self.domain.unstandardize(sample), info
 
+    def getSamples(self, n):
+        vectors, infos = self.getVectors(n)
+        return self.domain.unstandardizeArray(vectors), infos
+
+    def _standardizeArray(self, samples):
+        return self.domain.standardizeArray(samples).tolist()
+
     def getVector(self):
         raise NotImplementedError('tried to use abstract BoxSampler')
 
+    def getVectors(self, n):
+        """Generate a batch of n vectors in the unit hyperbox.
+
+        Returns a pair consisting of an array of shape (n, dimension) and a
+        list of the corresponding infos.
+        """
+        vectors, infos = [], []
+        for i in range(n):
+            vector, info = self.getVector()
+            vectors.append(vector)
+            infos.append(info)
+        return np.array(vectors, dtype=float).reshape(n, self.dimension), infos
+
     def update(self, sample, info, rho):
-        self.updateVector(self.domain.standardize(sample), info, rho)
+        if self._vectorized:
+            vector = tuple(self._standardizeArray([sample])[0])
+        else:
+            vector = self.domain.standardize(sample)
+        self.updateVector(vector, info, rho)
+
+    def updateSamples(self, samples, infos, rhos):
+        vectors = self._standardizeArray(samples)
+        self.updateVectors([tuple(vector) for vector in vectors], infos, rhos)
 
     def updateVector(self, vector, info, rho):
         pass
 
+    def updateVectors(self, vectors, infos, rhos):
+        """Batched version of `updateVector`."""
+        for vector, info, rho in zip(vectors, infos, rhos):
+            self.updateVector(vector, info, rho)
+
     def set_graph(self, graph):
         self.priority_graph = graph
         if graph is not None:
@@ -169,20 +258,59 @@ class DiscreteBoxSampler(DomainSampler):
             raise RuntimeError(f'{self.__class__.__name__} supports only'
                                ' discrete standardizable Domains')
         super().__init__(domain)
+        self._vectorized = _vectorized(domain, len(self.intervals))
 
     def getSample(self):
         sample, info = self.getVector()
+        if self._vectorized:
+            vector = np.asarray(sample, dtype=float).reshape(1, len(self.intervals))
+            return self.domain.unstandardizeArray(vector)[0], info
         return self.domain.unstandardize(sample), info
 
+    def getSamples(self, n):
+        vectors, infos = self.getVectors(n)
+        return self.domain.unstandardizeArray(vectors), infos
+
+    def _standardizeArray(self, samples):
+        vectors = self.domain.standardizeArray(samples)
+        return np.rint(vectors).astype(int).tolist()
+
     def getVector(self):
         raise NotImplementedError('tried to use abstract DiscreteBoxSampler')
 
+    def getVectors(self, n):
+        """Generate a batch of n vectors in the discrete hyperbox.
+
+        Returns a pair consisting of an integer array of shape
+        (n, len(intervals)) and a list of the corresponding infos.
+        """
+        vectors, infos = [], []
+        for i in range(n):
+            vector, info = self.getVector()
+            vectors.append(vector)
+            infos.append(info)
+        return (np.array(vectors, dtype=int).reshape(n, len(self.intervals)),
+                infos)
+
     def update(self, sample, info, rho):
-        self.updateVector(self.domain.standardize(sample), info, rho)
+        if self._vectorized:
+            vector = tuple(self._standardizeArray([sample])[0])
+        else:
+            vector = self.domain.standardize(sample)
+        self.updateVector(vector, info, rho)
+
+    def updateSamples(self, samples, infos, rhos):
+        vectors = self._standardizeArray(samples)
+        self.updateVectors([tuple(vector) for vector in vectors], infos, rhos)
 
     def updateVector(self, vector, info, rho):
         pass
 
+    def updateVectors(self, vectors, infos, rhos):
+        """Batched version of `updateVector`."""
+        for vector, info, rho in zip(vectors, infos, rhos):
+            self.updateVector(vector, info, rho)
+
 class IteratorSampler(DomainSampler):
     """Samplers defined using a generator function."""
 
@@ -73,11 +73,7 @@ class ContinuousEpsilonGreedySampler(BoxSampler):
         self.epsilon = epsilon
         self.sample_randomly = np.random.uniform() < self.epsilon
 
-    def nextVector(self, feedback=None):
-        self.update(None, self.current_sample, feedback)
-        return self.generateSample()
-    
-    def generateSample(self):
+    def getVector(self):
         if self.sample_randomly:
             bucket_samples = np.array([np.random.choice(int(b))
                                     for i, b in enumerate(self.buckets)])
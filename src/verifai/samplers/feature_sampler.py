@@ -12,7 +12,8 @@ from abc import ABC, abstractmethod
 from contextlib import contextmanager
 
 from verifai.features import FilteredDomain, TimeSeriesFeature, Sample
-from verifai.features.features import _PrecomputedSample
+from verifai.features.features import _PrecomputedSample, _LazySample
+from verifai.utils.utils import LazyMapping
 from verifai.samplers.domain_sampler import SplitSampler, TerminationException
 from verifai.samplers.rejection import RejectionSampler
 from verifai.samplers.halton import HaltonSampler
@@ -39,9 +40,14 @@ class FeatureSampler(ABC):
         return cls.randomSamplerFor(space)
 
     @staticmethod
-    def randomSamplerFor(space):
-        """Creates a random sampler for a given space"""
-        return LateFeatureSampler(space, RandomSampler, RandomSampler)
+    def randomSamplerFor(space, lazyTimeSeries=False):
+        """Creates a random sampler for a given space.
+
+        If lazyTimeSeries is True, values of TimeSeriesFeatures are only
+        sampled when needed (see `LateFeatureSampler`).
+        """
+        return LateFeatureSampler(space, RandomSampler, makeRandomSampler,
+                                  lazyTimeSeries=lazyTimeSeries)
 
     @staticmethod
     def haltonSamplerFor(space, halton_params=None):
@@ -161,6 +167,24 @@ class FeatureSampler(ABC):
         """Generate a `Sample`."""
         pass
 
+    def getSamples(self, n):
+        """Generate a list of n `Sample` objects at once.
+
+        Useful for filling a pool of simulators in a single call. Samplers
+        which can draw points in batches override this; by default it just
+        calls `getSample` repeatedly.
+        """
+        return [self.getSample() for i in range(n)]
+
+    def completeSamples(self, samples, rhos):
+        """Complete a batch of samples generated by this sampler.
+
+        Equivalent to calling `Sample.complete` on each sample in order, but
+        allows the sampler to update its state in a single batched step.
+        Returns the list of `CompletedSample` objects.
+        """
+        return [sample.complete(rho) for sample, rho in zip(samples, rhos)]
+
     def set_graph(self, graph):
         self.scenario.set_graph(graph)
 
@@ -202,22 +226,45 @@ class LateFeatureSampler(FeatureSampler):
     e.g. LateFeatureSampler(space, RandomSampler, HaltonSampler) creates a
     FeatureSampler which picks lengths uniformly at random and applies
     Halton sampling to each fixed-length space.
+
+    The sampler for each fixed-length space is only created when a sample
+    with those lengths is first needed. If maxCachedSamplers is not None, at
+    most that many are kept, discarding the least recently used ones: their
+    state (e.g. the distributions learned by cross-entropy samplers) is then
+    lost, and they start afresh if those lengths are sampled again.
+
+    If lazyTimeSeries is True, TimeSeriesFeatures are not expanded: instead,
+    the values of all of them at a time step are sampled when
+    `Sample.getDynamicSample` asks for that step, using a sampler created by
+    makeDomainSampler for the Domain of a single step (see
+    `FeatureSpace.timeStepDomain`). This saves the time and memory needed
+    for steps a simulation never reaches, but the samplers then learn about
+    each step separately rather than about whole trajectories. Every step
+    generated for a sample is updated with the sample's feedback.
     """
 
-    def __init__(self, space, makeLengthSampler, makeDomainSampler):
+    def __init__(self, space, makeLengthSampler, makeDomainSampler,
+                 maxCachedSamplers=None, lazyTimeSeries=False):
         super().__init__(space)
 
-        lengthDomain, fixedDomains = space.domains
+        self.lazyTimeSeries = lazyTimeSeries and space.hasTimeSeries
+        if self.lazyTimeSeries:
+            lengthDomain, fixedDomains = space.staticDomains
+            self._makeDomainSampler = makeDomainSampler
+            self.timeStepSamplers = {}
+            self._time_step_draws = {}
+        else:
+            lengthDomain, fixedDomains = space.domains
         if lengthDomain is None:    # space has no feature lists
             self.lengthSampler = None
             self.domainSamplers = {None: makeDomainSampler(fixedDomains)}
         else:
             self.lengthDomain = lengthDomain
             self.lengthSampler = makeLengthSampler(lengthDomain)
-            self.domainSamplers = {
-                point: makeDomainSampler(domain)
-                for point, domain in fixedDomains.items()
-            }
+            self.domainSamplers = LazyMapping(
+                fixedDomains.__iter__, len(fixedDomains), fixedDomains.__contains__,
+                lambda point: makeDomainSampler(fixedDomains[point]),
+                maxSize=maxCachedSamplers)
 
         self._id_metadata_dict = {}
         self._last_id = 0
@@ -234,16 +281,55 @@ class LateFeatureSampler(FeatureSampler):
             length, info1 = self.lengthSampler.getSample()
 
         domainPoint, info2 = self.domainSamplers[length].getSample()
-        info = (info1, info2)
-        
+        return self._makeSample(length, domainPoint, (info1, info2))
+
+    def getSamples(self, n):
+        if self.lengthSampler is None:
+            lengths, infos1 = [None] * n, [None] * n
+        else:
+            lengths, infos1 = self.lengthSampler.getSamples(n)
+
+        # Draw all points for a given assignment of lengths in one batch
+        indicesForLength = {}
+        for i, length in enumerate(lengths):
+            indicesForLength.setdefault(length, []).append(i)
+        domainPoints, infos2 = [None] * n, [None] * n
+        for length, indices in indicesForLength.items():
+            points, infos = self.domainSamplers[length].getSamples(len(indices))
+            for i, point, info in zip(indices, points, infos):
+                domainPoints[i] = point
+                infos2[i] = info
+
+        return [self._makeSample(*args)
+                for args in zip(lengths, domainPoints, zip(infos1, infos2))]
+
+    def completeSamples(self, samples, rhos):
+        self.updateSamples([sample._sampleId for sample in samples], rhos)
+        # complete without invoking the per-sample update callbacks
+        return [Sample.complete(sample, rho)
+                for sample, rho in zip(samples, rhos)]
+
+    def _makeSample(self, length, domainPoint, info):
         sample_id = self._get_info_id(info, length, domainPoint)
         complete_callback = lambda rho: self.update(sample_id, rho)
 
         # Make static points and iterable over dynamic points
         static_features = [(k, domainPoint._asdict()[k]) for k in self.space.staticFeatureNamed]
-        dynamic_features = [(k, domainPoint._asdict()[k]) for k in self.space.dynamicFeatureNamed]
         static_point = self.space.makeStaticPoint(*[v[1] for v in static_features])
 
+        dynamicSampleLengths = ({feature_name: getattr(length, feature_name)[0]
+                                 for feature_name, feature in self.space.dynamicFeatureNamed.items()
+                                 if feature.lengthDomain}
+                                if self.lengthSampler else {})
+
+        if self.lazyTimeSeries:
+            make_dynamic_point = self._timeStepGenerator(sample_id, dynamicSampleLengths)
+            sample = _LazySample(self.space, static_point, make_dynamic_point,
+                                 complete_callback, dynamicSampleLengths)
+            sample._sampleId = sample_id
+            return sample
+
+        dynamic_features = [(k, domainPoint._asdict()[k]) for k in self.space.dynamicFeatureNamed]
         dynamic_points = []
         if self.space.hasTimeSeries:
             for t in range(self.space.timeBound):
@@ -257,15 +343,34 @@ class LateFeatureSampler(FeatureSampler):
 
                 dynamic_points.append(self.space.makeDynamicPoint(*raw_point_list))
 
-
-        dynamicSampleLengths = ({feature_name: getattr(length, feature_name)[0]
-                                 for feature_name, feature in self.space.dynamicFeatureNamed.items()
-                                 if feature.lengthDomain}
-                                if self.lengthSampler else {})
-
-        return _PrecomputedSample(self.space, static_point, dynamic_points, complete_callback, dynamicSampleLengths)
+        sample = _PrecomputedSample(self.space, static_point, dynamic_points, complete_callback, dynamicSampleLengths)
+        sample._sampleId = sample_id
+        return sample
+
+    def _timeStepGenerator(self, sample_id, dynamicSampleLengths):
+        """Function generating the dynamic points of a sample one step at a time."""
+        key = tuple(sorted(dynamicSampleLengths.items()))
+        sampler = self.timeStepSamplers.get(key)
+        if sampler is None:
+            domain = self.space.timeStepDomain(dynamicSampleLengths)
+            sampler = self.timeStepSamplers[key] = self._makeDomainSampler(domain)
+        draws = self._time_step_draws[sample_id] = (sampler, [])
+        def make_dynamic_point(time):
+            point, info = sampler.getSample()
+            draws[1].append((point, info))
+            return self.space.makeDynamicPoint(*point)
+        return make_dynamic_point
+
+    def _updateTimeSteps(self, sample_id, rho):
+        sampler, draws = self._time_step_draws.pop(sample_id, (None, None))
+        if draws:
+            sampler.updateSamples([point for point, info in draws],
+                                  [info for point, info in draws],
+                                  [rho] * len(draws))
 
     def update(self, sample_id, rho):
+        if self.lazyTimeSeries:
+            self._updateTimeSteps(sample_id, rho)
         info, lengthPoint, domainPoint = self._id_metadata_dict[sample_id]
 
         if self.lengthSampler is None:
@@ -274,6 +379,28 @@ class LateFeatureSampler(FeatureSampler):
             self.lengthSampler.update(domainPoint, info[0], rho)
 
             self.domainSamplers[lengthPoint].update(domainPoint, info[1], rho)
+
+    def updateSamples(self, sample_ids, rhos):
+        """Batched version of `update`."""
+        if self.lazyTimeSeries:
+            for sample_id, rho in zip(sample_ids, rhos):
+                self._updateTimeSteps(sample_id, rho)
+        metadata = [self._id_metadata_dict[sample_id] for sample_id in sample_ids]
+
+        if self.lengthSampler is not None:
+            self.lengthSampler.updateSamples(
+                [domainPoint for info, lengthPoint, domainPoint in metadata],
+                [info[0] for info, lengthPoint, domainPoint in metadata],
+                rhos)
+
+        batches = {}
+        for (info, lengthPoint, domainPoint), rho in zip(metadata, rhos):
+            batch = batches.setdefault(lengthPoint, ([], [], []))
+            batch[0].append(domainPoint)
+            batch[1].append(info[1])
+            batch[2].append(rho)
+        for lengthPoint, (points, infos, batchRhos) in batches.items():
+            self.domainSamplers[lengthPoint].updateSamples(points, infos, batchRhos)
 ### Utilities
 
 def makeRandomSampler(domain):
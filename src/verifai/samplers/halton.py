@@ -3,6 +3,7 @@
 from verifai.samplers.domain_sampler import BoxSampler
 import itertools
 from math import floor
+import numpy as np
 
 def generate_primes():
     D = {}
@@ -26,6 +27,18 @@ def halton_sequence(index, base):
         index = floor(index/base)
     return r
 
+def halton_sequences(indices, base):
+    """Vectorized version of halton_sequence over an array of indices."""
+    indices = np.array(indices, dtype=np.int64)
+    f = np.ones(len(indices))
+    r = np.zeros(len(indices))
+    while np.any(indices > 0):
+        active = indices > 0
+        f[active] /= base
+        r[active] += f[active] * (indices[active] % base)
+        indices //= base
+    return r
+
 class HaltonSampler(BoxSampler):
     """Samples along a quasi-random Halton sequence"""
 
@@ -41,3 +54,10 @@ class HaltonSampler(BoxSampler):
         self.sample_index += 1
         return tuple(halton_sequence(index=self.sample_index, base=p)
                      for p in self.prime_bases), None
+
+    def getVectors(self, n):
+        start = self.sample_index + 1
+        self.sample_index += n
+        indices = np.arange(start, start + n)
+        columns = [halton_sequences(indices, p) for p in self.prime_bases]
+        return np.stack(columns, axis=1).reshape(n, self.dimension), [None] * n
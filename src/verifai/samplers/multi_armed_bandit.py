@@ -50,9 +50,15 @@ class MultiArmedBanditSampler(DomainSampler):
     def getSample(self):
         return self.split_sampler.getSample()
 
+    def getSamples(self, n):
+        return self.split_sampler.getSamples(n)
+
     def update(self, sample, info, rho):
         self.split_sampler.update(sample, info, rho)
 
+    def updateSamples(self, samples, infos, rhos):
+        self.split_sampler.updateSamples(samples, infos, rhos)
+
 class ContinuousMultiArmedBanditSampler(BoxSampler, MultiObjectiveSampler):
     def __init__(self, domain, alpha, thres,
                  buckets=10, dist=None, restart_every=100):
@@ -95,6 +101,19 @@ class ContinuousMultiArmedBanditSampler(BoxSampler, MultiObjectiveSampler):
         ret = tuple(np.random.uniform(bs, bs+1.)/b for b, bs
               in zip(self.buckets, bucket_samples))
         return ret, bucket_samples
+
+    def getVectors(self, n):
+        # No feedback arrives within a batch, so every sample in it sees the
+        # same UCB values; only the tie-breaking is random.
+        proportions = self.errors / self.counts
+        Q = proportions + np.sqrt(2 / self.counts * np.log(self.t))
+        bucket_samples = np.stack([
+            np.random.choice(np.flatnonzero(np.isclose(Q[i], Q[i].max())), size=n)
+            for i in range(len(self.buckets))], axis=1)
+        if n > 0:
+            self.current_sample = bucket_samples[-1]
+        vectors = (bucket_samples + np.random.uniform(size=bucket_samples.shape)) / self.buckets
+        return vectors, list(bucket_samples)
     
     def updateVector(self, vector, info, rho):
         assert rho is not None
@@ -111,6 +130,20 @@ class ContinuousMultiArmedBanditSampler(BoxSampler, MultiObjectiveSampler):
             if rho < self.thres:
                 self.errors[i][b] += 1.
 
+    def updateVectors(self, vectors, infos, rhos):
+        if self.is_multi:
+            return super().updateVectors(vectors, infos, rhos)
+        assert all(rho is not None for rho in rhos)
+        k = len(infos)
+        self.t += k
+        if k == 0:
+            return
+        buckets = np.array(infos, dtype=int).reshape(k, -1)
+        errors = np.array([rho < self.thres for rho in rhos])
+        for i in range(len(self.buckets)):
+            np.add.at(self.counts[i], buckets[:, i], 1.)
+            np.add.at(self.errors[i], buckets[errors, i], 1.)
+
     # is rho1 better than rho2?
     # partial pre-ordering on objective functions, so it is possible that:
     # is_better_counterexample(rho1, rho2)
@@ -15,6 +15,12 @@ class RandomSampler(DomainSampler):
         else:
             return self.distribution.sample(), None
 
+    def getSamples(self, n):
+        if self.distribution is None:
+            return self.domain.uniformPoints(n), [None] * n
+        else:
+            return super().getSamples(n)
+
     def __repr__(self):
         rep = f'RandomSampler({self.domain}'
         if self.distribution is not None:
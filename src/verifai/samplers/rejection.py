@@ -1,26 +1,65 @@
 """Rejection sampling"""
 
-from verifai.utils.utils import RejectionException
+import collections
+
+import numpy as np
+
+from verifai.utils.utils import RejectionException, AcceptanceRate
 from verifai.samplers.domain_sampler import ConstrainedSampler, SamplingError
+from verifai.samplers.random_sampler import RandomSampler
 
 class RejectionSampler(ConstrainedSampler):
     """Enforces a spec over some other sampler by rejection.
 
     RejectionSampler(RandomSampler(domain), spec)
+
+    In batched mode, candidates are drawn in blocks whose size adapts to the
+    observed acceptance rate, so that each block yields about ``batchSize``
+    samples; accepted samples are queued until needed. Domain filters are
+    applied to whole blocks (see `Domain.uniformCandidates`), as is the spec
+    if it has an ``areSatisfiedBy`` method taking a list of samples and
+    returning a boolean sequence. Since samples are drawn before earlier
+    ones are evaluated, batching is only enabled by default for samplers
+    which do not learn from feedback, i.e. plain `RandomSampler`.
+
+    The fraction of candidates accepted so far is given by `acceptanceRate`.
     """
 
-    def __init__(self, sampler, spec=None, rejectionRho=None, maxRejections=1000):
+    def __init__(self, sampler, spec=None, rejectionRho=None, maxRejections=1000,
+                 batched=None, batchSize=64):
         super().__init__(sampler.domain, spec)
         self.sampler = sampler
         self.specification = spec
         self.rejectionRho = None
         self.maxRejections = maxRejections
+        drawsUniformly = (type(sampler) is RandomSampler
+                          and sampler.distribution is None)
+        if batched is None:
+            batched = drawsUniformly
+        self.batched = batched
+        self.batchSize = batchSize
+        self.acceptance = AcceptanceRate()
+        self._drawsUniformly = drawsUniformly
+        self._queue = collections.deque()
+
+    @property
+    def acceptanceRate(self):
+        """Fraction of the candidates drawn so far which were accepted.
+
+        None if no candidates have been drawn yet.
+        """
+        return self.acceptance.rate
 
     def getSample(self):
+        if self.batched:
+            if not self._queue:
+                self._fill(1)
+            return self._queue.popleft()
         reject = True
         samples = 0
         while reject:
             if samples >= self.maxRejections:
+                self.acceptance.record(samples, 0)
                 raise SamplingError(
                     f'exceeded RejectionSampler limit of {samples} rejections')
             samples += 1
@@ -34,8 +73,69 @@ class RejectionSampler(ConstrainedSampler):
                     self.sampler.update(sample, info, self.rejectionRho)
             except RejectionException:
                 reject = True
+        self.acceptance.record(samples, 1)
         return sample, info
 
+    def getSamples(self, n):
+        if not self.batched:
+            return super().getSamples(n)
+        self._fill(n)
+        pairs = [self._queue.popleft() for i in range(n)]
+        return [sample for sample, info in pairs], [info for sample, info in pairs]
+
+    def _fill(self, count):
+        """Draw blocks of candidates until at least count samples are queued."""
+        queue = self._queue
+        rejected = 0
+        while len(queue) < count:
+            if rejected >= self.maxRejections:
+                raise SamplingError(
+                    f'exceeded RejectionSampler limit of {rejected} rejections')
+            size = self.acceptance.blockSize(max(count - len(queue), self.batchSize))
+            samples, infos, accepted = self._candidates(size)
+            accepted = np.flatnonzero(accepted)
+            self.acceptance.record(size, len(accepted))
+            if len(accepted) == 0:
+                rejected += size
+            else:
+                rejected = 0
+                queue.extend((samples[i], infos[i]) for i in accepted)
+
+    def _candidates(self, n):
+        if self._drawsUniformly:
+            samples, accepted = self.domain.uniformCandidates(n)
+            infos = [None] * n
+            if accepted is None:
+                accepted = np.ones(n, dtype=bool)
+        else:
+            try:
+                samples, infos = self.sampler.getSamples(n)
+                accepted = np.ones(n, dtype=bool)
+            except RejectionException:
+                samples, infos, accepted = [], [], np.ones(n, dtype=bool)
+                for i in range(n):
+                    try:
+                        sample, info = self.sampler.getSample()
+                    except RejectionException:
+                        sample, info = None, None
+                        accepted[i] = False
+                    samples.append(sample)
+                    infos.append(info)
+        spec = self.specification
+        if spec is not None:
+            indices = np.flatnonzero(accepted)
+            candidates = [samples[i] for i in indices]
+            areSatisfiedBy = getattr(spec, 'areSatisfiedBy', None)
+            if areSatisfiedBy is not None:
+                satisfied = np.asarray(areSatisfiedBy(candidates), dtype=bool)
+            else:
+                satisfied = np.fromiter(map(spec.isSatisfiedBy, candidates),
+                                        dtype=bool, count=len(candidates))
+            accepted[indices] = satisfied
+            for i in indices[~satisfied]:
+                self.sampler.update(samples[i], infos[i], self.rejectionRho)
+        return samples, infos, accepted
+
     def update(self, sample, info, rho):
         self.sampler.update(sample, info, rho)
 
@@ -11,6 +11,7 @@ except ModuleNotFoundError:
     ray = None   # ignore for now; we'll raise an error below if ray is actually needed
 
 from verifai.server import Server, ServerTimings
+from verifai.workers import WorkerProcess, wait_for_any
 from verifai.samplers.scenic_sampler import ScenicSampler
 from verifai.monitor import multi_objective_monitor
 from scenic.core.simulators import SimulationCreationError
@@ -26,7 +27,11 @@ class ScenicServer(Server):
         * ``verbosity``: verbosity level (as in the Scenic :option:`--verbosity` option);
         * ``maxIterations``: maximum number of iterations for rejection sampling;
         * ``simulator``: Scenic :obj:`~scenic.core.simulators.Simulator` to use, or
-          `None` (the default) to use one specified in the scenario.
+          `None` (the default) to use one specified in the scenario;
+        * ``result_cache``: a `ResultCache` used to skip simulating scenes
+          whose parameters have already been evaluated (default `None`);
+        * ``instrumentation``: an `Instrumentation` recording the time taken
+          by each phase of processing a sample (default `None`).
     """
     def __init__(self, sampling_data, monitor, options={}):
         if sampling_data.sampler is None:
@@ -42,8 +47,11 @@ class ScenicServer(Server):
             self.rejectionFeedback = extSampler.rejectionFeedback
         self.monitor = monitor
         self.lastValue = None
-        defaults = DotMap(maxSteps=None, verbosity=0, maxIterations=1, simulator=None)
+        defaults = DotMap(maxSteps=None, verbosity=0, maxIterations=1, simulator=None,
+                          result_cache=None, instrumentation=None)
         defaults.update(options)
+        self.init_cache(defaults.result_cache)
+        self.instrumentation = defaults.instrumentation
         self.maxSteps = defaults.maxSteps
         self.verbosity = defaults.verbosity
         self.maxIterations = defaults.maxIterations
@@ -55,11 +63,13 @@ class ScenicServer(Server):
     def evaluate_sample(self, sample):
         scene = self.sampler.lastScene
         assert scene
-        result = self._simulate(scene)
+        with self.timed('simulate'):
+            result = self._simulate(scene)
         if result is None:
             return self.rejectionFeedback
-        value = (0 if self.monitor is None
-                 else self.monitor.evaluate(result))
+        with self.timed('monitor'):
+            value = (0 if self.monitor is None
+                     else self.monitor.evaluate(result))
         return value
 
     def _simulate(self, scene):
@@ -87,96 +97,145 @@ class DummySampler(VerifaiSampler):
     def nextSample(self, feedback):
         return self.last_sample
 
-if ray:
-    @ray.remote
-    class SampleSimulator():
-
-        def __init__(self, scenic_path, worker_num, monitor, options={}):
-            scenario_params = options.get('scenario_params', {})
-            scenario_model = options.get('scenario_model', None)
-            scenario_params.update({
-                'port': 2000 + 2*worker_num
-            })
-            self.sampler = ScenicSampler.fromScenario(scenic_path, maxIterations=1,
-                                                      params=scenario_params,
-                                                      model=scenario_model)
-            # reset self.sampler.scenario.externalSampler to dummy sampler
-            # that reads argument
-            self.worker_num = worker_num
-            self.sampler.scenario.externalSampler = DummySampler(
-                self.sampler.scenario.externalParams,
-                self.sampler.scenario.params
-            )
-            self.simulator = self.sampler.scenario.getSimulator()
-            self.monitor = monitor
-            extSampler = self.sampler.scenario.externalSampler
-            if extSampler is None:
-                self.rejectionFeedback = None
-            else:
-                self.rejectionFeedback = extSampler.rejectionFeedback
-            defaults = DotMap(maxSteps=None, verbosity=0, maxIterations=1)
-            defaults.update(options)
-            self.maxSteps = defaults.maxSteps
-            self.verbosity = defaults.verbosity
-            self.maxIterations = defaults.maxIterations
-
-        def get_sample(self, sample):
-            self.sampler.scenario.externalSampler.last_sample = sample
-            self.full_sample = self.sampler.nextSample(sample)
-
-        def simulate(self, sample):
-            '''
-            Need to generate scene from sample here.
-            '''
-            t0 = time.time()
-            self.sampler.scenario.externalSampler.last_sample = sample
-            scene = self.sampler.lastScene
-            startTime = time.time()
-            if self.verbosity >= 1:
-                print('  Beginning simulation...')
-            try:
-                result = self.simulator.simulate(scene,
-                    maxSteps=self.maxSteps, verbosity=self.verbosity,
-                    maxIterations=self.maxIterations)
-                result.worker_num = self.worker_num
-            except SimulationCreationError as e:
-                if self.verbosity >= 1:
-                    print(f'  Failed to create simulation: {e}')
-                self.lastValue = self.rejectionFeedback
-                return self.worker_num, self.full_sample, self.lastValue
-            except RuntimeError as e:
-                print(f'Runtime error during simulation: {e}')
-                print('Waiting 1 minute before continuing...')
-                time.sleep(60)
-                return self.worker_num, self.full_sample, self.lastValue
+class SampleSimulator():
+
+    def __init__(self, scenic_path, worker_num, monitor, options={}):
+        scenario_params = options.get('scenario_params', {})
+        scenario_model = options.get('scenario_model', None)
+        scenario_params.update({
+            'port': 2000 + 2*worker_num
+        })
+        self.sampler = ScenicSampler.fromScenario(scenic_path, maxIterations=1,
+                                                  params=scenario_params,
+                                                  model=scenario_model)
+        # reset self.sampler.scenario.externalSampler to dummy sampler
+        # that reads argument
+        self.worker_num = worker_num
+        self.sampler.scenario.externalSampler = DummySampler(
+            self.sampler.scenario.externalParams,
+            self.sampler.scenario.params
+        )
+        self.simulator = self.sampler.scenario.getSimulator()
+        self.monitor = monitor
+        extSampler = self.sampler.scenario.externalSampler
+        if extSampler is None:
+            self.rejectionFeedback = None
+        else:
+            self.rejectionFeedback = extSampler.rejectionFeedback
+        defaults = DotMap(maxSteps=None, verbosity=0, maxIterations=1)
+        defaults.update(options)
+        self.maxSteps = defaults.maxSteps
+        self.verbosity = defaults.verbosity
+        self.maxIterations = defaults.maxIterations
+
+    def get_sample(self, sample):
+        self.sampler.scenario.externalSampler.last_sample = sample
+        self.full_sample = self.sampler.nextSample(sample)
+
+    def simulate(self, sample):
+        '''
+        Need to generate scene from sample here.
+        '''
+        t0 = time.time()
+        self.sampler.scenario.externalSampler.last_sample = sample
+        scene = self.sampler.lastScene
+        startTime = time.time()
+        if self.verbosity >= 1:
+            print('  Beginning simulation...')
+        try:
+            result = self.simulator.simulate(scene,
+                maxSteps=self.maxSteps, verbosity=self.verbosity,
+                maxIterations=self.maxIterations)
+            result.worker_num = self.worker_num
+        except SimulationCreationError as e:
             if self.verbosity >= 1:
-                totalTime = time.time() - startTime
-                print(f'  Ran simulation in {totalTime:.4g} seconds.')
-            if result is None:
-                self.lastValue = self.rejectionFeedback
-            else:
-                self.lastValue = (0 if self.monitor is None
-                                  else self.monitor.evaluate(result))
+                print(f'  Failed to create simulation: {e}')
+            self.lastValue = self.rejectionFeedback
             return self.worker_num, self.full_sample, self.lastValue
+        except RuntimeError as e:
+            print(f'Runtime error during simulation: {e}')
+            print('Waiting 1 minute before continuing...')
+            time.sleep(60)
+            return self.worker_num, self.full_sample, self.lastValue
+        if self.verbosity >= 1:
+            totalTime = time.time() - startTime
+            print(f'  Ran simulation in {totalTime:.4g} seconds.')
+        if result is None:
+            self.lastValue = self.rejectionFeedback
+        else:
+            self.lastValue = (0 if self.monitor is None
+                              else self.monitor.evaluate(result))
+        return self.worker_num, self.full_sample, self.lastValue
+
+if ray:
+    RaySampleSimulator = ray.remote(SampleSimulator)
 
 class ParallelScenicServer(ScenicServer):
+    """`ScenicServer` running simulations in parallel worker processes.
+
+    Supported server options are those of `ScenicServer` except
+    ``result_cache`` and ``instrumentation``, which are rejected since the
+    simulations run in the workers, plus:
 
+        * ``backend``: ``'ray'`` to run the workers as ray actors, or
+          ``'processes'`` to run them as local processes (the default if ray
+          is not installed);
+        * ``start_method``: `multiprocessing` start method for the
+          ``'processes'`` backend (default `None`, meaning the platform default).
+    """
     def __init__(self, total_workers, n_iters, sampling_data, scenic_path, monitor,
                  options={}, max_time=None, sampler=None):
-        if not ray:
-            raise RuntimeError('ParallelScenicServer requires ray to be installed')
-
-        if not ray.is_initialized():
-            ray.init(ignore_reinit_error=True)
+        for option in ('result_cache', 'instrumentation'):
+            if options.get(option) is not None:
+                raise RuntimeError(f'ParallelScenicServer does not support "{option}"')
+        backend = options.get('backend', 'ray' if ray else 'processes')
+        if backend == 'ray':
+            if not ray:
+                raise RuntimeError('the "ray" backend requires ray to be installed')
+            if not ray.is_initialized():
+                ray.init(ignore_reinit_error=True)
+        elif backend != 'processes':
+            raise RuntimeError(f'unknown backend "{backend}"')
+        self.backend = backend
         self.total_workers = total_workers
         self.n_iters = n_iters
         self.max_time = max_time
         sampling_data.sampler = sampler
         super().__init__(sampling_data, monitor, options)
-        self.sample_simulators = [
-            SampleSimulator.remote(scenic_path, i, monitor, options)
-            for i in range(self.total_workers)
-        ]
+        if backend == 'ray':
+            self.sample_simulators = [
+                RaySampleSimulator.remote(scenic_path, i, monitor, options)
+                for i in range(self.total_workers)
+            ]
+        else:
+            start_method = options.get('start_method', None)
+            self.sample_simulators = [
+                WorkerProcess(SampleSimulator, scenic_path, i, monitor, options,
+                              context=start_method)
+                for i in range(self.total_workers)
+            ]
+        self.futures = [None] * self.total_workers
+
+    def _prepare_sample(self, worker_num, sample):
+        sim = self.sample_simulators[worker_num]
+        if self.backend == 'ray':
+            ray.get(sim.get_sample.remote(sample))
+        else:
+            sim.call('get_sample', sample)
+
+    def _start_simulation(self, worker_num, sample):
+        sim = self.sample_simulators[worker_num]
+        if self.backend == 'ray':
+            self.futures[worker_num] = sim.simulate.remote(sample)
+        else:
+            sim.submit('simulate', sample)
+
+    def _next_result(self):
+        if self.backend == 'ray':
+            done, _ = ray.wait(self.futures)
+            return ray.get(done[0])
+        sim = wait_for_any([sim for sim in self.sample_simulators if sim.busy])[0]
+        return sim.result()
 
     def _generate_next_sample(self, worker_num):
         i = 0
@@ -184,9 +243,8 @@ class ParallelScenicServer(ScenicServer):
         while i < 2000:
             ext.cachedSample, info = ext.getSample()
             sample = ext.cachedSample
-            sim = self.sample_simulators[worker_num]
             try:
-                ray.get(sim.get_sample.remote(sample))
+                self._prepare_sample(worker_num, sample)
                 return sample, info
             except SimulationCreationError as e:
                 if self.verbosity >= 1:
@@ -197,9 +255,13 @@ class ParallelScenicServer(ScenicServer):
                 continue
         return None, None
 
-    def run_server(self):
+    def run_server(self, on_result=None):
+        """Run the simulations, returning a list of (sample, value) pairs.
+
+        If on_result is not None, it is called with each sample and its value
+        as soon as they are available; if it returns True, the run stops.
+        """
         results = []
-        futures = []
         samples = []
         infos = []
         if self.n_iters is not None:
@@ -212,17 +274,16 @@ class ParallelScenicServer(ScenicServer):
             next_sample, info = self._generate_next_sample(i)
             samples.append(next_sample)
             infos.append(info)
-            sim = self.sample_simulators[i]
-            futures.append(sim.simulate.remote(next_sample))
+            self._start_simulation(i, next_sample)
         while True:
-            done, _ = ray.wait(futures)
-            result = ray.get(done[0])
-            index, sample, rho = result
+            index, sample, rho = self._next_result()
             self.lastValue = rho
             results.append((sample, rho))
             info = infos[index]
             self.sampler.scenario.externalSampler.update(sample, info, rho)
             bar.update(len(results))
+            if on_result is not None and on_result(sample, rho):
+                break
             if len(results) == 1:
                 t0 = time.time()
             elapsed = time.time() - t0
@@ -232,9 +293,13 @@ class ParallelScenicServer(ScenicServer):
                 break
             next_sample, info = self._generate_next_sample(index)
             elapsed = time.time() - t0
-            sim = self.sample_simulators[index]
             samples[index] = next_sample
             infos[index] = info
-            futures[index] = sim.simulate.remote(next_sample)
+            self._start_simulation(index, next_sample)
 
         return results
+
+    def terminate(self):
+        if self.backend == 'processes':
+            for sim in self.sample_simulators:
+                sim.close()
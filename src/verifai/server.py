@@ -1,4 +1,7 @@
+import asyncio
+from collections import deque
 from dataclasses import dataclass
+import selectors
 import socket
 import time
 
@@ -7,6 +10,12 @@ from dotmap import DotMap
 
 from verifai.features.features import *
 from verifai.samplers.feature_sampler import *
+from verifai.protocol import (send_message, send_end_of_session, receive_message,
+                              write_message, read_message)
+from verifai.codec import DillCodec, CodecNegotiator, default_codecs
+from verifai.cache import fingerprint
+from verifai.workers import WorkerProcess, wait_for_any
+from verifai.instrumentation import timed
 
 def choose_sampler(sample_space, sampler_type,
                    sampler_params=None):
@@ -99,20 +108,49 @@ def choose_sampler(sample_space, sampler_type,
     raise ValueError(f'unknown sampler type "{sampler_type}"')
 
 class Server:
-    """Generic server for communicating with an external simulator."""
+    """Generic server for communicating with an external simulator.
+
+    Supported server options:
+
+        * ``port``: port to listen on (0 to pick a free one);
+        * ``bufsize``: size of socket reads in one-shot mode;
+        * ``maxreqs``: backlog of pending connections;
+        * ``persistent``: if True, keep one connection open to a client for
+          many samples, framing each message with a length header, instead
+          of making a new connection per sample. The client must also be
+          created with ``persistent=True``.
+        * ``codecs``: names of the codecs (see `verifai.codec`) persistent
+          clients may use, in order of preference (default binary, then dill).
+          One-shot connections always use dill.
+        * ``result_cache``: a `ResultCache` used to skip simulating points
+          which have already been evaluated (default `None`);
+        * ``instrumentation``: an `Instrumentation` recording the time taken
+          by each phase of processing a sample (default `None`).
+    """
     def __init__(self, sampling_data, monitor, options={}):
-        defaults = DotMap(port=8888, bufsize=4096, maxreqs=5)
+        defaults = DotMap(port=8888, bufsize=4096, maxreqs=5, persistent=False,
+                          codecs=default_codecs, result_cache=None,
+                          instrumentation=None)
         defaults.update(options)
         self.monitor = monitor
         self.lastValue = None
+        self.instrumentation = defaults.instrumentation
         self.port = defaults.port
         self.bufsize = defaults.bufsize
         self.maxreqs = defaults.maxreqs
+        self.persistent = defaults.persistent
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.host = '127.0.0.1'
         self.socket.bind((self.host, self.port))
+        self.port = self.socket.getsockname()[1]
         self.socket.listen(self.maxreqs)
+        self.client_socket = None
+        self.codec = DillCodec()
+        self.init_sampler(sampling_data)
+        self.init_cache(defaults.result_cache)
+        self.negotiator = CodecNegotiator(defaults.codecs, self.sample_space)
 
+    def init_sampler(self, sampling_data):
         if sampling_data.sampler is not None:
             self.sampler_type = ('random' if sampling_data.sampler_type is None
                                  else sampling_data.sampler_type)
@@ -148,35 +186,75 @@ class Server:
             raise ValueError("Sample space for `Server` cannot contain `TimeSeriesFeature`")
 
     def listen(self):
-        client_socket, addr = self.socket.accept()
+        with self.timed('accept'):
+            client_socket, addr = self.socket.accept()
         self.client_socket = client_socket
+        if self.persistent:
+            self.codec = self.negotiate(client_socket)
+
+    def negotiate(self, client_socket):
+        """Agree on a codec with a newly-connected persistent client."""
+        codec, reply = self.negotiator.accept(receive_message(client_socket))
+        send_message(client_socket, reply)
+        return codec
 
     def receive(self):
+        if self.persistent:
+            with self.timed('simulate'):
+                msg = receive_message(self.client_socket)
+            if msg is None:
+                raise ConnectionError('client ended the session')
+            with self.timed('decode'):
+                return self.decode(msg)
         data = []
-        while True:
-            msg = self.client_socket.recv(self.bufsize)
-            if not msg:
-                break
-            data.append(msg)
-        simulation_data = self.decode(b"".join(data))
+        with self.timed('simulate'):
+            while True:
+                msg = self.client_socket.recv(self.bufsize)
+                if not msg:
+                    break
+                data.append(msg)
+        with self.timed('decode'):
+            simulation_data = self.decode(b"".join(data))
         return simulation_data
 
     def send(self, sample):
-        msg = self.encode(sample)
-        self.client_socket.send(msg)
-        self.client_socket.shutdown(socket.SHUT_WR)
+        with self.timed('encode'):
+            msg = self.encode(sample)
+        with self.timed('send'):
+            if self.persistent:
+                send_message(self.client_socket, msg)
+            else:
+                self.client_socket.send(msg)
+                self.client_socket.shutdown(socket.SHUT_WR)
 
-    def encode(self, sample):
-        return dill.dumps(sample)
+    def encode(self, sample, codec=None):
+        return (self.codec if codec is None else codec).encode(sample)
 
-    def decode(self, data):
-        return dill.loads(data)
+    def decode(self, data, codec=None):
+        return (self.codec if codec is None else codec).decode(data)
+
+    def timed(self, phase):
+        """Context manager recording the time taken by a phase, if instrumented."""
+        return timed(self.instrumentation, phase)
+
+    def record(self, phase, seconds):
+        if self.instrumentation is not None:
+            self.instrumentation.record(phase, seconds)
 
     def terminate(self):
+        if self.persistent and self.client_socket is not None:
+            try:
+                send_end_of_session(self.client_socket)
+            except OSError:
+                pass    # client already gone
+            self.close_connection()
         self.socket.close()
         
     def close_connection(self):
-        self.client_socket.close()
+        if self.client_socket is not None:
+            self.client_socket.close()
+            self.client_socket = None
+        self.codec.close()
 
     def get_sample(self):
         return self.sampler.getSample()
@@ -185,34 +263,550 @@ class Server:
         return self.sampler.space.flatten(sample)
 
     def evaluate_sample(self, sample):
-        self.listen()
-        self.send(sample)
-        simulation_data = self.receive()
-        self.close_connection()
-        value = (0 if self.monitor is None
-                 else self.monitor.evaluate(simulation_data))
+        if self.persistent:
+            simulation_data = self.exchange(sample)
+        else:
+            self.listen()
+            self.send(sample)
+            simulation_data = self.receive()
+            self.close_connection()
+        with self.timed('monitor'):
+            value = (0 if self.monitor is None
+                     else self.monitor.evaluate(simulation_data))
+        return value
+
+    def exchange(self, sample):
+        """Run a sample over the current session, returning the simulation data.
+
+        Waits for a client to connect if there is no open session, and resends
+        the sample to a new client if the current one disconnects before
+        returning a result.
+        """
+        while True:
+            try:
+                if self.client_socket is None:
+                    self.listen()
+                self.send(sample)
+                return self.receive()
+            except OSError:
+                self.close_connection()
+
+    def init_cache(self, cache):
+        """Use the given `ResultCache` (if any) for this server's space and monitor."""
+        self.cache = cache
+        if cache is not None:
+            cache.bind(fingerprint(self.sample_space, self.monitor))
+
+    def cached_value(self, sample):
+        """Look up a sample in the result cache, returning a pair (found, value)."""
+        if self.cache is None:
+            return False, None
+        with self.timed('cache'):
+            key = self.sample_space.flattenStaticSample(sample.staticSample)
+            return self.cache.get(key)
+
+    def cache_value(self, sample, value):
+        if self.cache is not None and value is not None:
+            self.cache.put(self.sample_space.flattenStaticSample(sample.staticSample),
+                           value)
+
+    def evaluate_cached(self, sample):
+        """Like `evaluate_sample`, but using the result cache if there is one."""
+        found, value = self.cached_value(sample)
+        if not found:
+            value = self.evaluate_sample(sample.staticSample)
+            self.cache_value(sample, value)
         return value
 
     def run_server(self):
         start = time.time()
-        sample = self.get_sample()
+        with self.timed('sample'):
+            sample = self.get_sample()
         after_sampling = time.time()
-        self.lastValue = self.evaluate_sample(sample.staticSample)
-        completed_sample = sample.complete(self.lastValue)
+        self.lastValue = self.evaluate_cached(sample)
+        with self.timed('complete'):
+            completed_sample = sample.complete(self.lastValue)
         after_simulation = time.time()
         timings = ServerTimings(sample_time=(after_sampling - start),
                                 simulate_time=(after_simulation - after_sampling))
         return completed_sample, self.lastValue, timings
 
-try:
-    import ray
-    @ray.remote
-    class ParallelServer(Server):
-        pass
-except ModuleNotFoundError:
-    class ParallelServer(Server):
-        def __init__(*args, **kwargs):
-            raise RuntimeError('ParallelServer requires ray to be installed')
+class MultiClientServer(Server):
+    """Server dispatching samples to many simulator clients at once.
+
+    Any number of clients may connect to the same port; they must be created
+    with ``persistent=True``. Each connected client is kept busy with one
+    sample at a time, and `run_server` returns results in whatever order the
+    simulations finish, completing each `Sample` with its own value. If a
+    client disconnects before returning a result, its sample is resent to the
+    next available client.
+
+    Supported server options are those of `Server` (``persistent`` is always
+    on), plus:
+
+        * ``max_in_flight``: maximum number of samples being simulated at
+          once (default `None`, meaning one per connected client).
+
+    Note that samplers which need feedback before producing the next sample
+    (e.g. grid sampling) cannot be used with more than one client.
+    """
+    def __init__(self, sampling_data, monitor, options={}):
+        defaults = DotMap(max_in_flight=None)
+        defaults.update(options)
+        defaults.persistent = True
+        super().__init__(sampling_data, monitor, defaults)
+        self.max_in_flight = defaults.max_in_flight
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.idle_clients = deque()
+        self.in_flight = {}
+        self.client_codecs = {}
+        self.pending = deque()
+        self.cached_results = deque()
+        self.sent_at = {}
+        self.exhausted = False
+
+    def listen(self):
+        with self.timed('accept'):
+            client_socket, addr = self.socket.accept()
+        try:
+            self.client_codecs[client_socket] = self.negotiate(client_socket)
+        except OSError:
+            client_socket.close()
+            return
+        self.selector.register(client_socket, selectors.EVENT_READ)
+        self.idle_clients.append(client_socket)
+
+    def drop_client(self, client_socket):
+        self.selector.unregister(client_socket)
+        client_socket.close()
+        self.client_codecs.pop(client_socket).close()
+        if client_socket in self.idle_clients:
+            self.idle_clients.remove(client_socket)
+        self.sent_at.pop(client_socket, None)
+        sample = self.in_flight.pop(client_socket, None)
+        if sample is not None:
+            self.pending.appendleft(sample)
+
+    def next_sample(self):
+        if self.pending:
+            return self.pending.popleft()
+        if self.exhausted:
+            return None
+        try:
+            return self.get_sample()
+        except TerminationException:
+            self.exhausted = True
+            return None
+
+    def dispatch(self):
+        """Send new samples to idle clients, returning the time spent sampling.
+
+        Stops at the first sample found in the result cache, which is queued
+        for `run_server` to return without using up a client.
+        """
+        sample_time = 0
+        while (not self.cached_results and self.idle_clients
+               and (self.max_in_flight is None
+                    or len(self.in_flight) < self.max_in_flight)):
+            start = time.time()
+            with self.timed('sample'):
+                sample = self.next_sample()
+            sample_time += time.time() - start
+            if sample is None:
+                break
+            found, value = self.cached_value(sample)
+            if found:
+                self.cached_results.append((sample, value))
+                continue
+            client_socket = self.idle_clients.popleft()
+            self.in_flight[client_socket] = sample
+            try:
+                codec = self.client_codecs[client_socket]
+                with self.timed('encode'):
+                    msg = self.encode(sample.staticSample, codec)
+                with self.timed('send'):
+                    send_message(client_socket, msg)
+                self.sent_at[client_socket] = time.perf_counter()
+            except OSError:
+                self.drop_client(client_socket)
+        return sample_time
+
+    def run_server(self):
+        start = time.time()
+        sample_time = self.dispatch()
+        while True:
+            if self.cached_results:
+                sample, self.lastValue = self.cached_results.popleft()
+                with self.timed('complete'):
+                    completed_sample = sample.complete(self.lastValue)
+                timings = ServerTimings(sample_time=sample_time,
+                                        simulate_time=(time.time() - start - sample_time))
+                return completed_sample, self.lastValue, timings
+            if not self.in_flight and not self.pending and self.exhausted:
+                raise TerminationException('sampler and in-flight samples exhausted')
+            for key, events in self.selector.select():
+                client_socket = key.fileobj
+                if client_socket is self.socket:
+                    self.listen()
+                    continue
+                if client_socket not in self.in_flight:
+                    self.drop_client(client_socket)     # unexpected data
+                    continue
+                try:
+                    msg = receive_message(client_socket)
+                except OSError:
+                    msg = None
+                if msg is None:
+                    self.drop_client(client_socket)
+                    continue
+                sample = self.in_flight.pop(client_socket)
+                self.record('simulate',
+                            time.perf_counter() - self.sent_at.pop(client_socket))
+                self.idle_clients.append(client_socket)
+                with self.timed('decode'):
+                    simulation_data = self.decode(msg, self.client_codecs[client_socket])
+                with self.timed('monitor'):
+                    self.lastValue = (0 if self.monitor is None
+                                      else self.monitor.evaluate(simulation_data))
+                self.cache_value(sample, self.lastValue)
+                with self.timed('complete'):
+                    completed_sample = sample.complete(self.lastValue)
+                sample_time += self.dispatch()
+                timings = ServerTimings(sample_time=sample_time,
+                                        simulate_time=(time.time() - start - sample_time))
+                return completed_sample, self.lastValue, timings
+            sample_time += self.dispatch()
+
+    def terminate(self):
+        for client_socket in list(self.idle_clients) + list(self.in_flight):
+            try:
+                send_end_of_session(client_socket)
+            except OSError:
+                pass    # client already gone
+            client_socket.close()
+        for codec in self.client_codecs.values():
+            codec.close()
+        self.idle_clients.clear()
+        self.in_flight.clear()
+        self.client_codecs.clear()
+        self.selector.close()
+        self.socket.close()
+
+class AsyncServer(Server):
+    """Server multiplexing many simulator clients on an asyncio event loop.
+
+    Clients may be `AsyncClient` instances or persistent `Client` instances. Use
+    the async generator `results` to run samples; each connected client is
+    kept busy with one sample, and results are yielded as they finish. The
+    falsifier method `run_falsifier_async` does this automatically.
+
+    Supported server options are those of `Server`, plus:
+
+        * ``max_in_flight``: maximum number of samples being simulated at
+          once (default `None`, meaning one per connected client);
+        * ``timeout``: seconds to wait for the result of a simulation before
+          dropping the client running it (default `None`, meaning forever);
+        * ``max_attempts``: how many times a sample is sent to a client before
+          it is discarded after timeouts or disconnections (default 2);
+        * ``evaluate_in_executor``: if True, run the monitor in the event
+          loop's default executor so that slow monitors do not block
+          communication with other clients.
+    """
+    def __init__(self, sampling_data, monitor, options={}):
+        defaults = DotMap(max_in_flight=None, timeout=None, max_attempts=2,
+                          evaluate_in_executor=False, verbosity=0)
+        defaults.update(options)
+        defaults.persistent = True
+        super().__init__(sampling_data, monitor, defaults)
+        self.max_in_flight = defaults.max_in_flight
+        self.timeout = defaults.timeout
+        self.max_attempts = defaults.max_attempts
+        self.evaluate_in_executor = defaults.evaluate_in_executor
+        self.verbosity = defaults.verbosity
+        self.server = None
+        self.idle_clients = None
+        self.clients = {}
+        self.retries = deque()
+        self.discarded = 0
+
+    async def start(self):
+        """Start accepting clients, if not already doing so."""
+        if self.server is not None:
+            return
+        self.idle_clients = asyncio.Queue()
+        self.server = await asyncio.start_server(self._client_connected,
+                                                 sock=self.socket)
+
+    async def _client_connected(self, reader, writer):
+        try:
+            codec, reply = self.negotiator.accept(await read_message(reader))
+            await write_message(writer, reply)
+        except OSError:
+            writer.close()
+            return
+        client = (reader, writer)
+        self.clients[client] = codec
+        self.idle_clients.put_nowait(client)
+
+    def _drop_client(self, client):
+        codec = self.clients.pop(client, None)
+        if codec is not None:
+            codec.close()
+        client[1].close()
+
+    async def evaluate(self, simulation_data):
+        if self.monitor is None:
+            return 0
+        if self.evaluate_in_executor:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.monitor.evaluate,
+                                              simulation_data)
+        return self.monitor.evaluate(simulation_data)
+
+    async def run_sample(self, client, sample, sample_time, attempt=1):
+        """Simulate a sample on the given client.
+
+        Returns the usual triple of completed sample, value and timings, or
+        None if the simulation failed (in which case the sample is queued to be
+        retried, or discarded if it has used up its attempts).
+        """
+        reader, writer = client
+        codec = self.clients[client]
+        start = time.time()
+        try:
+            with self.timed('encode'):
+                msg = self.encode(sample.staticSample, codec)
+            with self.timed('send'):
+                await write_message(writer, msg)
+            with self.timed('simulate'):
+                msg = await asyncio.wait_for(read_message(reader), self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            msg = None
+        if msg is None:
+            self._drop_client(client)
+            if attempt < self.max_attempts:
+                self.retries.append((sample, sample_time, attempt + 1))
+            else:
+                self.discarded += 1
+                if self.verbosity >= 1:
+                    print(f'Discarding sample after {attempt} failed attempts')
+            return None
+        # zero-copy results are only valid until the client's next message,
+        # so such clients only get a new sample once evaluation is done
+        if not codec.zero_copy:
+            self.idle_clients.put_nowait(client)
+        with self.timed('decode'):
+            simulation_data = self.decode(msg, codec)
+        with self.timed('monitor'):
+            value = await self.evaluate(simulation_data)
+        if codec.zero_copy:
+            self.idle_clients.put_nowait(client)
+        self.cache_value(sample, value)
+        self.lastValue = value
+        with self.timed('complete'):
+            completed_sample = sample.complete(value)
+        timings = ServerTimings(sample_time=sample_time,
+                                simulate_time=(time.time() - start))
+        return completed_sample, value, timings
+
+    async def results(self):
+        """Asynchronously iterate over results of simulations as they finish.
+
+        Yields triples of completed sample, value and `ServerTimings`, as
+        returned by `Server.run_server`. Stops when the sampler is exhausted
+        and all outstanding simulations have finished.
+        """
+        await self.start()
+        running = set()
+        waiting = None
+        exhausted = False
+        try:
+            while True:
+                if (waiting is None and (self.retries or not exhausted)
+                    and (self.max_in_flight is None
+                         or len(running) < self.max_in_flight)):
+                    waiting = asyncio.ensure_future(self.idle_clients.get())
+                pending = running | ({waiting} if waiting else set())
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if waiting in done:
+                    client = waiting.result()
+                    waiting = None
+                    if self.retries:
+                        args = self.retries.popleft()
+                    else:
+                        start = time.time()
+                        try:
+                            with self.timed('sample'):
+                                sample = self.get_sample()
+                        except TerminationException:
+                            exhausted = True
+                            self.idle_clients.put_nowait(client)
+                            continue
+                        found, value = self.cached_value(sample)
+                        if found:
+                            self.idle_clients.put_nowait(client)
+                            self.lastValue = value
+                            with self.timed('complete'):
+                                sample = sample.complete(value)
+                            yield sample, value, ServerTimings(
+                                sample_time=time.time() - start, simulate_time=0)
+                            continue
+                        args = (sample, time.time() - start)
+                    running.add(asyncio.ensure_future(self.run_sample(client, *args)))
+                for task in done & running:
+                    running.remove(task)
+                    result = task.result()
+                    if result is not None:
+                        yield result
+        finally:
+            if waiting is not None:
+                waiting.cancel()
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(running)
+
+    def run_server(self):
+        raise RuntimeError('AsyncServer must be used with run_falsifier_async')
+
+    async def aclose(self):
+        """Stop accepting clients and end all sessions."""
+        if self.server is not None:
+            self.server.close()
+        for (reader, writer), codec in list(self.clients.items()):
+            try:
+                await write_message(writer, b'')
+            except OSError:
+                pass    # client already gone
+            writer.close()
+            codec.close()
+        self.clients.clear()
+        self.socket.close()
+
+    def terminate(self):
+        self.socket.close()
+
+class _SimulationWorker:
+    def __init__(self, simulator, monitor):
+        self.simulator = simulator
+        self.monitor = monitor
+
+    def evaluate(self, sample):
+        simulation_data = self.simulator(sample)
+        return (0 if self.monitor is None
+                else self.monitor.evaluate(simulation_data))
+
+class ParallelServer(Server):
+    """Server running simulations in parallel in local worker processes.
+
+    This is the server used by `generic_parallel_falsifier` for a generic
+    (non-Scenic) sample space. Samples are drawn in the parent process; the
+    workers simulate them and evaluate the monitor, and the results are fed
+    back to the sampler in the order they arrive.
+
+    Supported server options:
+
+        * ``simulator`` (required): function taking a sample and returning the
+          outcome of simulating it (e.g. trajectories), to be passed to the
+          monitor. It runs in the worker processes, so it (and the monitor)
+          must be picklable when processes are spawned rather than forked;
+        * ``start_method``: `multiprocessing` start method for the workers
+          (default `None`, meaning the platform default);
+        * ``result_cache``, ``instrumentation``: as for `Server`. The
+          ``simulate`` phase covers the whole round trip to a worker,
+          including evaluating the monitor.
+
+    To run simulations in external simulator processes instead, see
+    `MultiClientServer` and `AsyncServer`.
+    """
+    def __init__(self, total_workers, n_iters, sampling_data, scenic_path, monitor,
+                 options={}, max_time=None, sampler=None):
+        defaults = DotMap(simulator=None, start_method=None, result_cache=None,
+                          instrumentation=None)
+        defaults.update(options)
+        if defaults.simulator is None:
+            raise RuntimeError('ParallelServer requires the "simulator" option')
+        self.monitor = monitor
+        self.lastValue = None
+        self.instrumentation = defaults.instrumentation
+        self.total_workers = total_workers
+        self.n_iters = n_iters
+        self.max_time = max_time
+        sampling_data.sampler = sampler
+        self.init_sampler(sampling_data)
+        self.init_cache(defaults.result_cache)
+        self.workers = [
+            WorkerProcess(_SimulationWorker, defaults.simulator, monitor,
+                          context=defaults.start_method)
+            for i in range(self.total_workers)
+        ]
+
+    def run_server(self, on_result=None):
+        """Run the simulations, returning a list of (sample, value) pairs.
+
+        If on_result is not None, it is called with each completed sample and
+        its value as soon as they are available; if it returns True, the run
+        stops, abandoning any simulations still running.
+        """
+        results = []
+        running = {}
+        idle = list(self.workers)
+        exhausted = False
+        start = None
+        def add(sample, value):
+            with self.timed('complete'):
+                completed_sample = sample.complete(value)
+            results.append((completed_sample, value))
+            return on_result is not None and on_result(completed_sample, value)
+        def out_of_time():
+            return (self.max_time is not None and start is not None
+                    and time.time() - start >= self.max_time)
+        while True:
+            while idle and not exhausted and (self.n_iters is None
+                    or len(results) + len(running) < self.n_iters):
+                try:
+                    with self.timed('sample'):
+                        sample = self.get_sample()
+                except TerminationException:
+                    exhausted = True
+                    break
+                found, value = self.cached_value(sample)
+                if found:
+                    if add(sample, value):
+                        return results
+                    if start is None:
+                        start = time.time()
+                    if out_of_time():
+                        return results
+                    continue
+                worker = idle.pop()
+                worker.submit('evaluate', sample.staticSample)
+                running[worker] = (sample, time.perf_counter())
+            if not running:
+                break
+            for worker in wait_for_any(list(running)):
+                sample, submitted = running.pop(worker)
+                self.lastValue = worker.result()
+                self.record('simulate', time.perf_counter() - submitted)
+                self.cache_value(sample, self.lastValue)
+                idle.append(worker)
+                if add(sample, self.lastValue):
+                    return results
+            if start is None:
+                start = time.time()
+            if self.n_iters is not None and len(results) >= self.n_iters:
+                break
+            if out_of_time():
+                break
+        return results
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.close()
 
 @dataclass
 class ServerTimings:
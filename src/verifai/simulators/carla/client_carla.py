@@ -6,7 +6,8 @@ class ClientCarla(Client):
     def __init__(self, simulation_data):
         port = simulation_data.port
         bufsize = simulation_data.bufsize
-        super().__init__(port, bufsize)
+        persistent = simulation_data.get('persistent', False)
+        super().__init__(port, bufsize, persistent=persistent)
         self.task = simulation_data.task
 
     def simulate(self, sample):
@@ -225,10 +225,10 @@ class XPlaneFalsifier(verifai.falsifier.mtl_falsifier):
         super().populate_error_table(sample, rho, error)
         if self.video_threshold is not None and rho <= self.video_threshold:
             if error:
-                index = len(self.error_table.table) - 1
+                index = self.error_table.num_rows - 1
                 name = f'error-{index}'
             else:
-                index = len(self.safe_table.table) - 1
+                index = self.safe_table.num_rows - 1
                 name = f'safe-{index}'
             import utils.images
             utils.images.write_video(self.server.images, filename=name+'.avi',
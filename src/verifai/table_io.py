@@ -0,0 +1,187 @@
+"""Saving error tables to disk during falsification, and loading them back.
+
+Tables can be stored as Parquet, Arrow IPC (Feather v2) or CSV files. The
+columnar formats require pyarrow (e.g. ``pip install "verifai[tables]"``).
+"""
+
+import os
+import time
+
+import pandas as pd
+
+from verifai.error_table import error_table
+
+#: File formats for each recognized file extension.
+formats = {
+    '.parquet': 'parquet', '.pq': 'parquet',
+    '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow',
+    '.csv': 'csv',
+}
+
+def format_for_path(path, format=None):
+    """Determine the format of a table file from its extension, if not given.
+
+    Files with unrecognized extensions are treated as CSV.
+    """
+    if format is None:
+        format = formats.get(os.path.splitext(path)[1].lower(), 'csv')
+    if format not in ('parquet', 'arrow', 'csv'):
+        raise RuntimeError(f'unknown table format "{format}"')
+    return format
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ModuleNotFoundError:
+        raise RuntimeError(
+            'Parquet and Arrow tables require pyarrow to be installed')
+    return pyarrow
+
+class TableWriter:
+    """Saves the rows of an `error_table` to a file as they are added.
+
+    Call `update` whenever rows have been added to the table: new rows are
+    written out in batches, once at least ``flush_rows`` rows are pending or
+    ``flush_interval`` seconds have passed since the last write. Call `close`
+    when done to write the remaining rows and finish the file (Parquet and
+    Arrow files are only readable once closed). Writing again after closing
+    starts a new file containing the whole table.
+
+    If the columns of the table change, e.g. because a multi-objective monitor
+    adds ``rho_i`` columns, the file is rewritten from scratch.
+
+    Args:
+        table (error_table): table to save.
+        path (str): file to write.
+        format (str; optional): ``'parquet'``, ``'arrow'`` or ``'csv'``; by
+          default determined by `format_for_path`.
+        flush_rows (int): number of pending rows causing a write.
+        flush_interval (float): maximum time in seconds to hold pending rows;
+          `None` for no limit.
+    """
+    def __init__(self, table, path, format=None, flush_rows=100, flush_interval=10):
+        self.table = table
+        self.path = path
+        self.format = format_for_path(path, format)
+        if self.format != 'csv':
+            self.pyarrow = _import_pyarrow()
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.last_flush = time.monotonic()
+        self._file = None
+        self._columns = None
+
+    @property
+    def pending_rows(self):
+        if self._file is None:
+            return self.table.num_rows
+        return self.table.num_rows - self.rows_written
+
+    def update(self):
+        """Write out pending rows if enough have accumulated."""
+        pending = self.pending_rows
+        if pending == 0:
+            return
+        if (pending >= self.flush_rows
+            or (self.flush_interval is not None
+                and time.monotonic() - self.last_flush >= self.flush_interval)):
+            self.flush()
+
+    def flush(self):
+        """Write out all pending rows."""
+        if self._file is not None and self._columns != self.table.column_names:
+            self.close_file()
+        if self._file is None:
+            self.rows_written = 0
+        rows = self.table.tail(self.table.num_rows - self.rows_written)
+        if self._file is None:
+            self._open(rows)
+        elif not self._write(rows):
+            # Column types changed incompatibly: start over with the whole table.
+            self.close_file()
+            self.flush()
+            return
+        self.rows_written = self.table.num_rows
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """Write out any pending rows and finish the file."""
+        if self._file is None and self.rows_written == self.table.num_rows:
+            return      # nothing new since the file was last closed
+        if self.pending_rows > 0:
+            self.flush()
+        self.close_file()
+
+    def close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self, rows):
+        self._columns = list(self.table.column_names)
+        if self.format == 'csv':
+            self._file = open(self.path, 'w', newline='')
+            rows.to_csv(self._file)
+            self._file.flush()
+            return
+        pa = self.pyarrow
+        batch = pa.Table.from_pandas(rows, preserve_index=False)
+        self.schema = batch.schema.remove_metadata()
+        if self.format == 'parquet':
+            import pyarrow.parquet
+            self._file = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        else:
+            self._file = pa.ipc.new_file(self.path, self.schema)
+        self._file.write_table(batch.cast(self.schema))
+
+    def _write(self, rows):
+        if self.format == 'csv':
+            rows.to_csv(self._file, header=False)
+            self._file.flush()
+            return True
+        pa = self.pyarrow
+        try:
+            batch = pa.Table.from_pandas(rows, preserve_index=False)
+            batch = batch.cast(self.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            return False
+        self._file.write_table(batch)
+        return True
+
+    def __del__(self):
+        self.close_file()
+
+def read_table(path, format=None, memory_map=True):
+    """Load a table saved by `TableWriter` as a DataFrame.
+
+    Parquet and Arrow files are memory-mapped when ``memory_map`` is true, so
+    that large tables load quickly; Arrow files avoid copying numerical columns
+    without missing values where possible.
+    """
+    format = format_for_path(path, format)
+    if format == 'csv':
+        return pd.read_csv(path, index_col=0)
+    pa = _import_pyarrow()
+    if format == 'parquet':
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path, memory_map=memory_map)
+    else:
+        source = pa.memory_map(path, 'r') if memory_map else pa.OSFile(path, 'rb')
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+def load_error_table(path, format=None, column_type=None, memory_map=True):
+    """Load a table saved by `TableWriter` as an `error_table` for analysis.
+
+    If ``column_type`` is not given, columns with numerical (non-Boolean)
+    types are considered numerical and all others categorical.
+    """
+    table = read_table(path, format=format, memory_map=memory_map)
+    if column_type is None:
+        column_type = {
+            name: (pd.api.types.is_numeric_dtype(table[name])
+                   and not pd.api.types.is_bool_dtype(table[name]))
+            for name in table.columns
+        }
+    return error_table(table=table, column_type=column_type)
@@ -1,5 +1,8 @@
 """Assorted utility functions"""
 
+import collections.abc
+import math
+
 ### Exceptions
 
 class RejectionException(Exception):
@@ -20,3 +23,107 @@ def cached(oldMethod):
 def cached_property(oldMethod):
     """Decorator for making a property which caches its value"""
     return property(cached(oldMethod))
+
+class LazyMapping(collections.abc.Mapping):
+    """A read-only mapping whose values are computed when first looked up.
+
+    Args:
+        keys (function): function returning an iterator over the keys; only
+          called when iterating over the whole mapping.
+        size (int): number of keys.
+        contains (function): predicate saying whether an object is a key.
+        makeValue (function): function computing the value for a key.
+        maxSize (int; optional): if not None, at most this many values are
+          kept, evicting the least recently used ones (which are computed
+          again if needed).
+    """
+    def __init__(self, keys, size, contains, makeValue, maxSize=None):
+        if maxSize is not None and maxSize < 1:
+            raise RuntimeError('maxSize of LazyMapping must be positive')
+        self._keys = keys
+        self._size = size
+        self._contains = contains
+        self._makeValue = makeValue
+        self.maxSize = maxSize
+        self._values = collections.OrderedDict()
+
+    def __getitem__(self, key):
+        values = self._values
+        try:
+            value = values[key]
+        except KeyError:
+            if not self._contains(key):
+                raise
+            value = values[key] = self._makeValue(key)
+            if self.maxSize is not None and len(values) > self.maxSize:
+                values.popitem(last=False)
+        else:
+            if self.maxSize is not None:
+                values.move_to_end(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._values or self._contains(key)
+
+    def __iter__(self):
+        return self._keys()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def computed(self):
+        """Dict of the values computed so far (and not evicted)."""
+        return dict(self._values)
+
+### Rejection sampling
+
+class AcceptanceRate:
+    """Statistics of a rejection sampler, used to size blocks of candidates.
+
+    Keeps the total numbers of candidates drawn and accepted, as well as a
+    smoothed estimate of the current acceptance rate, so that block sizes
+    follow the rate if it drifts (e.g. because the candidates come from an
+    active sampler).
+
+    Args:
+        minBlockSize (int): smallest number of candidates to draw at once.
+        maxBlockSize (int): largest number of candidates to draw at once.
+        smoothing (float): weight of the latest block in the estimate.
+    """
+    def __init__(self, minBlockSize=16, maxBlockSize=65536, smoothing=0.5):
+        self.minBlockSize = minBlockSize
+        self.maxBlockSize = maxBlockSize
+        self.smoothing = smoothing
+        self.candidates = 0
+        self.accepted = 0
+        self.estimate = None
+
+    @property
+    def rate(self):
+        """Fraction of all candidates which were accepted (None if none were drawn)."""
+        if self.candidates == 0:
+            return None
+        return self.accepted / self.candidates
+
+    def record(self, candidates, accepted):
+        """Record a block of candidates, of which the given number were accepted."""
+        if candidates == 0:
+            return
+        self.candidates += candidates
+        self.accepted += accepted
+        rate = accepted / candidates
+        if self.estimate is None:
+            self.estimate = rate
+        else:
+            self.estimate += self.smoothing * (rate - self.estimate)
+
+    def blockSize(self, needed):
+        """Number of candidates to draw to get about the given number accepted."""
+        if self.estimate is None:
+            size = needed
+        elif self.estimate * self.maxBlockSize <= needed:
+            size = self.maxBlockSize
+        else:
+            size = math.ceil(needed / self.estimate)
+        return min(max(size, self.minBlockSize), self.maxBlockSize)
@@ -0,0 +1,104 @@
+"""Local worker processes, used for parallel falsification without ray."""
+
+import multiprocessing
+from multiprocessing.connection import wait
+
+import dill
+
+class WorkerProcess:
+    """An object living in its own process, whose methods can be called remotely.
+
+    A lightweight stand-in for a ray actor: the object is created in a new
+    process by calling ``factory(*args)``. Use `submit` to start calling one of
+    its methods and `result` to wait for the return value (re-raising any
+    exception the method raised), or `call` to do both. Each worker runs one
+    call at a time. Arguments and results are pickled with dill, so that e.g.
+    samples can be passed directly.
+
+    Args:
+        factory: class or function creating the object in the worker.
+        args: arguments for ``factory``.
+        context (str; optional): `multiprocessing` start method to use.
+    """
+    def __init__(self, factory, *args, context=None):
+        context = multiprocessing.get_context(context)
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve,
+                                       args=(child, dill.dumps((factory, args))),
+                                       daemon=True)
+        self.process.start()
+        child.close()
+        self.busy = False
+
+    def submit(self, method, *args):
+        self.connection.send_bytes(dill.dumps((method, args)))
+        self.busy = True
+
+    def result(self):
+        try:
+            succeeded, value = dill.loads(self.connection.recv_bytes())
+        except EOFError as e:
+            raise RuntimeError('worker process died') from e
+        finally:
+            self.busy = False
+        if not succeeded:
+            raise value
+        return value
+
+    def call(self, method, *args):
+        self.submit(method, *args)
+        return self.result()
+
+    def close(self, timeout=1):
+        """Shut down the worker, killing it if it is still busy."""
+        if not self.busy:
+            try:
+                self.connection.send_bytes(b'')
+            except OSError:
+                pass    # worker already gone
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+def wait_for_any(workers):
+    """Wait until some of the given busy workers have results ready, and return them."""
+    ready = wait([worker.connection for worker in workers])
+    return [worker for worker in workers if worker.connection in ready]
+
+def _serve(connection, constructor):
+    try:
+        factory, args = dill.loads(constructor)
+        obj, error = factory(*args), None
+    except Exception as e:
+        obj, error = None, e
+    while True:
+        try:
+            request = connection.recv_bytes()
+        except EOFError:
+            break
+        if not request:
+            break
+        if error is not None:
+            _reply(connection, False, error)
+            continue
+        method, args = dill.loads(request)
+        try:
+            value = getattr(obj, method)(*args)
+        except Exception as e:
+            _reply(connection, False, e)
+        else:
+            _reply(connection, True, value)
+    connection.close()
+
+def _reply(connection, succeeded, value):
+    try:
+        message = dill.dumps((succeeded, value))
+    except Exception as e:
+        if succeeded:
+            error = RuntimeError(f'unable to send result from worker: {e}')
+        else:   # exception can't be pickled; send a description instead
+            error = RuntimeError(f'{type(value).__name__}: {value}')
+        message = dill.dumps((False, error))
+    connection.send_bytes(message)
@@ -3,7 +3,9 @@ import pytest
 from dotmap import DotMap
 
 from verifai.samplers.scenic_sampler import ScenicSampler, scenicMajorVersion
-from verifai.scenic_server import ScenicServer
+from verifai.scenic_server import ScenicServer, ParallelScenicServer
+from verifai.cache import ResultCache
+from verifai.instrumentation import Instrumentation
 from verifai.falsifier import generic_falsifier
 from verifai.monitor import specification_monitor
 from tests.utils import sampleWithFeedback, checkSaveRestore
@@ -231,3 +233,9 @@ def test_double_time_series_access():
                                     server_class=ScenicServer,
                                     server_options=server_options)
         falsifier.run_falsifier()
+
+def test_parallel_server_options():
+    for options in (DotMap(result_cache=ResultCache()),
+                    DotMap(instrumentation=Instrumentation())):
+        with pytest.raises(RuntimeError, match='does not support'):
+            ParallelScenicServer(2, 10, DotMap(), 'unused.scenic', None, options)
@@ -0,0 +1,53 @@
+import json
+
+from benchmarks import common, falsifier, samplers
+
+def test_samplers(tmp_path):
+    path = tmp_path / 'samplers.json'
+    assert samplers.main(['-n', '5', '-d', '10', '-k', 'random/', '-k', 'grid/',
+                          '-o', str(path)]) == 0
+    data = json.loads(path.read_text())
+    results = {case['name']: case for case in data['results']}
+    assert len(results) == 2 * len(samplers.spaces())
+    assert results['random/box']['samples'] == 5
+    assert results['grid/small_box']['samples_per_sec'] > 0
+    assert 'skipped' in results['grid/box']
+
+    # a much faster baseline makes every case a regression
+    for case in data['results']:
+        if 'skipped' not in case:
+            case['samples_per_sec'] *= 10
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(data))
+    assert samplers.main(['-n', '5', '-d', '10', '-k', 'random/box',
+                          '-o', str(path), '--baseline', str(baseline)]) == 1
+
+def test_compare():
+    baseline = [{'name': 'a', 'rate': 100, 'latency': 1.0},
+                {'name': 'b', 'skipped': 'no GPyOpt'}]
+    results = [{'name': 'a', 'rate': 90, 'latency': 1.5},
+               {'name': 'b', 'rate': 1}]
+    metrics = {'rate': True, 'latency': False}
+    assert common.compare(results, baseline, metrics) == [('a', 'latency', 1.0, 1.5)]
+    assert common.compare(results, baseline, metrics, tolerance=0.05) == [
+        ('a', 'rate', 100, 90), ('a', 'latency', 1.0, 1.5)]
+
+def test_falsifier(tmp_path):
+    path = tmp_path / 'falsifier.json'
+    assert falsifier.main(['-n', '20', '--falsifier', 'generic', '--tables', 'none',
+                           'csv', '-o', str(path)]) == 0
+    results = json.loads(path.read_text())['results']
+    assert len(results) == 4
+    for case in results:
+        assert case['samples'] == 20
+        assert case['overhead_ms_per_sample'] > 0
+        assert case['phases']['simulate']['total_s'] >= 0
+        if case['tables'] == 'csv':
+            assert case['table_file_bytes'] > 0 and 'record_ms_mean' in case
+
+def test_stub_latency():
+    result = falsifier.run_case('mtl', 'inprocess', 'memory', 5, latency=0.01,
+                                trajectory_size=10)
+    assert result['samples'] == 5
+    assert result['simulator_seconds'] >= 0.05
+    assert result['phases']['monitor']['mean_ms'] > 0
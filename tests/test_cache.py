@@ -0,0 +1,120 @@
+import threading
+
+import dill
+from dotmap import DotMap
+import pytest
+
+from verifai.features import *
+from verifai.cache import ResultCache, fingerprint
+from verifai.client import Client
+from verifai.falsifier import generic_falsifier
+from verifai.monitor import specification_monitor
+from verifai.server import Server, MultiClientServer
+
+def test_lru():
+    cache = ResultCache(max_entries=2)
+    cache.put((1,), 'a')
+    cache.put((2,), 'b')
+    assert cache.get((1,)) == (True, 'a')
+    cache.put((3,), 'c')    # evicts (2,), the least recently used
+    assert cache.get((2,)) == (False, None)
+    assert cache.get((3,)) == (True, 'c')
+    assert cache.stats() == {'hits': 2, 'disk_hits': 0, 'misses': 1,
+                             'hit_rate': 2/3, 'entries': 2}
+
+def test_disk(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = ResultCache(max_entries=1, path=path, max_disk_entries=3)
+    for i in range(5):
+        cache.put((i, 0.5), [i])
+    assert len(cache) == 3
+    assert cache.get((0, 0.5)) == (False, None)
+    assert cache.get((2, 0.5)) == (True, [2])
+    cache.close()
+
+    cache = ResultCache(path=path, max_disk_entries=3)
+    assert cache.get((4, 0.5)) == (True, [4])
+    assert cache.disk_hits == 1
+    copy = dill.loads(dill.dumps(cache))
+    assert copy.get((3, 0.5)) == (True, [3])
+    cache.put((5, 0.5), [5])    # evicts (2, 0.5), used longest ago
+    assert ResultCache(path=path).get((2, 0.5)) == (False, None)
+
+class CountingClient(Client):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.simulations = 0
+
+    def simulate(self, sample):
+        self.simulations += 1
+        return sample.x
+
+@pytest.mark.parametrize('server_class', [Server, MultiClientServer])
+def test_server_cache(server_class):
+    cache = ResultCache()
+    space = {'x': DiscreteBox((0, 3))}
+    monitor = specification_monitor(lambda x: x[0] - 1)
+    options = DotMap(port=0, persistent=True, result_cache=cache)
+    falsifier = generic_falsifier(sample_space=space, monitor=monitor,
+                                  falsifier_params=DotMap(n_iters=40),
+                                  server_options=options, server_class=server_class)
+    client = CountingClient(falsifier.server.port, 4096, persistent=True)
+    def loop():
+        while client.run_client():
+            pass
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    assert len(falsifier.samples) == 40
+    assert client.simulations == len(cache) == 4
+    assert cache.hits == 36 and cache.hit_rate == 0.9
+    for table in (falsifier.error_table, falsifier.safe_table):
+        for _, row in table.table.iterrows():
+            assert row['rho'] == row.iloc[0] - 1
+
+def simulateX(sample):
+    return sample.x[0] - 1
+
+def test_parallel_server_cache():
+    from verifai.falsifier import generic_parallel_falsifier
+    # every sample is soon in the cache: the run must still respect max_time
+    cache = ResultCache()
+    options = DotMap(num_workers=2, simulator=simulateX, result_cache=cache)
+    falsifier = generic_parallel_falsifier(
+        sample_space={'x': DiscreteBox((0, 3))},
+        monitor=specification_monitor(lambda rho: rho),
+        falsifier_params=DotMap(n_iters=None, max_time=0.5, save_error_table=False,
+                                save_safe_table=False),
+        server_options=options)
+    falsifier.run_falsifier()
+    assert falsifier.num_results > len(cache) == 4
+    assert cache.hits > 0
+
+def test_fingerprint_mismatch(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    space = FeatureSpace({'x': Feature(Box((0, 1)))})
+    monitor = specification_monitor(lambda traj: traj)
+    other = specification_monitor(lambda traj: traj - 1)
+    assert fingerprint(space, monitor) == fingerprint(space, monitor)
+    assert fingerprint(space, monitor) != fingerprint(space, other)
+    cache = ResultCache(path=path)
+    cache.bind(fingerprint(space, monitor))
+    cache.put((0.5,), 0.5)
+    cache.close()
+
+    cache = ResultCache(path=path)
+    cache.bind(fingerprint(space, monitor))
+    assert cache.get((0.5,)) == (True, 0.5)
+    with pytest.raises(RuntimeError):
+        cache.bind(fingerprint(space, other))
+    with pytest.raises(RuntimeError):
+        ResultCache(path=path).bind(fingerprint(space, other))
+    cache = ResultCache(path=path, on_mismatch='clear')
+    cache.bind(fingerprint(space, other))
+    assert cache.get((0.5,)) == (False, None)
+
+    cache = ResultCache(path=str(tmp_path / 'fixed.db'), fingerprint='v1')
+    cache.put((0.5,), 1)
+    cache.bind(fingerprint(space, other))
+    assert cache.get((0.5,)) == (True, 1)
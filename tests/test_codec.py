@@ -0,0 +1,126 @@
+from dotmap import DotMap
+import numpy as np
+
+from verifai.features import *
+from verifai.samplers import FeatureSampler
+from verifai.codec import (BinaryCodec, DillCodec, SharedMemoryCodec,
+                           CodecNegotiator, hello_message, codec_from_reply)
+from verifai.protocol import _as_buffers
+
+### Utilities
+
+def roundtrip(codec, obj):
+    return roundtrip_with(codec, codec, obj)
+
+def roundtrip_with(encoder, decoder, obj):
+    encoded = encoder.encode(obj)
+    data = b''.join(bytes(buf) for buf in _as_buffers(encoded))
+    return decoder.decode(bytearray(data))
+
+### Tests
+
+def test_binary_values():
+    codec = BinaryCodec()
+    values = [
+        None, True, False, 0, -5, 2**70, 1.5, float('inf'), 'héllo', b'\x00\x01',
+        [], (), [1.0, 2.0, 3.0], (1.0, -2.5), [1, 'a', None, (2.0,)],
+        [(1.0, 2.0), (3.0, 4.0)], ([1.0], [2.0]), [(1.0, 2.0), (3.0,)],
+        {'x': [0.1, 0.2], 3: {'nested': (1, 2)}, (1, 2): None},
+        np.float32(1.25), np.int64(7), np.bool_(True),
+        {1, 2, 3}, DotMap(a=1),
+    ]
+    for value in values:
+        result = roundtrip(codec, value)
+        assert result == value
+        assert type(result) is type(value)
+
+def test_binary_arrays():
+    codec = BinaryCodec()
+    arrays = [
+        np.arange(10, dtype=np.int16),
+        np.random.random((3, 4)),
+        np.random.random((300, 100)),     # large enough to be sent separately
+        np.random.random((6, 4))[::2, 1:],  # non-contiguous
+        np.zeros((0, 3)),
+        np.array(3.5),
+        np.array([1+2j, 3-1j]),
+    ]
+    for array in arrays:
+        result = roundtrip(codec, array)
+        assert result.dtype == array.dtype
+        assert result.shape == array.shape
+        assert np.array_equal(result, array)
+        result[...] = 0     # arrays should be writable
+    traj = {'ego': np.random.random((1000, 3)), 'times': list(np.linspace(0, 1, 5))}
+    result = roundtrip(codec, traj)
+    assert np.array_equal(result['ego'], traj['ego'])
+    assert result['times'] == traj['times']
+
+def test_binary_samples():
+    carDomain = Struct({
+        'position': Box([-10, 10], [-10, 10]),
+        'heading': Box([0, 3.14]),
+        'model': Categorical('A', 'B', 'C'),
+    })
+    space = FeatureSpace({
+        'weather': Feature(DiscreteBox([0, 12])),
+        'egoCar': Feature(carDomain),
+        'traffic': Feature(Array(carDomain, [2])),
+        'others': Feature(carDomain, lengthDomain=DiscreteBox([0, 3])),
+        'flag': Feature(Constant(True)),
+    })
+    codec = BinaryCodec(space)
+    sampler = FeatureSampler.randomSamplerFor(space)
+    for i in range(20):
+        point = sampler.getSample().staticSample
+        result = roundtrip(codec, point)
+        assert result == point
+        assert type(result) is type(point)
+        assert type(result.weather[0]) is int
+    # without the space, samples are pickled
+    assert roundtrip(BinaryCodec(), point) == point
+    assert roundtrip(DillCodec(), point) == point
+
+def test_negotiation():
+    space = FeatureSpace({'x': Feature(Box([0, 1]))})
+    point = space.makeStaticPoint(x=(0.5,))
+    negotiator = CodecNegotiator(space=space)
+
+    serverCodec, reply = negotiator.accept(hello_message())
+    clientCodec = codec_from_reply(reply)
+    assert type(serverCodec) is BinaryCodec and type(clientCodec) is BinaryCodec
+    data = b''.join(bytes(buf) for buf in _as_buffers(serverCodec.encode(point)))
+    assert clientCodec.decode(data).x == point.x
+
+    serverCodec, reply = negotiator.accept(hello_message(['dill']))
+    assert type(serverCodec) is DillCodec
+    assert type(codec_from_reply(reply)) is DillCodec
+
+    negotiator = CodecNegotiator(preferences=['dill'], space=space)
+    serverCodec, reply = negotiator.accept(hello_message())
+    assert type(codec_from_reply(reply)) is DillCodec
+
+def test_shared_memory():
+    writer, reader = SharedMemoryCodec(size=1 << 16), SharedMemoryCodec()
+    try:
+        for i in range(3):
+            traj = {
+                'small': np.arange(10.0),
+                'large': np.random.random((200, 50)) + i,
+                'larger': np.random.random((500, 100)),    # forces segment to grow
+            }
+            result = roundtrip_with(writer, reader, traj)
+            for key, array in traj.items():
+                assert np.array_equal(result[key], array)
+            assert result['large'].base is not None     # a view, not a copy
+    finally:
+        writer.close()
+        reader.close()
+
+def test_shared_memory_negotiation():
+    negotiator = CodecNegotiator(preferences=['shm', 'binary'])
+    serverCodec, reply = negotiator.accept(hello_message(['shm', 'binary']))
+    assert type(serverCodec) is SharedMemoryCodec
+    assert type(codec_from_reply(reply)) is SharedMemoryCodec
+    serverCodec, reply = negotiator.accept(hello_message())
+    assert type(serverCodec) is BinaryCodec
@@ -68,3 +68,34 @@ def test_save_restore(tmpdir):
     sampler = FeatureSampler.crossEntropySamplerFor(space, ce_params)
 
     checkSaveRestore(sampler, tmpdir, iterations=30)
+
+def test_batch_update():
+    space = FeatureSpace({
+        'a': Feature(DiscreteBox([0, 12])),
+        'b': Feature(Box((0, 1), (-1, 1)))
+    })
+    ce_params = DotMap(alpha=0.8, thres=0)
+    ce_params.cont.buckets = 4
+    ce_params.cont.dist = None
+    ce_params.disc.dist = None
+    sampler1 = FeatureSampler.crossEntropySamplerFor(space, ce_params)
+    sampler2 = FeatureSampler.crossEntropySamplerFor(space, ce_params)
+
+    samples = sampler1.getSamples(50)
+    assert len(samples) == 50
+    rhos = [-1 if sample.b[0] < 0.5 else 1 for sample in samples]
+    completed = sampler1.completeSamples(samples, rhos)
+    assert [sample.staticSample for sample in completed] == \
+           [sample.staticSample for sample in samples]
+
+    # replay the same points through the unbatched update
+    domainSampler = sampler2.domainSamplers[None]
+    for info, length, point in sampler1._id_metadata_dict.values():
+        domainSampler.update(point, info[1], rhos.pop(0))
+
+    batched = sampler1.domainSamplers[None]
+    for d1, d2 in zip(batched.cont_sampler.dist, domainSampler.cont_sampler.dist):
+        assert np.allclose(d1, d2)
+    for d1, d2 in zip(batched.disc_sampler.dist, domainSampler.disc_sampler.dist):
+        assert np.allclose(d1, d2)
+    assert batched.cont_sampler.dist[0][:2].sum() > 0.9
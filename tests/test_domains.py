@@ -22,6 +22,25 @@ def checkFlattening(domain, point, expectedLength=None, coordsAreNumeric=None):
         assert domain.numericizeCoordinate(extractedValue) == value
         if coordsAreNumeric is not None:
             assert domain.coordinateIsNumerical(index) == coordsAreNumeric
+        coord = domain.flatLayout[index]
+        assert coord.meaning() == meaning
+        assert coord.pandasIndex == domain.pandasIndexForFlatCoordinate(index)
+        assert coord.isNumerical == domain.coordinateIsNumerical(index)
+    assert len(domain.flatLayout) == domain.flattenedDimension
+    batch = domain.flattenPoints([point, point])
+    assert batch.shape == (2, domain.flattenedDimension)
+    assert np.array_equal(batch[1], np.array(flat, dtype=float))
+    assert domain.unflattenPoints(batch) == [point, point]
+
+def checkStandardizeArray(domain, points):
+    stand = domain.standardizeArray(points)
+    assert stand.shape[0] == len(points)
+    for point, row in zip(points, stand):
+        assert np.allclose(row, domain.standardize(point))
+    unstand = domain.unstandardizeArray(stand)
+    assert len(unstand) == len(points)
+    for point, value in zip(points, unstand):
+        assert domain.flattenPoints([value]) == pytest.approx(domain.flattenPoints([point]))
 
 ### Constant and Categorical
 
@@ -156,6 +175,8 @@ def test_box_standardize():
             assert 0 <= coord <= 1
         unstand = box.unstandardize(stand)
         assert point == unstand
+    checkStandardizeArray(box, box.uniformPoints(10))
+    assert box.affineStandardization is not None
 
 def test_box_equality():
     dom1 = Box((-3, 5))
@@ -176,6 +197,8 @@ def test_discrete_box_standardize():
             assert left <= coord <= right
         unstand = box.unstandardize(stand)
         assert point == unstand
+    checkStandardizeArray(box, list(box))
+    assert type(box.unstandardizeArray(box.standardizeArray([(0, 1, 2)]))[0][0]) is int
 
 def test_discrete_box_equality():
     dom1 = DiscreteBox((-3, 5))
@@ -291,6 +314,7 @@ def test_array_standardize():
             assert -1 <= coord <= 1
         unstand = array.unstandardize(stand)
         assert point == unstand
+    checkStandardizeArray(array, array.uniformPoints(10))
 
 def test_array_discrete_standardize():
     interval = (-1, 1)
@@ -421,6 +445,7 @@ def test_struct_standardize_continuous():
             assert 0 <= coord <= 1
         unstand = struct.unstandardize(stand)
         assert point == unstand
+    checkStandardizeArray(struct, struct.uniformPoints(10))
 
 def test_struct_standardize_discrete():
     intervals = ((0, 1), (0, 5), (-3, 3))
@@ -438,6 +463,8 @@ def test_struct_standardize_discrete():
             assert left <= coord <= right
         unstand = struct.unstandardize(stand)
         assert point == unstand
+    cars = Array(Struct({ 'box': box, 'model': Categorical('a', 'b') }), (3,))
+    checkStandardizeArray(cars, cars.uniformPoints(10))
 
 def test_struct_standardize_mixed():
     struct = Struct({ 'a': DiscreteBox((0, 1)), 'b': Box((0, 1)) })
@@ -470,6 +497,28 @@ def test_struct_of_structs():
     point = struct2.uniformPoint()
     checkFlattening(struct2, point, expectedLength=5, coordsAreNumeric=True)
 
+def test_uniform_points():
+    car = Struct({
+        'position': Box((-1, 1), (0, 5)),
+        'model': DiscreteBox((0, 3)),
+        'color': Categorical('red', 'blue'),
+        'kind': Constant('car')
+    })
+    domain = Array(car, (2, 3))
+    points = domain.uniformPoints(50)
+    assert len(points) == 50
+    for point in points:
+        assert len(point) == 2 and len(point[0]) == 3
+        for elt in domain.elementsOfPoint(point):
+            assert type(elt) is car.makePoint
+            assert -1 <= elt.position[0] <= 1 and 0 <= elt.position[1] <= 5
+            assert type(elt.model[0]) is int and 0 <= elt.model[0] <= 3
+            assert elt.color in ('red', 'blue')
+            assert elt.kind == 'car'
+        assert domain.unflatten(domain.flatten(point)) == point
+    assert len(set(points)) == 50
+    assert Struct({}).uniformPoints(3) == [Struct({}).makePoint()] * 3
+
 ### Partitioning
 
 def test_partition_primitive():
@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.cluster import MiniBatchKMeans
+
+from verifai.features import *
+from verifai.samplers import FeatureSampler
+from verifai.error_table import error_table
+from verifai.table_io import TableWriter, load_error_table
+
+def make_space():
+    return FeatureSpace({
+        'a': Feature(Box((0, 1), (-1, 1))),
+        'b': Feature(Categorical('x', 'y', 'z')),
+        'c': Feature(Box((0, 1)), lengthDomain=DiscreteBox((0, 2))),
+    })
+
+def fill(table, space, n, rho):
+    sampler = FeatureSampler.randomSamplerFor(space)
+    samples = [sampler.getSample().complete(None) for i in range(n)]
+    for i, sample in enumerate(samples):
+        table.update_error_table(sample, rho(i))
+    return samples
+
+def test_table_contents():
+    space = make_space()
+    table = error_table(space=space)
+    samples = fill(table, space, 50, lambda i: float(i))
+    assert table.num_rows == 50
+    df = table.table
+    assert list(df.columns) == table.column_names
+    assert len(df) == 50
+    assert df['rho'].dtype == np.float64
+    for (_, row), sample in zip(df.iterrows(), samples):
+        flat = space.flatten(sample, fixedDimension=True)
+        for name, value in zip(df.columns, flat):
+            if value is None:
+                assert pd.isna(row[name])
+            else:
+                assert row[name] == value
+    assert table.ignore_locs == sorted(set(table.ignore_locs))
+    assert df is table.table    # cached until the next update
+    fill(table, space, 1, lambda i: 0.0)
+    assert len(table.table) == 51
+    last = table.tail(2)
+    assert list(last.index) == [49, 50]
+    assert last.equals(table.table.tail(2))
+
+def test_multi_objective_columns():
+    space = make_space()
+    table = error_table(space=space)
+    fill(table, space, 3, lambda i: 1.0)
+    fill(table, space, 70, lambda i: (i, bool(i % 2), 2.0))
+    df = table.table
+    assert table.column_names[-3:] == ['rho', 'rho_0', 'rho_1']
+    assert df['rho_0'][:3].isna().all()
+    assert list(df['rho_0'][3:]) == list(range(70))
+    assert list(df['rho_1'][3:]) == [bool(i % 2) for i in range(70)]
+    assert not table.column_type['rho_1']
+    assert (df['rho'] == [1.0]*3 + [2.0]*70).all()
+
+def test_boolean_rho():
+    space = make_space()
+    table = error_table(space=space)
+    fill(table, space, 10, lambda i: i % 3 == 0)
+    assert not table.column_type['rho']
+    assert list(table.table['rho']) == [i % 3 == 0 for i in range(10)]
+
+def test_from_table():
+    space = make_space()
+    table = error_table(space=space)
+    fill(table, space, 20, lambda i: float(i))
+    copy = error_table(table=table.table, column_type=table.column_type)
+    assert copy.num_rows == 20
+    assert copy.table.equals(table.table)
+    names = [f'col{i}' for i in range(len(table.column_names))]
+    table.update_column_names(names)
+    assert list(table.table.columns) == names
+    assert len(table.k_closest_samples(column_names=['col0', 'col1'], k=3)) == 3
+
+@pytest.mark.parametrize('extension', ['csv', 'parquet', 'arrow'])
+def test_table_writer(extension, tmp_path):
+    if extension != 'csv':
+        pytest.importorskip('pyarrow')
+    space = make_space()
+    table = error_table(space=space)
+    path = str(tmp_path / f'table.{extension}')
+    writer = TableWriter(table, path, flush_rows=7, flush_interval=None)
+    sampler = FeatureSampler.randomSamplerFor(space)
+    for i in range(30):
+        table.update_error_table(sampler.getSample().complete(None), float(i))
+        writer.update()
+        assert writer.pending_rows < 7
+    # adding columns rewrites the file
+    for i in range(5):
+        table.update_error_table(sampler.getSample().complete(None), (i % 2 == 0, 1.0))
+        writer.update()
+    writer.close()
+    loaded = load_error_table(path)
+    assert loaded.num_rows == 35
+    assert list(loaded.table.columns) == table.column_names
+    assert list(loaded.table['rho']) == [float(i) for i in range(30)] + [1.0]*5
+    assert loaded.table['rho_0'][:30].isna().all()
+    assert list(loaded.table['rho_0'][30:]) == [i % 2 == 0 for i in range(5)]
+    assert np.allclose(loaded.table.iloc[:, 0], table.table.iloc[:, 0])
+    assert loaded.column_type[table.column_names[0]]
+
+def test_k_closest_samples():
+    rng = np.random.default_rng(0)
+    points = rng.random((300, 3))
+    table = error_table(table=pd.DataFrame(points, columns=['a', 'b', 'c']))
+    numerical, _, _, _ = table.build_normalized()
+    values = numerical.values
+    dists = np.linalg.norm(values[:, np.newaxis] - values[np.newaxis], axis=2)
+    for k in (1, 5):
+        expected = np.argsort(dists, axis=1)[:, :k]
+        sums = np.take_along_axis(dists, expected, axis=1).sum(axis=1)
+        closest = table.k_closest_samples(k=k)
+        assert sorted(closest) == sorted(expected[sums.argmin()])
+        # missing values force a brute-force search
+        missing = pd.DataFrame(points, columns=['a', 'b', 'c'], copy=True)
+        missing.iloc[0, 0] = np.nan
+        missing = error_table(table=missing)
+        assert len(set(missing.k_closest_samples(k=k))) == k
+    approx = table.k_closest_samples(k=5, approximate=True, num_candidates=50)
+    assert len(set(approx)) == 5
+
+def test_k_closest_samples_constant_column(monkeypatch):
+    rng = np.random.default_rng(0)
+    points = rng.random((20000, 3))
+    points[:, 1] = 7
+    def bruteForce(*args):
+        raise AssertionError('constant column forced a brute-force search')
+    monkeypatch.setattr(error_table, '_k_nearest_with_nan', bruteForce)
+    table = error_table(table=pd.DataFrame(points, columns=['a', 'b', 'c']))
+    closest = table.k_closest_samples(k=5)
+    assert len(set(closest)) == 5
+    # the group is the same as without the constant column
+    reduced = error_table(table=pd.DataFrame(points[:, [0, 2]], columns=['a', 'c']))
+    assert sorted(closest) == sorted(reduced.k_closest_samples(k=5))
+    single = error_table(table=pd.DataFrame(points[:, [1]], columns=['b']))
+    assert list(single.k_closest_samples(k=5)) == list(range(5))
+
+def test_online_analysis():
+    space = make_space()
+    table = error_table(space=space)
+    online = table.enable_online_analysis(k=3, n_components=2, batch_size=40)
+    assert 'point.b' not in online.column_names
+    fill(table, space, 30, lambda i: float(i))
+    assert online.clusters() is None
+    fill(table, space, 100, lambda i: float(i))
+    assert online.rows_seen == 130 and online.rows_fitted == 120
+    expected = table.table[online.column_names].describe()
+    for stat in ('count', 'mean', 'std', 'min', 'max'):
+        assert np.allclose(online.stats.loc[stat], expected.loc[stat])
+    clusters = online.clusters()['clusters']
+    assert len(clusters) == 3
+    for center in clusters.values():
+        assert len(center) == len(online.column_names)
+    pca = online.principal_components()
+    assert pca['directions'].shape == (2, len(online.column_names))
+    online.update(force=True)
+    assert online.rows_fitted == 130
+    assert len(online.labels()) == 130
+    assert set(table.analyze().online.keys()) == {'stats', 'k_clusters', 'pca'}
+
+def test_online_analysis_growing_range():
+    # the normalization changes when the outliers arrive: the centers found
+    # so far must be converted, giving the same clusters as in raw units
+    space = FeatureSpace({'x': Feature(Box((0, 2000)))})
+    table = error_table(space=space)
+    online = table.enable_online_analysis(column_names=['point.x[0]'], k=3,
+                                          batch_size=30)
+    reference = MiniBatchKMeans(n_clusters=3, random_state=0, n_init=3)
+    batches = ([0.0, 5.0, 10.0] * 10, [0.0, 5.0, 10.0] * 9 + [1000.0] * 3)
+    for batch in batches:
+        for value in batch:
+            point = space.makeStaticPoint(x=(value,))
+            table.update_error_table(CompletedSample(point, (), space, {}), 0.0)
+        reference.partial_fit(np.array(batch).reshape(-1, 1))
+        centers = sorted(c[0] for c in online.clusters()['clusters'].values())
+        assert np.allclose(centers, sorted(reference.cluster_centers_[:, 0]))
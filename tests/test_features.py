@@ -1,3 +1,7 @@
+import dill
+import numpy as np
+import pytest
+
 from verifai.features import *
 from verifai.samplers import FeatureSampler
 
@@ -129,6 +133,111 @@ def test_fs_flatten_fixed_dimension_dynamic():
     assert space.pandasIndexForFlatCoordinate(4) == ('b', 1, 0)
     assert all(space.coordinateIsNumerical(i) for i in range(4))
 
+def test_fs_flat_layout():
+    car = Struct({
+        'position': Array(Box((-1, 1)), [2]),
+        'model': Categorical('sedan', 'truck'),
+    })
+    space = FeatureSpace({
+        'a': Feature(DiscreteBox([0, 12])),
+        'cars': Feature(car, lengthDomain=DiscreteBox((0, 2))),
+        'b': TimeSeriesFeature(Box((0, 1)), lengthDomain=DiscreteBox((0, 2))),
+        'c': TimeSeriesFeature(car),
+        },
+        timeBound=3
+    )
+    layout = space.flatLayout
+    assert len(layout) == space.fixedFlattenedDimension
+    assert layout[0] == FlatCoordinate('', '.a[0]', ('a', 0), True, space.featureNamed['a'].domain)
+    assert layout[1].meaning('p') == 'len(p.cars)'
+    assert layout[1].pandasIndex == ('cars', 'length')
+    assert layout[2].meaning() == 'point.cars[0].model'
+    assert layout[2].pandasIndex == ('cars', 0, 'model')
+    assert not layout[2].isNumerical
+    assert layout[5].meaning() == 'point.cars[1].model'
+    assert layout[8].meaning() == 'len(point.dynamicSampleHistory)'
+    assert layout[9].meaning() == 'point.dynamicSampleLengths["b"]'
+    assert layout[12].meaning() == 'point.b[1][0][0]'
+    assert layout[16].meaning() == 'point.c[0].model'
+    assert layout[19].meaning() == 'point.c[1].model'
+    assert layout[-1].meaning() == 'point.c[2].position[1][0]'
+    assert layout[-1].domain is car.domainNamed['position'].domain
+    for index, coord in enumerate(layout):
+        assert space.meaningOfFlatCoordinate(index) == coord.meaning()
+        assert space.pandasIndexForFlatCoordinate(index) == coord.pandasIndex
+        assert space.coordinateIsNumerical(index) == coord.isNumerical
+
+def test_fs_compact_sample():
+    car = Struct({
+        'position': Array(Box((-1, 1)), [2, 3]),
+        'model': Categorical('sedan', 'truck'),
+        'lane': DiscreteBox((0, 3)),
+    })
+    space = FeatureSpace({
+        'a': Feature(DiscreteBox([0, 12])),
+        'cars': Feature(car, lengthDomain=DiscreteBox((0, 3))),
+        'b': TimeSeriesFeature(car, lengthDomain=DiscreteBox((0, 2))),
+        'c': TimeSeriesFeature(Box((0, 1))),
+        },
+        timeBound=4
+    )
+    sampler = FeatureSampler.randomSamplerFor(space)
+    for i in range(50):
+        point = sampler.getSample()
+        duration = random.randint(0, 4)
+        for _ in range(duration):
+            point.getDynamicSample()
+        point = point.complete(None)
+        compact = space.compactSample(point)
+        assert compact.expand() == point
+        assert compact == space.compactSample(point)
+        assert hash(compact) == hash(space.compactSample(point))
+        assert dill.loads(dill.dumps(compact)) == compact
+        assert compact.a == point.a
+        assert type(compact.a[0]) is int
+        assert compact.cars == point.cars
+        assert len(compact.cars) == len(point.cars)
+        for car, expected in zip(compact.cars, point.cars):
+            assert car.model == expected.model
+            assert car.position[1][2] == expected.position[1][2]
+            assert car.position[-1] == expected.position[-1]
+        assert len(compact.b) == duration
+        assert list(compact.b) == list(point.b)
+        assert list(compact.c) == list(point.c)
+        assert space.flatten(compact) == space.flatten(point)
+    with pytest.raises(IndexError):
+        compact.c[duration]
+
+def test_fs_flatten_batch():
+    car = Struct({
+        'position': Array(Box((-1, 1)), [2]),
+        'model': Categorical('sedan', 'truck'),
+        'lane': DiscreteBox((0, 3)),
+    })
+    space = FeatureSpace({
+        'a': Feature(DiscreteBox([0, 12])),
+        'b': Feature(Box((0, 1)), lengthDomain=DiscreteBox((0, 2))),
+        'cars': Feature(car, lengthDomain=DiscreteBox((1, 3))),
+        'weather': Feature(Categorical('sun', 'rain')),
+    })
+    sampler = FeatureSampler.randomSamplerFor(space)
+    points = [sampler.getSample().complete(None) for i in range(100)]
+    batch = space.flattenBatch(points)
+    assert batch.shape == (100, space.fixedFlattenedDimension)
+    for point, row, rowMask in zip(points, batch.data, batch.mask):
+        flat = space.flatten(point, fixedDimension=True)
+        for value, coord, masked in zip(flat, row, rowMask):
+            assert masked == (value is None)
+            if value is None:
+                assert np.isnan(coord)
+            else:
+                assert coord == value
+    unflat = space.unflattenBatch(batch)
+    assert unflat == points
+    assert type(unflat[0].a[0]) is int
+    assert space.unflattenBatch(batch.filled(0)) == points
+    assert space.flattenBatch([]).shape == (0, space.fixedFlattenedDimension)
+
 def test_fs_utilities():
     space = FeatureSpace({
         'a': Feature(DiscreteBox([0, 12])),
@@ -148,6 +257,27 @@ def test_fs_utilities():
         hash(point)
         assert all(0 <= point.b[i][0][0] <= 1 for i in range(duration))
 
+def test_fs_domains_cache():
+    space = FeatureSpace({
+        'a': Feature(Box((0, 1)), lengthDomain=DiscreteBox((0, 3))),
+        'b': Feature(DiscreteBox((0, 1)), lengthDomain=DiscreteBox((1, 2))),
+        },
+        maxCachedDomains=2
+    )
+    lengthDomain, domains = space.domains
+    assert len(domains) == 8
+    assert set(domains) == set(lengthDomain)
+    first = domains[((0,), (1,))]
+    domains[((1,), (1,))]
+    assert domains[((0,), (1,))] is first
+    domains[((2,), (1,))]   # evicts ((1,), (1,))
+    assert set(domains.computed) == {((0,), (1,)), ((2,), (1,))}
+    assert domains[((1,), (1,))] == Struct({
+        'a': Array(Box((0, 1)), (1,)), 'b': Array(DiscreteBox((0, 1)), (1,))
+    })
+    with pytest.raises(KeyError):
+        domains[((4,), (1,))]
+
 def test_fs_distance():
     box = Box([0, 10])
     space = FeatureSpace({ 'a': Feature(box), 'b': Feature(box) })
@@ -158,3 +288,42 @@ def test_fs_distance():
     assert space.distance(pointA, pointA) == 0
     assert space.distance(pointB, pointB) == 0
     assert space.distance(pointA, pointB) != 0
+
+def test_fs_pairwise_distances():
+    car = Struct({
+        'position': Array(Box((-1, 1), (0, 2)), (2, 3)),
+        'model': Categorical('a', 'b', 'c'),
+        'lane': DiscreteBox((0, 3)),
+    })
+    space = FeatureSpace({
+        'a': Feature(DiscreteBox([0, 12])),
+        'car': Feature(car),
+        'w': Feature(Box((0, 1)), distanceMetric=lambda a, b: 5 * abs(a[0] - b[0])),
+        'cars': Feature(Box((0, 1)), lengthDomain=DiscreteBox((2, 2))),
+    })
+    sampler = FeatureSampler.randomSamplerFor(space)
+    samplesA = [sampler.getSample().complete(None) for i in range(15)]
+    samplesB = [sampler.getSample().complete(None) for i in range(10)]
+    distances = space.pairwiseDistances(samplesA, samplesB)
+    assert distances.shape == (15, 10)
+    for i, sampleA in enumerate(samplesA):
+        for j, sampleB in enumerate(samplesB):
+            expected = space.distance(sampleA.staticSample, sampleB.staticSample)
+            assert distances[i, j] == pytest.approx(expected)
+    points = [sample.staticSample for sample in samplesA]
+    assert np.allclose(space.pairwiseDistances(points, points).diagonal(), 0)
+
+    indices, nearest = space.nearestNeighbors(samplesA[0], samplesB, k=3)
+    assert len(indices) == len(nearest) == 3
+    assert list(nearest) == sorted(distances[0])[:3]
+    assert list(distances[0][indices]) == list(nearest)
+
+def test_fs_pairwise_distances_custom_metric():
+    space = FeatureSpace({ 'a': Feature(Box([0, 10])), 'b': Feature(Box([0, 10])) },
+                         distanceMetric=max)
+    sampler = FeatureSampler.randomSamplerFor(space)
+    points = [sampler.getSample().staticSample for i in range(5)]
+    distances = space.pairwiseDistances(points, points[:2])
+    for i, point in enumerate(points):
+        for j, other in enumerate(points[:2]):
+            assert distances[i, j] == pytest.approx(space.distance(point, other))
@@ -35,3 +35,17 @@ def test_save_restore(tmpdir):
     sampler = FeatureSampler.haltonSamplerFor(space, halton_params)
 
     checkSaveRestore(sampler, tmpdir)
+
+def test_batch_matches_sequential():
+    space = FeatureSpace({
+        'a': Feature(Box((0, 1), (-5, 5))),
+        'b': Feature(Array(Box((0, 2)), [3]))
+    })
+    halton_params = DotMap(sample_index=0, bases_skipped=0)
+    sampler1 = FeatureSampler.haltonSamplerFor(space, halton_params)
+    sampler2 = FeatureSampler.haltonSamplerFor(space, halton_params)
+
+    batch = sampler1.completeSamples(sampler1.getSamples(20), [0] * 20)
+    single = [sampler2.getSample().complete(0) for i in range(20)]
+    assert batch == single
+    assert sampler1.getSample().complete(0) == sampler2.getSample().complete(0)
@@ -0,0 +1,74 @@
+import csv
+import json
+import threading
+
+import numpy as np
+from dotmap import DotMap
+
+from verifai.features import *
+from verifai.client import Client
+from verifai.falsifier import generic_falsifier
+from verifai.instrumentation import Instrumentation
+from verifai.monitor import specification_monitor
+
+def test_summary(tmp_path):
+    instrumentation = Instrumentation()
+    for i in range(1, 101):
+        instrumentation.record('sample', i / 1000)
+    with instrumentation.phase('monitor'):
+        pass
+    summary = instrumentation.summary()
+    assert list(summary) == ['sample', 'monitor']
+    stats = summary['sample']
+    assert stats['count'] == 100
+    assert np.isclose(stats['total'], 5.05)
+    assert stats['min'] == 0.001 and stats['max'] == 0.1
+    assert np.isclose(stats['p50'], 0.0505)
+    counts, edges = instrumentation.histogram('sample', bins=10)
+    assert list(counts) == [10] * 10
+
+    mark = instrumentation.mark()
+    instrumentation.record('sample', 1)
+    assert instrumentation.summary(since=mark)['sample']['count'] == 1
+    assert 'monitor' not in instrumentation.summary(since=mark)
+
+    json_path = tmp_path / 'timings.json'
+    instrumentation.write_json(json_path, bins=5)
+    data = json.loads(json_path.read_text())
+    assert data['sample']['count'] == 101
+    assert sum(data['sample']['histogram']['counts']) == 101
+
+    csv_path = tmp_path / 'timings.csv'
+    instrumentation.write_csv(csv_path)
+    with open(csv_path) as infile:
+        rows = list(csv.DictReader(infile))
+    assert [row['phase'] for row in rows] == ['sample', 'monitor']
+    instrumentation.write_csv(csv_path, raw=True)
+    with open(csv_path) as infile:
+        assert len(list(csv.reader(infile))) == 1 + 101 + 1
+
+class EchoClient(Client):
+    def simulate(self, sample):
+        return sample.x[0] - 0.5
+
+def test_server_phases():
+    instrumentation = Instrumentation()
+    space = {'x': Box((0, 1))}
+    monitor = specification_monitor(lambda traj: traj)
+    options = DotMap(port=0, persistent=True, instrumentation=instrumentation)
+    falsifier = generic_falsifier(sample_space=space, monitor=monitor,
+                                  falsifier_params=DotMap(n_iters=20),
+                                  server_options=options)
+    client = EchoClient(falsifier.server.port, 4096, persistent=True)
+    def loop():
+        while client.run_client():
+            pass
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    summary = falsifier.timing_summary
+    for phase in ('sample', 'encode', 'send', 'simulate', 'decode', 'monitor',
+                  'complete', 'record'):
+        assert summary[phase]['count'] == 20
+    assert summary['accept']['count'] == 1
@@ -2,9 +2,13 @@ import math
 import itertools
 import os.path
 
-from verifai.features import (Struct, Array, Box, DiscreteBox,
+import pytest
+
+from verifai.features import (Struct, Array, Box, DiscreteBox, FilteredDomain,
                               Feature, TimeSeriesFeature, FeatureSpace)
-from verifai.samplers import RandomSampler, FeatureSampler
+from verifai.samplers import (RandomSampler, RejectionSampler, FeatureSampler,
+                              LateFeatureSampler)
+from verifai.samplers.domain_sampler import SamplingError
 
 def test_feature_sampling():
     space = FeatureSpace({
@@ -118,3 +122,123 @@ def test_random_restore(tmpdir):
     sampler = FeatureSampler.restoreFromFile(path)
     sample2 = sampler.getSample().complete(0)
     assert sample1 == sample2
+
+def test_lazy_domain_samplers():
+    # 11^5 combinations of lengths: too many to create samplers for upfront
+    space = FeatureSpace({
+        f'l{i}': Feature(Box((0, 1)), lengthDomain=DiscreteBox((0, 10)))
+        for i in range(5)
+    })
+    lengthDomain, domains = space.domains
+    assert len(domains) == 11**5
+    lengths = lengthDomain.makePoint(*[(i,) for i in range(5)])
+    assert lengths in domains
+    assert lengthDomain.makePoint(*[(11,)] * 5) not in domains
+    assert domains[lengths] is domains[lengths]
+    assert domains[lengths].domainNamed['l3'] == Array(Box((0, 1)), (3,))
+
+    sampler = LateFeatureSampler(space, RandomSampler, RandomSampler,
+                                 maxCachedSamplers=10)
+    assert len(sampler.domainSamplers.computed) == 0
+    samples = [sampler.getSample() for i in range(50)]
+    assert len(sampler.domainSamplers.computed) == 10
+    for sample in samples:
+        assert all(0 <= v[0] <= 1 for v in sample.l0)
+        sample.complete(0)
+
+def test_lazy_time_series():
+    space = FeatureSpace({
+        'a': Feature(DiscreteBox([0, 12])),
+        'c': TimeSeriesFeature(Box((2, 5))),
+        'd': TimeSeriesFeature(Box((5, 6)), lengthDomain=DiscreteBox((0, 2)))
+        }, timeBound=10000)
+    sampler = FeatureSampler.randomSamplerFor(space, lazyTimeSeries=True)
+    assert sampler.lazyTimeSeries
+    for i in range(20):
+        sample = sampler.getSample()
+        assert 0 <= sample.a[0] <= 12
+        length = sample.dynamicSampleLengths['d']
+        for t in range(5):
+            point = sample.getDynamicSample()
+            assert 2 <= point.c[0] <= 5
+            assert len(point.d) == length
+            assert all(5 <= v[0] <= 6 for v in point.d)
+        completed = sample.complete(0)
+        assert len(completed.dynamicSamples) == 5
+        assert len(completed.c) == 5
+    assert not sampler._time_step_draws
+
+    # time steps are never expanded to the time bound
+    lengthDomain, domains = space.staticDomains
+    assert all(set(domain.domainNamed) == {'a'} for domain in domains.values())
+
+def test_batch_sampling():
+    space = FeatureSpace({
+        'a': Feature(DiscreteBox([0, 12])),
+        'b': Feature(Box((0, 1)), lengthDomain=DiscreteBox((0, 2))),
+        'c': Feature(Array(Box((-1, 1)), [2, 2]))
+    })
+    for sampler in (FeatureSampler.randomSamplerFor(space),
+                    FeatureSampler.haltonSamplerFor(space),
+                    FeatureSampler.multiArmedBanditSamplerFor(space),
+                    FeatureSampler.epsilonGreedySamplerFor(space)):
+        samples = sampler.getSamples(100)
+        assert len(samples) == 100
+        for sample in samples:
+            assert type(sample.a[0]) is int
+            assert 0 <= sample.a[0] <= 12
+            assert 0 <= len(sample.b) <= 2
+            assert all(0 <= v[0] <= 1 for v in sample.b)
+            assert len(sample.c) == 2 and len(sample.c[0]) == 2
+            assert all(-1 <= v[0] <= 1 for row in sample.c for v in row)
+        assert any(len(sample.b) == 0 for sample in samples)
+        assert any(len(sample.b) == 2 for sample in samples)
+        completed = sampler.completeSamples(samples, [0] * len(samples))
+        assert len(completed) == 100
+        hash(completed[0])
+
+## Rejection sampling
+
+def inDisk(point):
+    return point[0]**2 + point[1]**2 < 0.16
+
+def test_rejection_batched():
+    disk = FilteredDomain(Box((0, 1), (0, 1)), inDisk,
+                          batchFilter=lambda a: a[:, 0]**2 + a[:, 1]**2 < 0.16)
+    for domain in (disk, FilteredDomain(Box((0, 1), (0, 1)), inDisk),
+                   Struct({ 'a': disk, 'b': Array(disk, (2,)) })):
+        sampler = RejectionSampler(RandomSampler(domain))
+        assert sampler.batched
+        assert sampler.acceptanceRate is None
+        points = [sampler.getSample()[0] for i in range(100)]
+        points += sampler.getSamples(100)[0]
+        for point in points:
+            if isinstance(domain, Struct):
+                assert inDisk(point.a) and all(inDisk(elt) for elt in point.b)
+            else:
+                assert type(point) is tuple
+                assert inDisk(point)
+        assert 0 < sampler.acceptanceRate < 0.2
+        assert len(domain.uniformPoints(10)) == 10
+
+def test_rejection_batched_spec():
+    class Spec:
+        def isSatisfiedBy(self, point):
+            return point[0] < 0.1
+    class BatchSpec(Spec):
+        def areSatisfiedBy(self, points):
+            return [point[0] < 0.1 for point in points]
+    for spec in (Spec(), BatchSpec()):
+        for batched in (False, True):
+            sampler = RejectionSampler(RandomSampler(Box((0, 1))), spec=spec,
+                                       batched=batched)
+            assert all(sampler.getSample()[0][0] < 0.1 for i in range(100))
+            assert 0.05 < sampler.acceptanceRate < 0.2
+
+def test_rejection_limit():
+    domain = FilteredDomain(Box((0, 1)), lambda point: False)
+    for batched in (False, True):
+        sampler = RejectionSampler(RandomSampler(domain), batched=batched)
+        with pytest.raises(SamplingError):
+            sampler.getSample()
+        assert sampler.acceptanceRate == 0
@@ -0,0 +1,370 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+from dotmap import DotMap
+
+from verifai.features import *
+from verifai.samplers import FeatureSampler
+from verifai.server import Server, MultiClientServer, AsyncServer
+from verifai.client import Client, AsyncClient
+from verifai.falsifier import generic_falsifier, resume_falsifier
+from verifai.monitor import specification_monitor
+from verifai.table_io import read_table
+
+## Utilities
+
+class EchoClient(Client):
+    """Client whose simulation result is just the value of the feature x."""
+    def simulate(self, sample):
+        return sample.x[0] - 0.5
+
+def identityMonitor():
+    return specification_monitor(lambda traj: traj)
+
+def runClient(client):
+    def loop():
+        try:
+            while client.run_client():
+                pass
+        except RuntimeError:    # server went away between one-shot samples
+            pass
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+def makeFalsifier(n_iters=20, **options):
+    space = {'x': Box((0, 1))}
+    server_options = DotMap(port=0, **options)
+    params = DotMap(n_iters=n_iters, save_safe_table=True)
+    return generic_falsifier(sample_space=space, monitor=identityMonitor(),
+                             falsifier_params=params,
+                             server_options=server_options)
+
+## Tests
+
+def test_one_shot():
+    falsifier = makeFalsifier(n_iters=5)
+    thread = runClient(EchoClient(falsifier.server.port, 4096))
+    falsifier.run_falsifier()
+    assert len(falsifier.samples) == 5
+    table_rows = len(falsifier.error_table.table) + len(falsifier.safe_table.table)
+    assert table_rows == 5
+    thread.join(timeout=5)
+
+def test_table_files(tmp_path):
+    space = {'x': Box((0, 1))}
+    params = DotMap(n_iters=10, table_flush_rows=3,
+                    error_table_path=str(tmp_path / 'error.csv'),
+                    safe_table_path=str(tmp_path / 'safe.csv'))
+    falsifier = generic_falsifier(sample_space=space, monitor=identityMonitor(),
+                                  falsifier_params=params,
+                                  server_options=DotMap(port=0, persistent=True))
+    thread = runClient(EchoClient(falsifier.server.port, 4096, persistent=True))
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    for table, name in ((falsifier.error_table, 'error'), (falsifier.safe_table, 'safe')):
+        saved = read_table(str(tmp_path / f'{name}.csv'))
+        assert len(saved) == table.num_rows
+        assert np.allclose(saved['rho'], table.table['rho'])
+
+def test_compact_samples(tmp_path):
+    space = {'x': Box((0, 1))}
+    params = DotMap(n_iters=10, compact_samples=True,
+                    history_path=str(tmp_path / 'history.dat'))
+    falsifier = generic_falsifier(sample_space=space, monitor=identityMonitor(),
+                                  falsifier_params=params,
+                                  server_options=DotMap(port=0, persistent=True))
+    thread = runClient(EchoClient(falsifier.server.port, 4096, persistent=True))
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    assert len(falsifier.samples) == 10
+    for i in range(10):
+        sample = falsifier.samples[i]
+        assert isinstance(sample, CompactSample)
+        assert 0 <= sample.x[0] <= 1
+    assert falsifier.error_table.num_rows + falsifier.safe_table.num_rows == 10
+
+def test_streaming(tmp_path):
+    seen = []
+    space = {'x': Box((0, 1))}
+    params = DotMap(n_iters=100, streaming=True, ce_num_max=3,
+                    sinks=[lambda sample, rho, ce: seen.append((rho, ce))],
+                    history_path=str(tmp_path / 'history.dat'))
+    falsifier = generic_falsifier(sample_space=space, monitor=identityMonitor(),
+                                  falsifier_params=params,
+                                  server_options=DotMap(port=0, persistent=True))
+    thread = runClient(EchoClient(falsifier.server.port, 4096, persistent=True))
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    # the run stops as soon as the third counterexample is found
+    assert falsifier.error_table.num_rows == 3
+    assert len(falsifier.samples) == len(seen) == falsifier.num_results
+    assert seen[-1][1] and sum(ce for rho, ce in seen) == 3
+    assert len(falsifier.safe_table.table) == len(seen) - 3
+    for i, (rho, ce) in enumerate(seen):
+        assert abs(falsifier.samples[i].x[0] - 0.5 - rho) < 1e-9
+
+    falsifier.init_server(DotMap(port=0, persistent=True), Server)
+    falsifier.ce_num_max = np.inf
+    falsifier.stop_condition = lambda sample, rho: rho > 0.4
+    thread = runClient(EchoClient(falsifier.server.port, 4096, persistent=True))
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    last = falsifier.samples[len(falsifier.samples) - 1]
+    assert last.x[0] - 0.5 > 0.4
+
+class Interruption(Exception):
+    pass
+
+interruptions = []
+
+def interruptOnce():
+    if not interruptions:
+        interruptions.append(True)
+        raise Interruption
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_checkpoint_resume(streaming, tmp_path):
+    interruptions.clear()
+    space = {'x': Box((0, 1))}
+    params = DotMap(n_iters=30, streaming=streaming, checkpoint_path=str(tmp_path),
+                    checkpoint_results=4)
+    falsifier = generic_falsifier(sample_space=space, monitor=identityMonitor(),
+                                  falsifier_params=params,
+                                  server_options=DotMap(port=0, persistent=True))
+    getSample = falsifier.server.get_sample
+    def interruptingGetSample():
+        if len(falsifier.samples) == 17:
+            interruptOnce()
+        return getSample()
+    falsifier.server.get_sample = interruptingGetSample
+    thread = runClient(EchoClient(falsifier.server.port, 4096, persistent=True))
+    with pytest.raises(Interruption):
+        falsifier.run_falsifier()
+    thread.join(timeout=5)
+
+    resumed = resume_falsifier(str(tmp_path))
+    assert resumed.num_results == 17
+    assert len(resumed.samples) == 17
+    assert resumed.error_table.num_rows + resumed.safe_table.num_rows == (17 if streaming else 0)
+    thread = runClient(EchoClient(resumed.server.port, 4096, persistent=True))
+    resumed.run_falsifier()
+    thread.join(timeout=5)
+    assert resumed.num_results == len(resumed.samples) == 30
+    assert resumed.error_table.num_rows + resumed.safe_table.num_rows == 30
+    for i in range(17):
+        assert resumed.samples[i] == falsifier.samples[i]
+    for _, row in resumed.error_table.table.iterrows():
+        assert row['rho'] <= 0
+
+    again = resume_falsifier(str(tmp_path))     # finished run is not continued
+    assert again.num_results == 30
+    assert again.error_table.table.equals(resumed.error_table.table)
+    again.server.terminate()
+
+def test_persistent():
+    falsifier = makeFalsifier(persistent=True)
+    client = EchoClient(falsifier.server.port, 4096, persistent=True)
+    thread = runClient(client)
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert client.socket is None
+    assert len(falsifier.samples) == 20
+    for _, row in falsifier.error_table.table.iterrows():
+        assert row['rho'] <= 0
+        assert abs(row['rho'] - (row.iloc[0] - 0.5)) < 1e-9
+
+def test_multi_client():
+    import random
+    import time
+
+    class SlowClient(EchoClient):
+        def simulate(self, sample):
+            time.sleep(random.uniform(0, 0.01))
+            return super().simulate(sample)
+
+    falsifier = generic_falsifier(
+        sample_space={'x': Box((0, 1))}, monitor=identityMonitor(),
+        falsifier_params=DotMap(n_iters=60),
+        server_options=DotMap(port=0, max_in_flight=3),
+        server_class=MultiClientServer)
+    port = falsifier.server.port
+    clients = [SlowClient(port, 4096, persistent=True) for i in range(4)]
+    threads = [runClient(client) for client in clients]
+    falsifier.run_falsifier()
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+    assert len(falsifier.samples) == 60
+    tables = (falsifier.error_table.table, falsifier.safe_table.table)
+    assert sum(len(table) for table in tables) == 60
+    for table in tables:
+        for _, row in table.iterrows():
+            assert abs(row['rho'] - (row.iloc[0] - 0.5)) < 1e-9
+
+def test_multi_client_exhausted_sampler():
+    space = FeatureSpace({'x': Feature(DiscreteBox((0, 9)))})
+    falsifier = generic_falsifier(
+        sampler=FeatureSampler.gridSamplerFor(space), monitor=identityMonitor(),
+        falsifier_params=DotMap(n_iters=None),
+        server_options=DotMap(port=0), server_class=MultiClientServer)
+    thread = runClient(EchoClient(falsifier.server.port, 4096, persistent=True))
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert sorted(sample.x[0] for sample in falsifier.samples.values()) == list(range(10))
+
+class AsyncEchoClient(AsyncClient):
+    def __init__(self, port, delay=0):
+        super().__init__(port)
+        self.delay = delay
+        self.handled = 0
+
+    async def simulate(self, sample):
+        await asyncio.sleep(self.delay)
+        self.handled += 1
+        return sample.x[0] - 0.5
+
+def makeAsyncFalsifier(n_iters, **options):
+    return generic_falsifier(
+        sample_space={'x': Box((0, 1))}, monitor=identityMonitor(),
+        falsifier_params=DotMap(n_iters=n_iters),
+        server_options=DotMap(port=0, **options), server_class=AsyncServer)
+
+def test_async():
+    falsifier = makeAsyncFalsifier(40)
+    port = falsifier.server.port
+    clients = [AsyncEchoClient(port, delay=0.001 * i) for i in range(4)]
+    threaded = EchoClient(port, 4096, persistent=True)
+    thread = runClient(threaded)
+
+    async def main():
+        tasks = [asyncio.ensure_future(client.run()) for client in clients]
+        await falsifier.run_falsifier_async()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+    asyncio.run(main())
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert len(falsifier.samples) == 40
+    tables = (falsifier.error_table.table, falsifier.safe_table.table)
+    assert sum(len(table) for table in tables) == 40
+    for table in tables:
+        for _, row in table.iterrows():
+            assert abs(row['rho'] - (row.iloc[0] - 0.5)) < 1e-9
+
+def test_async_timeout():
+    falsifier = makeAsyncFalsifier(10, timeout=0.2)
+    port = falsifier.server.port
+    stuck = AsyncEchoClient(port, delay=60)
+    fast = AsyncEchoClient(port)
+
+    async def main():
+        stuck_task = asyncio.ensure_future(stuck.run())
+        await asyncio.sleep(0.05)   # make sure the stuck client gets a sample
+        fast_task = asyncio.ensure_future(fast.run())
+        await falsifier.run_falsifier_async()
+        await asyncio.wait_for(fast_task, 5)
+        stuck_task.cancel()
+    asyncio.run(main())
+    assert len(falsifier.samples) == 10
+    assert fast.handled == 10
+    assert falsifier.server.discarded == 0
+
+def test_shared_memory_codec():
+    import numpy as np
+
+    class TrajectoryClient(Client):
+        def simulate(self, sample):
+            return np.full((200, 100), sample.x[0])
+
+    monitor = specification_monitor(lambda traj: float(traj.mean()) - 0.5)
+    codecs = ('shm', 'binary')
+    falsifier = generic_falsifier(
+        sample_space={'x': Box((0, 1))}, monitor=monitor,
+        falsifier_params=DotMap(n_iters=10),
+        server_options=DotMap(port=0, persistent=True, codecs=codecs))
+    client = TrajectoryClient(falsifier.server.port, 4096, persistent=True,
+                              codecs=codecs)
+    thread = runClient(client)
+    falsifier.run_falsifier()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert len(falsifier.samples) == 10
+    assert client.codec.name == 'shm'
+    for _, row in falsifier.error_table.table.iterrows():
+        assert abs(row['rho'] - (row.iloc[0] - 0.5)) < 1e-9
+
+def simulateX(sample):
+    return sample.x[0] - 0.5
+
+def test_parallel_server():
+    from verifai.falsifier import generic_parallel_falsifier
+    server_options = DotMap(num_workers=3, simulator=simulateX)
+    falsifier = generic_parallel_falsifier(
+        sample_space={'x': Box((0, 1))}, monitor=identityMonitor(),
+        falsifier_params=DotMap(n_iters=30, save_safe_table=True),
+        server_options=server_options)
+    falsifier.run_falsifier()
+    assert len(falsifier.samples) == 30
+    tables = (falsifier.error_table.table, falsifier.safe_table.table)
+    assert sum(len(table) for table in tables) == 30
+    for table in tables:
+        for _, row in table.iterrows():
+            assert abs(row['rho'] - (row.iloc[0] - 0.5)) < 1e-9
+    for worker in falsifier.server.workers:
+        assert not worker.process.is_alive()
+
+def test_parallel_checkpoint_resume(tmp_path):
+    from verifai.falsifier import generic_parallel_falsifier
+    interruptions.clear()
+    params = DotMap(n_iters=30, checkpoint_path=str(tmp_path), checkpoint_results=4)
+    falsifier = generic_parallel_falsifier(
+        sample_space={'x': Box((0, 1))}, monitor=identityMonitor(),
+        falsifier_params=params,
+        server_options=DotMap(num_workers=3, simulator=simulateX))
+    getSample = falsifier.server.get_sample
+    def interruptingGetSample():
+        if len(falsifier.samples) >= 17:
+            interruptOnce()
+        return getSample()
+    falsifier.server.get_sample = interruptingGetSample
+    with pytest.raises(Interruption):
+        falsifier.run_falsifier()
+    done = falsifier.num_results
+    assert 17 <= done < 30
+    # checkpoints were saved during the run, not only when it was interrupted
+    assert len(list(falsifier.checkpointer.read_deltas())) > done // 4
+
+    resumed = resume_falsifier(str(tmp_path))
+    assert resumed.num_results == len(resumed.samples) == done
+    assert resumed.error_table.num_rows + resumed.safe_table.num_rows == done
+    resumed.run_falsifier()
+    assert resumed.num_results == len(resumed.samples) == 30
+    assert resumed.error_table.num_rows + resumed.safe_table.num_rows == 30
+    for i in range(done):
+        assert resumed.samples[i] == falsifier.samples[i]
+    for worker in resumed.server.workers:
+        assert not worker.process.is_alive()
+
+def test_worker_process_errors():
+    from verifai.workers import WorkerProcess
+    import pytest
+
+    class Divider:
+        def __init__(self, numerator):
+            self.numerator = numerator
+        def divide(self, denominator):
+            return self.numerator / denominator
+
+    worker = WorkerProcess(Divider, 6, context='spawn')
+    try:
+        assert worker.call('divide', 3) == 2
+        with pytest.raises(ZeroDivisionError):
+            worker.call('divide', 0)
+        assert worker.call('divide', 2) == 3
+    finally:
+        worker.close()
+    assert not worker.process.is_alive()